@@ -1,7 +1,60 @@
 import time
 import operator
+from collections import namedtuple
+from functools import partial
 import padKontrol as pk
 import midi_ports as mp
+import latency
+from midi_event import EventType
+
+_PRESSED = (pk.NOTE_ON, 1)
+_CONTROL_BITS = 7  # dispatch table index: event type << 7 | control
+
+
+def route(event_type, *controls, **kwargs):
+    """State method decorator:
+    Register method as handler of event type for given controls
+    (or all controls of the type, if none given).
+
+    Arguments:
+        event_type {EventType} -- handled event type
+        controls {int} -- handled controls
+
+    Keyword Arguments:
+        passed to handler with every routed event
+    """
+
+    def wrapper(func):
+        routes = getattr(func, "_routes", [])
+        func._routes = routes + [(event_type, controls, kwargs)]
+        return func
+
+    return wrapper
+
+
+class Combo(namedtuple("Combo", ["controls", "ordered", "window"])):
+    """Hotkey combination, may be used as combinations dictionary key
+    instead of frozenset.
+
+    Arguments:
+        controls {iterable} -- combined controls (in press order for ordered combo)
+
+    Keyword Arguments:
+        ordered {bool} -- controls must be pressed in given order (default: {False})
+        window {float} -- max seconds between first and last press (default: {None})
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, controls, ordered=False, window=None):
+        return super(Combo, cls).__new__(cls, tuple(controls), ordered, window)
+
+    @property
+    def mask(self):
+        mask = 0
+        for control in self.controls:
+            mask |= 1 << control
+        return mask
 
 
 class State:
@@ -13,7 +66,18 @@ class State:
         _RESERVED_CONTROLLERS -- controllers for global actions.
         _context -- context object reference.
         _GLOBAL_COMBINATIONS -- global hotkeys combinations dictionary:
-            key: controls combination, value: called function name (string).
+            key: controls combination (frozenset or Combo),
+            value: called function name (string).
+        _LOCAL_COMBINATIONS -- state hotkeys combinations dictionary:
+            key: controls combination (frozenset or Combo),
+            value: called function.
+
+    Held controls are tracked as bitmask (bit number = control), combinations
+    are compiled to dictionary keyed by controls mask on first use.
+
+    Events are dispatched by table indexed with event type and control,
+    built on class creation from `handle_<type>` methods and methods
+    decorated with `route`.
     """
 
     state_name = "base"
@@ -21,16 +85,96 @@ class State:
     _RESERVED_CONTROLLERS = [pk.BUTTON_KNOB_1_ASSIGN, pk.BUTTON_KNOB_2_ASSIGN]
     _context = None
     _GLOBAL_COMBINATIONS = {
-        frozenset([pk.BUTTON_SETTING, pk.ROTARY_KNOB]): "change_state"
+        frozenset([pk.BUTTON_SETTING, pk.ROTARY_KNOB]): "change_state",
+        frozenset([pk.BUTTON_SETTING, pk.BUTTON_MESSAGE]): "dump_latency",
     }
 
     def __init__(self):
-        self.hotkeys = set()
+        self._held = 0  # bitmask of pressed controls
+        self._press_order = []  # pressed controls, tracked for ordered combos
+        self._press_time = {}  # control: press time, tracked for timed combos
+        self._dispatch = None  # bound `_ROUTES` table
         self._LOCAL_COMBINATIONS = {}
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._ROUTES = cls._compile_routes()
+
+    @classmethod
+    def _compile_routes(cls):
+        """Build class dispatch table
+
+        Returns:
+            list -- (function, keyword arguments) handler of every
+                event type and control
+        """
+        table = []
+        for event_type in EventType:
+            handler = (getattr(cls, "handle_%s" % event_type.name.lower()), {})
+            table.extend([handler] * (1 << _CONTROL_BITS))
+        # base class routes first, overridden by subclasses
+        for klass in reversed(cls.__mro__):
+            for func in vars(klass).values():
+                for event_type, controls, kwargs in getattr(func, "_routes", ()):
+                    index = event_type << _CONTROL_BITS
+                    for control in controls or range(1 << _CONTROL_BITS):
+                        table[index | control] = (func, kwargs)
+        return table
+
+    def _bind_routes(self):
+        self._dispatch = [
+            partial(func, self, **kwargs) if kwargs else func.__get__(self)
+            for func, kwargs in self._ROUTES
+        ]
+        return self._dispatch
+
     def __str__(self):
         return self.name
 
+    @property
+    def hotkeys(self):
+        """Currently held controls"""
+        return frozenset(
+            c for c in range(self._held.bit_length()) if self._held >> c & 1
+        )
+
+    @property
+    def _LOCAL_COMBINATIONS(self):
+        return self._local_combinations
+
+    @_LOCAL_COMBINATIONS.setter
+    def _LOCAL_COMBINATIONS(self, combinations):
+        self._local_combinations = combinations
+        self._combos = None  # compile on next event
+
+    def _compile_combinations(self):
+        """Compile global and local combinations to dictionary
+
+        key: controls mask,
+        value: tuple of (bound callable, press order or None, window ns or None),
+            global combinations first.
+        """
+        combos = {}
+        self._track_order = self._track_time = False
+        self._min_combo = 2
+        for combinations, global_ in (
+            (self._GLOBAL_COMBINATIONS, True),
+            (self._local_combinations, False),
+        ):
+            for key, action in combinations.items():
+                combo = key if isinstance(key, Combo) else Combo(key)
+                if global_:
+                    #  find method in class scope
+                    action = operator.attrgetter(action)(self)
+                order = combo.controls if combo.ordered else None
+                window = int(combo.window * 1e9) if combo.window else None
+                combos.setdefault(combo.mask, []).append((action, order, window))
+                self._track_order |= combo.ordered
+                self._track_time |= window is not None
+                self._min_combo = min(self._min_combo, len(combo.controls))
+        self._combos = {mask: tuple(entries) for mask, entries in combos.items()}
+        self._knobs_mask = Combo(self._KNOBS).mask
+
     def load_state(self):
         """
         Generic initialization method for context object handler
@@ -51,13 +195,21 @@ class State:
         # mp.send_sysex(
         #     pk.light_group('ABC', dict.fromkeys(pk.ALL_PADS, False))
         # )
-        mp.group_light_off(pk.ALL_BUTTONS)
-        mp.group_light_off(pk.ALL_PADS)
+        mp.group_light_off(pk.ALL_BUTTONS + pk.ALL_PADS)
         if sysEx.data == 1:
             self._context.next_state()
         else:
             self._context.previous_state()
 
+    def dump_latency(self, sysEx) -> None:
+        """Print latency histograms and output thread counters
+
+        Arguments:
+            sysEx message
+        """
+        latency.dump()
+        print(mp.writer_stats())
+
     # ------------------------handle events ---------------------------
 
     def handle_default_action(self, sysEx):
@@ -80,33 +232,57 @@ class State:
             bool -- global or local hotkey combo found
         """
 
+        if self._combos is None:
+            self._compile_combinations()
+
         catched = False
+        control = sysEx.control
+        bit = 1 << control
 
-        if sysEx.state in (pk.NOTE_ON, 1):
+        if sysEx.state in _PRESSED:
             # catch combination if button pressed or knob turned
-            self.hotkeys.add(sysEx.control)
-            if frozenset(self.hotkeys) in self._GLOBAL_COMBINATIONS:
-                combo_method = self._GLOBAL_COMBINATIONS[frozenset(self.hotkeys)]
-                #  find and call method in class scope
-                operator.attrgetter(combo_method)(self)(sysEx)
-                catched = True
-
-            elif frozenset(self.hotkeys) in self._LOCAL_COMBINATIONS:
-                self._LOCAL_COMBINATIONS[frozenset(self.hotkeys)](sysEx)
-                catched = True
-            else:
+            held = self._held | bit
+            if held != self._held:
+                self._held = held
+                if self._track_order:
+                    self._press_order.append(control)
+                if self._track_time:
+                    self._press_time[control] = time.perf_counter_ns()
+
+            # single control can't be a combination (unless defined)
+            entries = None
+            if held & (held - 1) or self._min_combo < 2:
+                entries = self._combos.get(held)
+            if entries:
+                for action, order, window in entries:
+                    if order is not None and tuple(self._press_order) != order:
+                        continue
+                    if window is not None:
+                        times = [self._press_time[c] for c in order or self.hotkeys]
+                        if max(times) - min(times) > window:
+                            continue
+                    action(sysEx)
+                    catched = True
+                    break
+            if not catched:
                 self.handle_default_action(sysEx)
         else:
             # remove from hotkeys queue on release
-            self.hotkeys.discard(sysEx.control)
+            self._release(bit, control)
 
         # knobs do not send on/off state,
         # controller must be removed from hotkey queue every turn
-        if sysEx.control in self._KNOBS:
-            self.hotkeys.discard(sysEx.control)
+        if bit & self._knobs_mask:
+            self._release(bit, control)
 
         return catched
 
+    def _release(self, bit, control):
+        if self._held & bit:
+            self._held &= ~bit
+            if self._track_order:
+                self._press_order.remove(control)
+
     def handle_event(self, sysEx):
         """Base event handler for State Object.
 
@@ -138,8 +314,8 @@ class State:
         Arguments:
             sysEx {SysexEvent} -- sysEx message from PK controller
         """
-        method = getattr(self, "handle_%s" % sysEx.type)
-        method(sysEx)
+        dispatch = self._dispatch or self._bind_routes()
+        dispatch[sysEx.type << _CONTROL_BITS | sysEx.control](sysEx)
 
     def handle_pad(self, sysEx):
         pass
@@ -172,3 +348,6 @@ class State:
         Should be overriden to stop current configuration`s thread on state change
         """
         pass
+
+
+State._ROUTES = State._compile_routes()
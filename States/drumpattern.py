@@ -1,17 +1,236 @@
 import midi_ports as mp
 import padKontrol as pk
+import threading
+from array import array
 from collections import deque
 from decorators import *
+from humanize import Humanizer
 from itertools import count
-from random import gauss
+
+
+class PatternGrid:
+    """Dense velocity grid of sequencer tracks.
+
+    Cells are stored step-major (cells of one step are contiguous), so
+    step column is a single slice. Velocity 0 is empty cell. Track shorter
+    than pattern is tiled over the whole pattern length.
+
+    Grid is edited by one thread and compiled by sequencer thread, `dirty`
+    bitmap is changed only under lock (`mark_dirty`, `take_dirty`), so
+    edits made during compile are not lost.
+
+    Keyword Arguments:
+        tracks {int} -- max number of tracks (default: {64})
+        steps {int} -- max pattern length (default: {256})
+        length {int} -- pattern length (default: {16})
+        buffer {buffer} -- attach to grid arrays stored in buffer by other
+            grid (see `share`), e.g. shared memory (default: {None})
+    """
+
+    def __init__(self, tracks=64, steps=256, length=16, buffer=None):
+        self.tracks = tracks
+        self.steps = steps
+        self.masks = [0] * steps  # bitmap of non-empty tracks of step
+        self.used = 0  # allocated tracks
+        self.dirty = 0  # bitmap of steps changed since last compile
+        self._dirty_lock = threading.Lock()
+        self._length = length
+        if buffer is None:
+            self._bind(bytearray(self.nbytes(tracks, steps)))
+            self.lengths[:] = array("H", [length]) * tracks
+        else:
+            self._bind(buffer)
+
+    @staticmethod
+    def nbytes(tracks, steps):
+        """Size of grid arrays"""
+        return 3 * tracks + tracks * steps
+
+    def _bind(self, buffer):
+        buffer = memoryview(buffer)
+        tracks = self.tracks
+        self.notes = buffer[:tracks]  # triggered note of track
+        self.lengths = buffer[tracks : 3 * tracks].cast("H")
+        self.cells = buffer[3 * tracks : self.nbytes(tracks, self.steps)]
+
+    def share(self, buffer):
+        """Move grid arrays to buffer (e.g. shared memory), other grid
+        attached to the buffer reads the same cells
+
+        Arguments:
+            buffer {buffer} -- writable buffer of `nbytes` size
+        """
+        notes, lengths, cells = self.notes, self.lengths, self.cells
+        self._bind(buffer)
+        self.notes[:] = notes
+        self.lengths[:] = lengths
+        self.cells[:] = cells
+
+    def sync(self, used, length):
+        """Adopt number of tracks and pattern length of grid attached to
+        the same buffer, cells are already changed by that grid"""
+        self.used = used
+        self._length = length
+
+    def refresh(self, step):
+        """Recompute bitmap of step changed by grid attached to the same
+        buffer and mark step for compile"""
+        column = self.column(step)
+        mask = 0
+        for track in range(self.used):
+            if column[track]:
+                mask |= 1 << track
+        self.masks[step] = mask
+        self.mark_dirty(1 << step)
+
+    def mark_dirty(self, steps):
+        """Mark steps for compile
+
+        Arguments:
+            steps {int} -- bitmap of changed steps
+        """
+        with self._dirty_lock:
+            self.dirty |= steps
+
+    def take_dirty(self):
+        """Clear and return bitmap of steps changed since last call, step
+        changed later is marked again"""
+        with self._dirty_lock:
+            dirty, self.dirty = self.dirty, 0
+        return dirty
+
+    @property
+    def length(self):
+        """Pattern length in steps"""
+        return self._length
+
+    @length.setter
+    def length(self, length):
+        length = max(1, min(length, self.steps))
+        previous, self._length = self._length, length
+        for track in range(self.used):
+            if self.lengths[track] > length:
+                self.lengths[track] = length
+            self._tile(track, length)
+        for step in range(length, previous):
+            self.masks[step] = 0
+            self.cells[step * self.tracks : (step + 1) * self.tracks] = bytes(
+                self.tracks
+            )
+
+    def add_track(self, note, length=None):
+        """Allocate track
+
+        Arguments:
+            note {int} -- triggered midi note
+
+        Keyword Arguments:
+            length {int} -- track length (default: pattern length)
+
+        Returns:
+            int -- track index
+        """
+        if self.used >= self.tracks:
+            raise ValueError("Pattern grid is full (%d tracks)" % self.tracks)
+        track = self.used
+        self.used += 1
+        self.notes[track] = note
+        self.lengths[track] = min(length or self._length, self._length)
+        return track
+
+    def column(self, step):
+        """Velocities of all tracks at step
+
+        Returns:
+            memoryview -- cells of step, indexed by track
+        """
+        offset = step * self.tracks
+        return self.cells[offset : offset + self.tracks]
+
+    def set_note(self, track, note):
+        """Change triggered note of track"""
+        self.notes[track] = note
+        bit = 1 << track
+        dirty = 0
+        for step, mask in enumerate(self.masks):
+            if mask & bit:
+                dirty |= 1 << step
+        self.mark_dirty(dirty)
+
+    def get(self, track, step):
+        return self.cells[step * self.tracks + track]
+
+    def set(self, track, step, velocity):
+        """Set velocity of track step (and its tiled copies)"""
+        for tiled in range(step, self._length, self.lengths[track]):
+            self._put(track, tiled, velocity)
+
+    def set_track_length(self, track, length):
+        """Change track length, new steps are empty"""
+        length = max(1, min(length, self._length))
+        previous = self.lengths[track]
+        self.lengths[track] = length
+        for step in range(previous, length):
+            self._put(track, step, 0)
+        self._tile(track, self._length)
+
+    def _tile(self, track, end):
+        """Repeat first `length` steps of track up to `end` step"""
+        length = self.lengths[track]
+        for step in range(length, min(end, self._length)):
+            self._put(track, step, self.get(track, step % length))
+
+    def _put(self, track, step, velocity):
+        self.cells[step * self.tracks + track] = velocity
+        if velocity:
+            self.masks[step] |= 1 << track
+        else:
+            self.masks[step] &= ~(1 << track)
+        self.mark_dirty(1 << step)  # after cell and mask, see `take_dirty`
+
+
+class Strokes:
+    """List-like view of instrument velocities in pattern grid"""
+
+    __slots__ = ("_grid", "_track")
+
+    def __init__(self, grid, track):
+        self._grid = grid
+        self._track = track
+
+    def __len__(self):
+        return self._grid.lengths[self._track]
+
+    def _index(self, step):
+        length = len(self)
+        if step < 0:
+            step += length
+        if not 0 <= step < length:
+            raise IndexError("step out of range")
+        return step
+
+    def __getitem__(self, step):
+        if isinstance(step, slice):
+            return [self[idx] for idx in range(*step.indices(len(self)))]
+        return self._grid.get(self._track, self._index(step))
+
+    def __setitem__(self, step, velocity):
+        self._grid.set(self._track, self._index(step), velocity or 0)
+
+    def __iter__(self):
+        return (self._grid.get(self._track, step) for step in range(len(self)))
+
+    def __repr__(self):
+        return repr(list(self))
 
 
 class Instrument:
-    """Instrument class for sequencer
+    """Instrument class for sequencer, view of pattern grid track
 
     Arguments:
         note: midi pitch value
-        strokes: (optional) velocities of each stroke, default [None]*16
+        strokes: (optional) velocities of each stroke, default [0]*16
+        grid: (optional) pattern grid, default private single track grid
     Raises:
         TypeError: Strokes must be list/tuple with values None or 0-127
 
@@ -19,14 +238,28 @@ class Instrument:
 
     id_iter = count(1)  # start with 1
 
-    def __init__(self, note, **kwargs):
-        self.note = note  # triggered note # TODO unique value for channel
-        self._strokes = kwargs.get(
-            "strokes", [None] * 16
-        )  # initialize grid with 0 velocity per step
+    def __init__(self, note, grid=None, **kwargs):
+        if grid is None:
+            grid = PatternGrid(tracks=1, steps=16)
+        self.grid = grid
+        self.track = grid.add_track(note)
+        self._strokes = Strokes(grid, self.track)
         self._position = 0
-        self.max_length = 16
         self.id = next(self.id_iter)
+        if "strokes" in kwargs:
+            self.strokes = kwargs["strokes"]
+
+    @property
+    def max_length(self):
+        return self.grid.length
+
+    @property
+    def note(self):
+        return self.grid.notes[self.track]  # TODO unique value for channel
+
+    @note.setter
+    def note(self, note):
+        self.grid.set_note(self.track, note)
 
     @property
     def strokes(self):
@@ -36,10 +269,10 @@ class Instrument:
     def strokes(self, pattern: list) -> None:
         if not isinstance(pattern, (list, tuple)):
             raise TypeError("Strokes must be a list")
-        if len(pattern) > self.max_length:
-            self._strokes = pattern[: self.max_length]
-        elif len(pattern) < self.max_length:
-            self._strokes = pattern + [0] * (self.max_length - len(pattern))
+        pattern = list(pattern[: self.max_length])
+        self.grid.set_track_length(self.track, len(pattern) or 1)
+        for step, velocity in enumerate(pattern):
+            self._strokes[step] = velocity
 
     def __str__(self):
         return f"Trigger note {self.note}"
@@ -76,7 +309,7 @@ class Instrument:
         """
         if 0 <= step < len(self.strokes):
             velocity = max(0, min(velocity, 127))
-            self.strokes[stroke] = velocity
+            self.strokes[step] = velocity
 
     def remove_step(self, step: int) -> None:
         """Remove step velocity value
@@ -93,64 +326,238 @@ class Instrument:
     def add_length(self):
         """Increase strokes lengts (max-16)
         """
-        if len(self.strokes) < 16:
-            self.strokes += [0]
+        if len(self.strokes) < self.max_length:
+            self.grid.set_track_length(self.track, len(self.strokes) + 1)
 
     def remove_length(self):
         """Increase strokes lengts (min-1)
         """
         if len(self.strokes) > 1:
-            del self.strokes[:-1]
+            self.grid.set_track_length(self.track, len(self.strokes) - 1)
 
 
 class Drumpattern(object):
-    """Container and iterator for a multi-track step sequence."""
+    """Container and iterator for a multi-track step sequence.
+
+    Instruments are views of tracks in shared `PatternGrid`, `step` is
+    cursor of the grid column played next. Every step is compiled to bundle
+    of note offs of the previous step hits and note ons, written at once (see
+    `midi_ports.send_bundle`). Steps changed in grid are recompiled before
+    playback.
+
+    Keyword Arguments:
+        humanize {float} -- velocity deviation ratio (default: {0})
+        timing_ns {int} -- step time deviation, applied by sequencer
+            scheduler (default: {0})
+        seed {int} -- humanize random seed (default: {None})
+        tracks {int} -- max number of instruments (default: {64})
+        steps {int} -- pattern length (default: {16})
+    """
 
-    def __init__(self, humanize=0):
+    def __init__(self, humanize=0, tracks=64, steps=16, timing_ns=0, seed=None):
         self.instruments = deque()
-        self.humanize = humanize
-        self.steps = 16
+        self.humanizer = None
+        self.set_humanize(humanize, timing_ns, seed)
+        self.grid = PatternGrid(tracks, length=steps)
         self.step = 0
-        self._notes = {}
+        self._ringing = 0  # bitmap of notes of the last played step
+        self._allocate(self.grid.steps)
+        self._channel = None  # channel of compiled bundles
+        self._length = None  # pattern length of compiled bundles
+        self._messages = [None] * 128 * 128  # interned note on of humanized hits
         self.curent_instrument = None
 
+    def set_humanize(self, velocity=0.0, timing_ns=0, seed=None):
+        """Enable humanization, see `Humanizer`, zero values disable it"""
+        if velocity or timing_ns:
+            self.humanizer = Humanizer(velocity, timing_ns, seed)
+        else:
+            self.humanizer = None
+
+    @property
+    def steps(self):
+        return self.grid.length
+
+    @steps.setter
+    def steps(self, steps):
+        self.grid.length = steps
+        self.step %= self.grid.length
+
     def reset(self):
         self.step = 0
         for instrument in self.instruments:
             instrument.reset()
 
+    def skip(self, steps):
+        """Move step cursor without playing steps"""
+        self.step = (self.step + steps) % self.grid.length
+
     def initialize(self):
         for n in range(4):
-            i = Instrument(note=36 + n)
-            self.instruments.append(i)
+            self.add_instrument(note=36 + n)
+
+    def add_instrument(self, note, **kwargs):
+        """Add instrument track to pattern grid
+
+        Arguments:
+            note {int} -- triggered midi note
+
+        Returns:
+            Instrument -- new instrument
+        """
+        instrument = Instrument(note, grid=self.grid, **kwargs)
+        self.instruments.append(instrument)
+        return instrument
+
+    def _allocate(self, steps):
+        self._step_notes = [0] * steps  # bitmap of notes of step
+        self._step_offs = [0] * steps  # bitmap of notes stopped by bundle
+        self._bundles = [()] * steps  # compiled messages of step
+        self._onsets = [()] * steps  # compiled note ons of step
+
+    def _notes(self, step):
+        """Bitmap of notes hit at step"""
+        grid = self.grid
+        notes = 0
+        hits = grid.masks[step]
+        while hits:
+            bit = hits & -hits
+            hits ^= bit
+            notes |= 1 << grid.notes[bit.bit_length() - 1]
+        return notes
+
+    def _compile_offs(self, notes, channel):
+        offs = []
+        while notes:
+            bit = notes & -notes
+            notes ^= bit
+            offs.append(mp.note_bytes(channel, bit.bit_length() - 1, 0))
+        return tuple(offs)
+
+    def _compile_ons(self, step, channel):
+        grid = self.grid
+        column = grid.column(step)
+        hits = grid.masks[step]
+        ons = []
+        while hits:
+            bit = hits & -hits
+            hits ^= bit
+            track = bit.bit_length() - 1
+            ons.append(mp.note_bytes(channel, grid.notes[track], column[track]))
+        return tuple(ons)
+
+    def compile_step(self, step, channel):
+        """Compile note off messages of notes ringing from the previous step
+        and note on messages of step hits
+
+        Returns:
+            tuple -- raw midi messages
+        """
+        previous = self._notes((step - 1) % self.grid.length)
+        return self._compile_offs(previous, channel) + self._compile_ons(step, channel)
+
+    def _compile_dirty(self, channel):
+        grid = self.grid
+        length = grid.length
+        if channel != self._channel:
+            self._channel = channel
+            self._messages = [None] * 128 * 128
+            grid.take_dirty()
+            dirty = (1 << grid.steps) - 1
+        else:
+            dirty = grid.take_dirty()
+            # note offs of step depend on hits of the previous step
+            dirty |= (dirty << 1 | dirty >> (length - 1) & 1) & ((1 << grid.steps) - 1)
+            if length != self._length:
+                dirty |= 1
+        self._length = length
+        while dirty:
+            bit = dirty & -dirty
+            dirty ^= bit
+            step = bit.bit_length() - 1
+            previous = self._notes((step - 1) % length)
+            ons = self._compile_ons(step, channel)
+            self._step_notes[step] = self._notes(step)
+            self._step_offs[step] = previous
+            self._onsets[step] = ons
+            self._bundles[step] = self._compile_offs(previous, channel) + ons
 
     def playstep(self, bpm, channel=1):
-        for inst in self.instruments:
-            note, velocity = next(inst)
-
-            if velocity is not None:
-                if self._notes.get(note):
-                    mp.send_midi(
-                        dict(type="note_on", channel=channel, note=note, velocity=0)
-                    )
-                    self._notes[note] = 0
-                if velocity > 0:
-                    if self.humanize:
-                        velocity += int(round(gauss(0, velocity * self.humanize)))
-                    mp.send_midi(
-                        dict(
-                            type="note_on",
-                            channel=channel,
-                            note=note,
-                            velocity=max(1, velocity),
-                        )
-                    )
-                    self._notes[note] = velocity
+        grid = self.grid
+        step = self.step
+        if grid.dirty or channel != self._channel or grid.length != self._length:
+            self._compile_dirty(channel)
+        if self.humanizer and self.humanizer.velocity:
+            self._play_humanized(step, channel)
+        else:
+            ringing = self._ringing
+            bundle = self._bundles[step]
+            if ringing != self._step_offs[step]:
+                # first step after silence or moved cursor
+                bundle = self._onsets[step]
+                if ringing:
+                    bundle = self._compile_offs(ringing, channel) + bundle
+            if bundle:
+                mp.send_bundle(bundle)
+            self._ringing = self._step_notes[step]
 
         self.step += 1
-        if self.step >= self.steps:
+        if self.step >= grid.length:
             self.step = 0
-        self.current_instrument_seq(bpm)
+        self.current_instrument_seq(bpm, step)
+
+    def _play_humanized(self, step, channel):
+        """Play step with pre-generated velocity deviation"""
+        grid = self.grid
+        message = self._message
+        ringing = self._ringing
+        while ringing:
+            bit = ringing & -ringing
+            ringing ^= bit
+            mp.send_data(message(channel, bit.bit_length() - 1, 0))
+        hits = grid.masks[step]
+        if hits:
+            column = grid.column(step)
+            notes = grid.notes
+            humanize_velocity = self.humanizer.humanize_velocity
+            while hits:
+                bit = hits & -hits
+                hits ^= bit
+                track = bit.bit_length() - 1
+                velocity = humanize_velocity(column[track])
+                mp.send_data(message(channel, notes[track], velocity))
+        self._ringing = self._step_notes[step]
+
+    def silence(self, channel):
+        """Send note off of notes ringing from the last played step
+
+        Returns:
+            int -- number of stopped notes
+        """
+        ringing, self._ringing = self._ringing, 0
+        offs = self._compile_offs(ringing, channel)
+        if offs:
+            mp.send_bundle(offs)
+        return len(offs)
+
+    def preallocate(self, channel):
+        """Compile all steps and intern messages of every track note and
+        velocity, so playback does not allocate messages (realtime mode)"""
+        grid = self.grid
+        grid.mark_dirty((1 << grid.steps) - 1)
+        self._compile_dirty(channel)
+        for note in set(grid.notes[: grid.used]):
+            for velocity in range(128):
+                self._message(channel, note, velocity)
+
+    def _message(self, channel, note, velocity):
+        """Interned note on message"""
+        message = self._messages[note << 7 | velocity]
+        if message is None:
+            message = self._messages[note << 7 | velocity] = mp.note_bytes(
+                channel, note, velocity
+            )
+        return message
 
     @press_light
     @action_on_press(False)
@@ -199,20 +606,21 @@ class Drumpattern(object):
         inst = self.curent_instrument
         strokes = inst.strokes
 
-        mp.group_light_off(pk.ALL_PADS)
-        for idx, s in enumerate(strokes):
-            if s:
-                mp.light_on(idx)
+        pads = strokes[: len(pk.ALL_PADS)]
+        mp.group_light_set(pk.ALL_PADS, [idx for idx, s in enumerate(pads) if s])
 
         mp.led(inst.id)
 
-    def current_instrument_seq(self, bpm):
+    def current_instrument_seq(self, bpm, step):
         """flash pad on active step
 
         Arguments:
             bpm {int} -- sequence tempo
+            step {int} -- played pattern step
         """
         inst = self.curent_instrument
         tick = bpm / 960  # 16th grid
         val = (tick - 9) / 270
-        mp.light_flash(inst._position, 0.125)
+        position = step % len(inst.strokes)
+        if position < len(pk.ALL_PADS):
+            mp.light_flash(position, 0.125)
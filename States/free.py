@@ -1,6 +1,7 @@
 import time
 from collections import deque
-from States.baseState import State
+from States.baseState import State, route
+from midi_event import EventType
 import utils
 import decorators
 import midi_ports as mp
@@ -8,6 +9,7 @@ import padKontrol as pk
 
 
 class FreeState(State):
+    USER_SCALE = "Usr"
     _scales = deque(
         [
             ("Chromatic", [1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1], []),
@@ -49,10 +51,25 @@ class FreeState(State):
         2,
         3,
     ]  # pad order left-right / down-up
+    # (scale name, mode): pad notes for every base note, see `utils.pad_note_table`
+    _note_tables = {}
+
+    @classmethod
+    def compile_note_tables(cls):
+        """Precompute pad notes of all scales and modes (except user scale)"""
+        for name, pattern, modes in cls._scales:
+            if name != cls.USER_SCALE:
+                for mode in range(len(modes) or 1):
+                    cls._note_tables[name, mode] = cls._note_table(pattern, mode)
+
+    @classmethod
+    def _note_table(cls, pattern, mode):
+        return memoryview(
+            utils.pad_note_table(utils.scale_to_16(pattern, mode), cls.ordered)
+        )
 
     def __init__(self,):
         super().__init__()
-        self.hotkeys = set()
         self._LOCAL_COMBINATIONS = {
             frozenset([pk.BUTTON_PEDAL, pk.ROTARY_KNOB]): self.change_mode,
             frozenset([pk.BUTTON_FLAM, pk.ROTARY_KNOB]): self.transpose_12,
@@ -60,10 +77,11 @@ class FreeState(State):
         }
         self.channel = 1
         self._transpose = 0
-        self.scale = None
+        self._table = None  # pad notes table of current scale and mode
+        self._pads = None  # pad notes for current base note
         self.led_text = None
         self.mode = 0
-        self.base_note = 36
+        self._base_note = 36
 
     @property
     def transpose(self):
@@ -73,20 +91,20 @@ class FreeState(State):
     def transpose(self, val):
         self._transpose = max(min(127, val), -36)
 
+    @property
+    def base_note(self):
+        return self._base_note
+
+    @base_note.setter
+    def base_note(self, val):
+        self._base_note = max(min(163, val), 0)
+        if self._table is not None:
+            offset = self._base_note * len(self.ordered)
+            self._pads = self._table[offset : offset + len(self.ordered)]
+
     def handle_pad(self, sysEx):
         self.play_note(sysEx)
 
-    def handle_button(self, sysEx):
-        # print(sysEx)
-        if sysEx.control == pk.BUTTON_HOLD:
-            self.handle_transpose(sysEx, 1)
-        elif sysEx.control == pk.BUTTON_ROLL:
-            self.handle_transpose(sysEx, -1)
-        elif sysEx.control == pk.BUTTON_FLAM:
-            self.show_note(sysEx)
-        elif sysEx.control == pk.BUTTON_PAD:
-            self.handle_xy_pad(sysEx)
-
     def handle_knob(self, sysEx):
         pass
 
@@ -98,22 +116,30 @@ class FreeState(State):
         self.mode = 0
         self.load_scale()
 
+    @route(EventType.BUTTON, pk.BUTTON_PAD)
     def handle_xy_pad(self, sysEx):
         # pitch bend on x
         if sysEx.state == 1 and sysEx.data:
             # 1 semitone pitch bend
             pitch = round(275 / 128 * sysEx.data[1] - 137)
 
-            mp.send_midi(dict(type="pitchwheel", pitch=pitch))
+            mp.pitchwheel(0, pitch)
         elif sysEx.state == 0:
-            mp.send_midi(dict(type="pitchwheel", pitch=0))
+            mp.pitchwheel(0, 0)
 
     def load_scale(self):
         """
         Change pattern and load prepared scale.
         """
         name, pattern, modes = self._scales[0]
-        self.scale = utils.scale_to_16(pattern, self.mode)
+        table = self._note_tables.get((name, self.mode))
+        if table is None:
+            # user scale, computed on first use
+            table = self._note_tables[name, self.mode] = self._note_table(
+                pattern, self.mode
+            )
+        self._table = table
+        self.base_note = self._base_note
         if self.mode:
             name = modes[self.mode]
         self.led_text = name
@@ -141,13 +167,16 @@ class FreeState(State):
         """
         Play notes with pads.
         """
-        pad = self.ordered[sysEx.control]
-        scale = self.scale
-        note = self.base_note + scale[pad]
-        mp.send_midi(
-            dict(type=sysEx.state, channel=self.channel, note=note, velocity=sysEx.data)
-        )
+        note = self._pads[sysEx.control]
+        if note < 0:
+            return
+        if sysEx.state == pk.NOTE_ON:
+            mp.note_on(self.channel, note, sysEx.data)
+        else:
+            mp.note_off(self.channel, note)
 
+    @route(EventType.BUTTON, pk.BUTTON_HOLD, steps=1)
+    @route(EventType.BUTTON, pk.BUTTON_ROLL, steps=-1)
     @decorators.press_light
     @decorators.action_on_press(True, "led_text")  # reset led on button release
     def handle_transpose(self, sysEx, steps):
@@ -171,6 +200,7 @@ class FreeState(State):
         self.base_note = 36
         self._transpose = 0
 
+    @route(EventType.BUTTON, pk.BUTTON_FLAM)
     @decorators.press_light
     @decorators.action_on_press(True, "led_text")
     def show_note(self, sysEx):
@@ -192,3 +222,6 @@ class FreeState(State):
         self.base_note = 36 + self.transpose
         note_name = utils.pitch_to_note(self.base_note)
         mp.led(note_name)
+
+
+FreeState.compile_note_tables()
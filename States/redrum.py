@@ -3,12 +3,27 @@ from rtmidi.midiconstants import (
     ALL_SOUND_OFF,
 )
 
-from .baseState import State
+from .baseState import State, route
+from midi_event import EventType
 import time
+from enum import IntEnum
+from math import ceil
 from .drumpattern import Drumpattern
 import threading
+from scheduler import LatenessStats, Scheduler
+from midi_clock import ClockFollower, ClockMaster, PPQN
 from decorators import *
 import midi_ports as mp
+import realtime
+
+
+class Transport(IntEnum):
+    """Sequencer thread state"""
+
+    STOPPED = 0  # silent, step cursor rewound
+    PAUSED = 1  # silent, step cursor kept
+    PLAYING = 2
+    SHUTDOWN = 3  # thread exits
 
 
 class ReDrumState(State, threading.Thread):
@@ -17,47 +32,215 @@ class ReDrumState(State, threading.Thread):
     def __init__(self):
         super(ReDrumState, self).__init__()
         threading.Thread.__init__(self)
-        self.hotkeys = set()
         self.channel = 1
         # self.bpm = max(20, min(bpm, 400))
         self.bpm = 120
-        self.interval = 15.0 / self.bpm
+        self.resolution = 4  # steps per beat, 16th grid
+        self.interval = 60.0 / (self.bpm * self.resolution)
         self.pattern = Drumpattern()
-        self.done = False
         self.daemon = True  # Allow main to exit even if still running.
-        self.paused = True  # Start out paused.
-        self.state = threading.Condition()
-        self.callcount = 0
-        self.started = time.time()
+        # transport is read without lock by sequencer thread,
+        # changes are signalled by `_wake` (see `run`)
+        self.transport = Transport.PAUSED
+        self._wake = threading.Event()
+        self._silence_requested = 0  # perf_counter_ns time of pause / stop
+        self.silence_latency = LatenessStats()  # pause to note offs sent
+        # steps and clock ticks are scheduled `lookahead_ns` ahead
+        # from anchored 24 ppqn timebase
+        self.scheduler = Scheduler()
+        self.lookahead_ns = 5_000_000
+        self._tick = 0  # song position of the next planned tick
+        self._step_tick = 0.0  # song position (in ticks) of the next planned step
+        self._anchor = 0  # perf_counter_ns time of anchor tick
+        self._anchor_tick = 0
+        self._tick_ns = 0.0
+        self.skipped_steps = 0  # late steps dropped after stall
+        # external MIDI clock in slave mode (see `follow_clock`)
+        self.clock = None
+        # MIDI clock output (see `send_clock`)
+        self.clock_out = None
+        self._resync = False  # transport message moved song position
+        # engine process playing pattern (see `run_in_process`)
+        self.engine = None
 
     def load_state(self):
         mp.light_blink(pk.BUTTON_VELOCITY)
-        if not self.is_alive():
-            self.start()
+        if not self.pattern.instruments:
             self.pattern.initialize()
+        if self.engine:
+            self.engine.publish()
+        elif not self.is_alive():
+            self.start()
         self.pattern.load_current_instrument()
 
-    def handle_button(self, sysEx):
-        if sysEx.control == pk.BUTTON_VELOCITY:
-            self.handle_pause(sysEx)
-        elif sysEx.control == pk.BUTTON_REL_VAL:
-            self.reset(sysEx)
-        elif sysEx.control == pk.BUTTON_HOLD:
-            self.pattern.next_instrument(sysEx)
-        elif sysEx.control == pk.BUTTON_ROLL:
-            self.pattern.prev_instrument(sysEx)
+    def run_in_process(self, **kwargs):
+        """Play pattern in separate engine process instead of this thread,
+        must be called before state is loaded
+
+        Keyword Arguments:
+            kwargs -- `SequencerProcess` port and backend arguments
+
+        Returns:
+            SequencerProcess -- engine process
+        """
+        from sequencer_process import SequencerProcess
+
+        self.engine = SequencerProcess(
+            self.pattern, self.bpm, self.resolution, self.channel, **kwargs
+        )
+        mp.on_close(self.shutdown)
+        return self.engine
+
+    def start(self):
+        super().start()
+        mp.on_close(self.shutdown)
+
+    @route(EventType.BUTTON, pk.BUTTON_HOLD)
+    def next_instrument(self, sysEx):
+        self.pattern.next_instrument(sysEx)
+
+    @route(EventType.BUTTON, pk.BUTTON_ROLL)
+    def prev_instrument(self, sysEx):
+        self.pattern.prev_instrument(sysEx)
 
     def handle_pad(self, sysEx):
         self.pattern.handle_step(sysEx)
+        if self.engine:
+            self.engine.publish()
 
     def handle_rotary(self, sysEx):
+        if self.clock:
+            mp.led(round(self.clock.bpm))  # tempo set by clock master
+            return
         if sysEx.data == 1:
-            self.bpm += 1
+            self.set_tempo(self.bpm + 1)
         else:
-            self.bpm -= 1
-        self.interval = 15.0 / self.bpm
+            self.set_tempo(self.bpm - 1)
         mp.led(self.bpm)
 
+    def set_tempo(self, bpm, resolution=None):
+        """Change tempo, applied from the next scheduled step
+
+        Arguments:
+            bpm {int} -- beats per minute
+
+        Keyword Arguments:
+            resolution {int} -- steps per beat, e.g. 8 for 32nd notes
+        """
+        self.bpm = max(20, min(bpm, 400))
+        if resolution:
+            self.resolution = resolution
+        self.interval = 60.0 / (self.bpm * self.resolution)
+        if self.engine:
+            self.engine.set_tempo(self.bpm, self.resolution)
+
+    def follow_clock(self, port=mp.CLOCK_MIDI_PORT, **kwargs):
+        """Slave mode: lock steps to external 24 ppqn MIDI clock
+
+        Start, stop and continue messages of clock master control
+        playback, song position pointer moves step cursor.
+
+        Keyword Arguments:
+            port {string} -- clock input port name, None follows clock
+                fed directly to `clock.receive` (default: {CLOCK_MIDI_PORT})
+            kwargs -- `ClockFollower` arguments
+
+        Returns:
+            ClockFollower -- followed clock
+        """
+        self.clock = ClockFollower(
+            bpm=self.bpm,
+            on_start=self._clock_continue,
+            on_stop=self.pause,
+            on_continue=self._clock_continue,
+            **kwargs,
+        )
+        if port:
+            mp.open_clock_input(self.clock.raw_callback, port)
+        return self.clock
+
+    def send_clock(self, ports=("data",)):
+        """Master mode: send 24 ppqn MIDI clock, start, stop and continue
+        from sequencer timebase, clock ticks never drift from steps
+
+        Keyword Arguments:
+            ports {list} -- clock output port names, see
+                `midi_ports.clock_writers` (default: {("data",)})
+
+        Returns:
+            ClockMaster -- clock output
+        """
+        self.clock_out = ClockMaster(mp.clock_writers(ports))
+        return self.clock_out
+
+    def _clock_continue(self):
+        self._resync = True  # step cursor from clock song position
+        self.play()
+
+    @property
+    def paused(self):
+        return self.transport != Transport.PLAYING
+
+    def play(self):
+        if self.engine:
+            self.engine.play()
+        self._set_transport(Transport.PLAYING)
+
+    def pause(self, requested=None):
+        """Stop playback, ringing notes are stopped by sequencer thread
+
+        Keyword Arguments:
+            requested {int} -- `time.perf_counter_ns()` time of pause request
+                for silence latency (default: {now})
+        """
+        self._silence_requested = requested or time.perf_counter_ns()
+        if self.engine:
+            self.engine.pause()
+        self._set_transport(Transport.PAUSED)
+
+    def stop(self):
+        """Pause and rewind pattern"""
+        self._silence_requested = time.perf_counter_ns()
+        if self.engine:
+            self.engine.pause()
+            self.engine.set_step(0)
+        self._set_transport(Transport.STOPPED)
+
+    def shutdown(self, timeout=1.0):
+        """Silence and stop sequencer thread (or engine process) and wait
+        for it, called by `midi_ports.close_native`
+
+        Keyword Arguments:
+            timeout {float} -- max wait for thread (default: {1.0})
+        """
+        self._silence_requested = time.perf_counter_ns()
+        self._set_transport(Transport.SHUTDOWN)
+        if self.engine:
+            self.engine.close()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(timeout)
+
+    def _set_transport(self, transport):
+        if self.transport != Transport.SHUTDOWN:
+            self.transport = transport
+        self._wake.set()
+
+    def silence_stats(self):
+        """Get pause to silence latency statistics, time from pause / stop
+        request to note offs passed to output, see `LatenessStats`
+        (published by engine process in process mode)"""
+        if self.engine:
+            return self.engine.silence_stats()
+        return self.silence_latency.summary()
+
+    def timing_stats(self):
+        """Get lateness statistics of played steps, see `LatenessStats`,
+        with number of steps skipped after stalls"""
+        if self.engine:
+            return self.engine.timing_stats()
+        return dict(self.scheduler.lateness.summary(), skipped=self.skipped_steps)
+
+    @route(EventType.BUTTON, pk.BUTTON_VELOCITY)
     @action_on_press(False)
     def handle_pause(self, sysEx):
         print(sysEx)
@@ -69,74 +252,182 @@ class ReDrumState(State, threading.Thread):
     @press_light
     def resume_seq(self, sysEx):
         # mp.light_off(self.pattern.step)
-        with self.state:
-            self.paused = False
-            self.started = time.time()
-
-            self.callcount = 0
-            self.state.notify()  # Unblock self if waiting.
+        self.play()
 
     @blink_light
     def _pause_seq(self, sysEx):
-        self._pause()
-
-    def _pause(self):
-        with self.state:
-            print("paused")
-            self.paused = True  # Block self.
+        self.pause()
 
+    @route(EventType.BUTTON, pk.BUTTON_REL_VAL)
     @press_light
     @action_on_press(False)
     def reset(self, sysEx):
         if self.paused:
-            self.pattern.reset()
+            self.stop()
 
     def main_loop(self):
-        self.worker()
-        self.callcount += 1
+        """Plan and play the next steps, sleep is interrupted by transport
+        change, so pause is not delayed by the rest of step interval"""
+        self._plan_steps(time.perf_counter_ns() + self.lookahead_ns)
+        scheduler = self.scheduler
+        remaining = scheduler.next_deadline() - time.perf_counter_ns()
+        remaining -= scheduler.spin_ns
+        if realtime.enabled and realtime.safe_point(remaining):
+            remaining = scheduler.next_deadline() - time.perf_counter_ns()
+            remaining -= scheduler.spin_ns
+        if remaining > 0 and self._wake.wait(remaining / 1e9):
+            self._wake.clear()
+            return
+        scheduler.run_next()
 
-        # Compensate for drift:
-        sleep_duration = (self.callcount) * self.interval - time.time() + self.started
+    def _plan_steps(self, horizon):
+        """Schedule steps and clock ticks with deadline before horizon
+        (at least one event).
 
-        if sleep_duration > 0:
-            time.sleep(sleep_duration)
+        Timebase counts 24 ppqn ticks, steps are `PPQN / resolution`
+        ticks apart, so resolutions not dividing 24 (e.g. 5 or 16 steps
+        per beat) put steps between ticks instead of rounding the step
+        length. Tick and step times are computed from anchor, so slow
+        writes do not accumulate drift and clock output stays locked to
+        steps. Tempo change moves anchor to the next planned event.
+        In slave mode ticks lie on extrapolated grid of followed clock.
+        Humanized step is moved by pre-generated timing deviation (limited
+        to lookahead and quarter of step).
+        After stall (thread not scheduled, system suspend) longer than
+        a step, late steps are skipped instead of played in a burst.
+        """
+        clock = self.clock
+        ticks_per_step = PPQN / self.resolution
+        if clock:
+            tick_ns = clock.period
+        else:
+            tick_ns = self.interval * 1e9 / ticks_per_step
+            if tick_ns != self._tick_ns:
+                position = min(self._tick, self._step_tick)
+                self._anchor += int((position - self._anchor_tick) * self._tick_ns)
+                self._anchor_tick = position
+                self._tick_ns = tick_ns
+        step_ns = tick_ns * ticks_per_step
+        now = horizon - self.lookahead_ns
+        position = min(self._tick, self._step_tick)
+        if clock:
+            late = now - clock.tick_time(position)
+        else:
+            late = now - self._anchor - (position - self._anchor_tick) * tick_ns
+        if late > step_ns:
+            self._skip_late(late, position, tick_ns, ticks_per_step)
+        humanizer = self.pattern.humanizer
+        timings = humanizer.timings if humanizer and humanizer.timing_ns else None
+        limit = min(self.lookahead_ns, int(step_ns) // 4)
+        clock_out = self.clock_out
+        scheduler = self.scheduler
+        while True:
+            tick = self._tick
+            step_tick = self._step_tick
+            # plan whichever of the next tick and the next step comes first
+            is_step = step_tick < tick
+            position = step_tick if is_step else tick
+            if clock:
+                deadline = clock.tick_time(position)
+            else:
+                deadline = self._anchor + int((position - self._anchor_tick) * tick_ns)
+            if deadline > horizon and len(scheduler):
+                break
+            if is_step:
+                if timings:
+                    deadline += max(-limit, min(limit, timings.take()))
+                scheduler.schedule(deadline, self.worker)
+                self._step_tick = step_tick + ticks_per_step
+            else:
+                if clock_out:
+                    scheduler.schedule(deadline, clock_out.tick)
+                self._tick = tick + 1
+
+    def _skip_late(self, late, position, tick_ns, ticks_per_step):
+        """Drop steps and ticks planned before now
+
+        Own timebase is moved to now, pattern continues from step cursor.
+        Followed clock grid cannot move, step cursor skips late steps.
+        """
+        skipped = int(late // (tick_ns * ticks_per_step))
+        if self.clock:
+            now_tick = position + late / tick_ns  # song position of now
+            skipped = max(0, ceil((now_tick - self._step_tick) / ticks_per_step))
+            self._step_tick += skipped * ticks_per_step
+            self._tick = max(self._tick, ceil(now_tick))
+            self.pattern.skip(skipped)
+        else:
+            self._anchor += int((position - self._anchor_tick) * tick_ns + late)
+            self._anchor_tick = position
+        self.skipped_steps += skipped
+
+    def _restart_clock(self):
+        """Drop scheduled events and start timebase from now at step cursor
+        (at song position of followed clock in slave mode)"""
+        self.scheduler.clear()
+        self.scheduler.lateness.reset()
+        self.skipped_steps = 0
+        self._resync = False
+        resolution = self.resolution
+        if self.clock:
+            self._tick = self.clock.next_tick
+            # first step boundary at or after song position
+            step = -(-self._tick * resolution // PPQN)
+            self.pattern.step = step % self.pattern.steps
+        else:
+            step = self.pattern.step
+            # first tick at or after step
+            self._tick = -(-step * PPQN // resolution)
+        self._step_tick = step * PPQN / resolution
+        self._anchor = time.perf_counter_ns()
+        self._anchor_tick = self._step_tick
+        if self.clock_out:
+            self.clock_out.resume(self._tick)
 
     def run(self):
-        mp.send_midi(
-            dict(
-                type="control_change",
-                channel=self.channel,
-                control=ALL_SOUND_OFF,
-                value=0,
-            )
-        )
+        mp.cc(self.channel, ALL_SOUND_OFF, 0)
 
         # give MIDI instrument some time to activate drumkit
         time.sleep(0.3)
 
-        while not self.done:
-            with self.state:
-                if self.paused:
-                    mp.send_midi(
-                        dict(
-                            type="control_change",
-                            channel=self.channel,
-                            control=ALL_SOUND_OFF,
-                            value=0,
-                        )
-                    )
-                    self.state.wait()  # Block execution until notified.
-            # Do stuff.
-            self.main_loop()
-
-        mp.send_midi(
-            dict(
-                type="control_change",
-                channel=self.channel,
-                control=ALL_SOUND_OFF,
-                value=0,
-            )
-        )
+        idle_timeout = None
+        if realtime.enabled:
+            realtime.promote("ReDrum")
+            idle_timeout = 1.0  # collect garbage while not playing
+
+        wake = self._wake
+        playing = False
+        while True:
+            transport = self.transport
+            if transport == Transport.PLAYING:
+                # fast path, no lock
+                if not playing or self._resync:
+                    if not playing and realtime.enabled:
+                        self.pattern.preallocate(self.channel)
+                    playing = True
+                    self._restart_clock()
+                self.main_loop()
+                continue
+            if playing:
+                playing = False
+                self._silence()
+            if transport == Transport.STOPPED:
+                self.pattern.reset()
+            elif transport == Transport.SHUTDOWN:
+                break
+            if realtime.enabled:
+                realtime.safe_point(full=True)
+            wake.wait(idle_timeout)  # Block execution until transport changes.
+            wake.clear()
+
+    def _silence(self):
+        """Stop notes played by pattern (targeted note offs) and clock output"""
+        if self.clock_out:
+            self.clock_out.stop()
+        self.pattern.silence(self.channel)
+        if self._silence_requested:
+            self.silence_latency.add(time.perf_counter_ns() - self._silence_requested)
+            self._silence_requested = 0
 
     def worker(self):
         """Variable time worker function.
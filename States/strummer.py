@@ -1,70 +1,95 @@
-from States.baseState import State
+from States.baseState import State, route
+from midi_event import EventType
 import padKontrol as pk
 import time
 import utils
-from collections import deque
+from array import array
+from collections import deque, namedtuple
 from rtmidi.midiconstants import ALL_SOUND_OFF, ALL_NOTES_OFF
 import midi_ports as mp
 import decorators
-from collections import deque
-from math import isclose
-from queue import Queue
+from scheduler import shared_timer
 
 
-class SetQueue(Queue):
-    """Custom set type queue to remove duplicates
-    """
-
-    def _init(self, maxsize):
-        self.queue = set()
-
-    def _put(self, item):
-        self.queue.add(item)
-
-    def _get(self):
-        return self.queue.pop()
-
-    def __repr__(self):
-        return f"{self.queue}"
-
+class Chord(namedtuple("Chord", ["pitch", "voicing", "notes", "positions", "zones"])):
+    """Prebuilt strum chord
 
-class Strum:
-    """Container for strum notes and velocities
+    Arguments:
+        pitch {int} -- root note
+        voicing {string} -- voicing name
+        notes {tuple} -- note of every string
+        positions {list} -- x/y pad position of every string
+        zones {array} -- string of every x/y pad value, shared by chords
+            with the same number of strings (see `utils.zone_table`)
     """
 
-    def __init__(self, pitch, velocity):
-        self.pitch = pitch
-        self.velocity = velocity
+    __slots__ = ()
 
-    def __eq__(self, other):
-        return self.pitch == other.pitch
 
-    def __hash__(self):
-        return hash(self.pitch)
+class StrumEngine:
+    """Plays strums on shared timer thread (see `scheduler.shared_timer`).
 
-    def __repr__(self):
-        return f"({self.pitch}, {self.velocity})"
+    Every string sounds one note at time: re-struck string steals its voice,
+    pending note on/off events of previous strike are invalidated by string
+    generation counter.
 
+    Arguments:
+        channel {int} -- midi channel 0-15
 
-class Chords:
-    """Container for strum chords
+    Keyword Arguments:
+        strings {int} -- max number of strings (default: {16})
+        sustain_ns {int} -- note length if string is not re-struck (default: {1s})
     """
 
-    def __init__(self, pitch, notes=None):
-        self.pitch = pitch
-        self.notes = notes
-
-    def add_note(self):
-        pass
-
-    def remove_note(self):
-        pass
-
-    def change_pitch(self):
-        pass
-
-    def get_notes(self):
-        return self.notes[1]
+    def __init__(self, channel, strings=16, sustain_ns=1_000_000_000):
+        self.channel = channel
+        self.sustain_ns = sustain_ns
+        self._timer = shared_timer()
+        self._generation = array("L", [0]) * strings
+        self._sounding = array("b", [-1]) * strings  # note of string, -1 if silent
+
+    def strike(self, strings, notes, velocity, spacing_ns):
+        """Schedule strum notes
+
+        Arguments:
+            strings {iterable} -- struck strings in play order
+            notes {list} -- note of every string
+            velocity {int} -- note velocity 1-127
+            spacing_ns {int} -- delay between consecutive strings
+        """
+        schedule = self._timer.schedule
+        generations = self._generation
+        start = time.perf_counter_ns()
+        for idx, string in enumerate(strings):
+            generation = generations[string] = (generations[string] + 1) & 0xFFFFFFFF
+            at = start + idx * spacing_ns
+            schedule(at, self._note_on, (string, generation, notes[string], velocity))
+            schedule(at + self.sustain_ns, self._note_off, (string, generation))
+
+    def release_all(self):
+        """Invalidate pending strikes and stop sounding notes"""
+        for string, note in enumerate(self._sounding):
+            self._generation[string] = (self._generation[string] + 1) & 0xFFFFFFFF
+            if note >= 0:
+                mp.note_off(self.channel, note)
+                self._sounding[string] = -1
+
+    def _note_on(self, event):
+        string, generation, note, velocity = event
+        if generation != self._generation[string]:
+            return  # string re-struck before note started
+        sounding = self._sounding[string]
+        if sounding >= 0:
+            mp.note_off(self.channel, sounding)  # steal voice
+        mp.note_on(self.channel, note, velocity)
+        self._sounding[string] = note
+
+    def _note_off(self, event):
+        string, generation = event
+        if generation != self._generation[string]:
+            return  # note stolen by next strike
+        mp.note_off(self.channel, self._sounding[string])
+        self._sounding[string] = -1
 
 
 class Strummer(State):
@@ -99,9 +124,56 @@ class Strummer(State):
         ]
     )
 
+    # max distance of x/y pad value from string position
+    strum_tolerance = 2
+    max_strings = 16
+    # max time between first and last string of strum
+    strum_window_ns = 60_000_000
+    # x/y pad packets further apart belong to different sweeps
+    sweep_timeout_ns = 50_000_000
+    base_pitch = 48
+    # scale degree offsets of pad chords (major scale with octave)
+    degrees = utils.pattern_to_scale([0, 2, 2, 1, 2, 2, 2, 1])
+    # voicing of pad chords: first, fourth and fifth major, leading note
+    # diminished, others minor
+    degree_voicings = (0, 1, 1, 0, 0, 1, 2, 0)
+    _chord_bank = None  # chords by (key, degree, voicing) index
+
+    @classmethod
+    def compile_chord_bank(cls):
+        """Precompute chords of all keys, scale degrees and voicings"""
+        zones = {}
+        bank = []
+        for key in range(12):
+            for degree in cls.degrees:
+                pitch = cls.base_pitch + key + degree
+                for name, intervals in cls.strum_voicing:
+                    count = len(intervals)
+                    if count not in zones:
+                        positions = utils.pad_intervals(count)
+                        zones[count] = (
+                            positions,
+                            utils.zone_table(positions, cls.strum_tolerance),
+                        )
+                    positions, table = zones[count]
+                    notes = tuple(pitch + interval for interval in intervals)
+                    bank.append(Chord(pitch, name, notes, positions, table))
+        cls._chord_bank = tuple(bank)
+
+    @classmethod
+    def bank_chord(cls, key, degree, voicing):
+        """Get prebuilt chord
+
+        Arguments:
+            key {int} -- key 0-11 (C-B)
+            degree {int} -- scale degree index (see `degrees`)
+            voicing {int} -- index of `strum_voicing`
+        """
+        index = (key * len(cls.degrees) + degree) * len(cls.strum_voicing) + voicing
+        return cls._chord_bank[index]
+
     def __init__(self,):
         super().__init__()
-        self.hotkeys = set()
         self._LOCAL_COMBINATIONS = {
             # frozenset([pk.BUTTON_PEDAL, pk.ROTARY_KNOB]): self.change_mode,
             # frozenset([pk.BUTTON_FLAM, pk.ROTARY_KNOB]): self.transpose_12,
@@ -109,8 +181,14 @@ class Strummer(State):
         }
         self.channel = 1
         self.led_text = None
-        self.strum_queue = SetQueue()
-        self.strum_chords = deque()
+        self._zones = array("b", [-1]) * 128  # string of x/y pad value
+        # strings struck by current sweep, bit per string
+        self._strings = 0
+        self._direction = 1  # sweep direction on x axis
+        self._last_x = 0
+        self._last_time = 0
+        self.engine = StrumEngine(self.channel, self.max_strings)
+        self.key = 0
         self.strum = None
         self.chord = None
         self.strum_notes = None
@@ -119,33 +197,29 @@ class Strummer(State):
     def load_state(self):
         # TODO scale pattern
         mp.led(self.state_name)
-        major_scale = utils.pattern_to_scale([0, 2, 2, 1, 2, 2, 2, 1])
-        for idx, n in enumerate(major_scale):
-            if idx in [0, 3, 4, 7]:  # first, fourth and fifth
-                notes = self.strum_voicing[0]
-            elif idx == 6:  # leading note
-                notes = self.strum_voicing[2]
-            else:
-                notes = self.strum_voicing[1]
-
-            i = Chords(pitch=48 + n, notes=notes)
-            self.strum_chords.append(i)
         self.load_strum(0)
 
+    def _pause(self, data=None):
+        """Stop strummed notes on state change"""
+        self.engine.release_all()
+
     def load_strum(self, x):
-        try:
-            self.strum = self.strum_chords[x]
-
-            notes = self.strum.notes[1]
-            self.chord = [x + self.strum.pitch for x in notes]
-            self.strum_notes = utils.pad_intervals(len(self.chord))
-            # light on pads
-            pads = self.ordered[: len(self.strum_chords)]
-            mp.group_light_on(pads)
-            # blink active
-            mp.light_blink(self.ordered[x])
-        except:
-            pass
+        """Select chord of pad
+
+        Arguments:
+            x {int} -- scale degree index of pad
+        """
+        if x >= len(self.degrees):
+            return
+        self.strum = self.bank_chord(self.key, x, self.degree_voicings[x])
+        self.chord = self.strum.notes
+        self.strum_notes = self.strum.positions
+        self._zones = self.strum.zones
+        # light on pads
+        pads = self.ordered[: len(self.degrees)]
+        mp.group_light_on(pads)
+        # blink active
+        mp.light_blink(self.ordered[x])
 
     def handle_pad(self, sysEx):
         self.load_strum(self.ordered[sysEx.control])
@@ -159,47 +233,66 @@ class Strummer(State):
     #     self.strum_chords.rotate(1)
     # self.load_strum()
 
-    def handle_button(self, sysEx):
-        if sysEx.control == pk.BUTTON_PAD:
-            pass
-            # self.handle_xy_pad(sysEx)
+    @route(EventType.BUTTON, pk.BUTTON_PAD)
+    def end_sweep(self, sysEx):
+        """x/y pad touch released"""
+        if sysEx.state == 0:
+            self._strings = 0
+            self._last_time = 0
 
     def handle_xy_pad(self, sysEx):
         """x/y pad during fast sliding does not always return precise values,
-        tolerance value from `math.isclose` reduce sensitivity of receiving values,
-        custom strum_queue removes duplicate values within tolerance range
+        `strum_tolerance` (baked in zone table) reduce sensitivity of receiving
+        values, strings bitmap removes duplicate values within tolerance range
 
         Caution: for slower tempos keep tolerance value small to send midi
         as fast as sysex value leaves strum range, for higher tempos it is recommended
         to increate tolerance value to catch x/y pad data
         """
-        alist = [isclose(sysEx.data[0], x, abs_tol=2) for x in self.strum_notes]
-        # check, if value is in range of any strum
-        if any(alist):
-            # find index of triggered strum
-            idx = alist.index(True)
-            # add strum pitch and velocity of first occurence and handle any duplicates in same range
-            self.strum_queue.put_nowait(Strum(self.chord[idx], sysEx.data[1]))
+        x, y = sysEx.data
+        now = time.perf_counter_ns()
+        dx = x - self._last_x
+        dt = now - self._last_time
+        self._last_x = x
+        self._last_time = now
+        if dt > self.sweep_timeout_ns:
+            dx = 0
+            self._strings = 0
+        elif dx and (dx > 0) != (self._direction > 0):
+            # reversed sweep strums again
+            self._direction = 1 if dx > 0 else -1
+            self._strings = 0
+        string = self._zones[x]
+        if string >= 0 and not self._strings >> string & 1:
+            self.send_strum(string, y, abs(dx), dt)
+
+    def send_strum(self, string, velocity, dx=0, dt=0):
+        """Strum strings from touched string in sweep direction,
+        strings are spread by sweep speed within `strum_window_ns`
+
+        Arguments:
+            string {int} -- first struck string
+            velocity {int} -- y axis value
+
+        Keyword Arguments:
+            dx {int} -- x distance from previous x/y pad packet (default: {0})
+            dt {int} -- time from previous x/y pad packet in ns (default: {0})
+        """
+        count = len(self.chord)
+        if self._direction > 0:
+            strings = range(string, count)
+        else:
+            strings = range(string, -1, -1)
+        max_spacing = self.strum_window_ns // max(1, count - 1)
+        if dx:
+            # time to sweep from string to string
+            gap = 128 / (count + 1)
+            spacing = min(max_spacing, int(gap * dt / dx))
         else:
-            # send strum in midi
-            self.send_strum()
+            spacing = max_spacing
+        for struck in strings:
+            self._strings |= 1 << struck
+        self.engine.strike(strings, self.chord, max(1, velocity), spacing)
 
-    def send_strum(self):
-        """Send strum values as midi
-        """
-        while not self.strum_queue.empty():
-            try:
-                strum = self.strum_queue.get_nowait()
-                mp.send_midi(
-                    dict(
-                        type="note_on",
-                        note=strum.pitch,
-                        velocity=strum.velocity,
-                        channel=self.channel,
-                    )
-                )
-                # mp.send_midi(
-                #     dict(type="note_off", note=note, velocity=0, channel=self.channel)
-                # )
-            except:
-                pass
+
+Strummer.compile_chord_bank()
@@ -0,0 +1,566 @@
+#!/usr/bin/env python
+"""Microbenchmarks of hot paths.
+
+Usage:
+    python benchmarks.py [name ...]
+
+Runs all benchmarks if no name is given.
+"""
+
+import sys
+import timeit
+
+import padKontrol as pk
+from kontrol_listener import PadKontrolPrint
+from midi_event import EventType, SysexEvent
+
+BENCHMARKS = {}
+
+
+def benchmark(func):
+    BENCHMARKS[func.__name__[len("bench_") :]] = func
+    return func
+
+
+def report(name, number, seconds):
+    print(
+        f"{name:<40} {number / seconds:>14,.0f} ops/s {seconds / number * 1e6:>9.3f} us"
+    )
+
+
+class _NullListener:
+    def notify(self, msg):
+        pass
+
+
+class _LegacyInput(pk.PadKontrolInput):
+    """Byte by byte SysEx dispatch through `on_*` handlers creating new
+    event per packet, input path replaced by `kontrol_listener.SysexDecoder`
+    """
+
+    def __init__(self, listener):
+        self._listener = listener
+
+    def on_pad_down(self, pad, velocity):
+        self._listener.notify(SysexEvent(EventType.PAD, pad, pk.NOTE_ON, velocity))
+
+    def on_pad_up(self, pad):
+        self._listener.notify(SysexEvent(EventType.PAD, pad, pk.NOTE_OFF, 0))
+
+    def on_button_down(self, button):
+        self._listener.notify(SysexEvent(EventType.BUTTON, button, 1))
+
+    def on_button_up(self, button):
+        self._listener.notify(SysexEvent(EventType.BUTTON, button, 0))
+
+    def on_knob(self, knob, value):
+        self._listener.notify(SysexEvent(EventType.KNOB, knob, 1, value))
+
+    def on_rotary(self, val):
+        self._listener.notify(SysexEvent(EventType.ROTARY, pk.ROTARY_KNOB, 1, val))
+
+    def on_x_y(self, x, y):
+        self._listener.notify(SysexEvent(EventType.XY_PAD, pk.BUTTON_PAD, 1, (x, y)))
+
+
+def _xy_sweep():
+    """Native mode packets of x/y pad sweep and pad hits"""
+    packets = []
+    for x in range(128):
+        packets.append(pk._SYSEX_COMMON + [0x4B, x, 127 - x, 0xF7])
+    for pad in pk.ALL_PADS:
+        packets.append(pk._SYSEX_COMMON + [0x45, 64 + pad, 100, 0xF7])
+        packets.append(pk._SYSEX_COMMON + [0x45, pad, 0, 0xF7])
+    return packets
+
+
+@benchmark
+def bench_decoder(number=200):
+    """Compare byte by byte SysEx decoding with table driven decoder"""
+    packets = _xy_sweep()
+    listener = PadKontrolPrint()
+    listener.register(_NullListener())
+    legacy_input = _LegacyInput(_NullListener())
+
+    def legacy():
+        for packet in packets:
+            sysex_buffer = []
+            for byte in packet:
+                sysex_buffer.append(byte)
+                if byte == 0xF7:
+                    legacy_input.process_sysex(sysex_buffer)
+                    del sysex_buffer[:]
+
+    def table():
+        for packet in packets:
+            listener.process_bytes(packet)
+
+    for name, func in (("decoder: legacy", legacy), ("decoder: table", table)):
+        func()  # warm up interned events
+        report(name, number * len(packets), timeit.timeit(func, number=number))
+
+
+@benchmark
+def bench_input(number=200):
+    """Compare mido callback input path with raw rtmidi callback path"""
+    import mido
+
+    packets = _xy_sweep()
+    listener = PadKontrolPrint()
+    listener.register(_NullListener())
+
+    def mido_callback():
+        for packet in packets:
+            # rtmidi callback wrapper of mido input port
+            listener.callback(mido.Message.from_bytes(packet))
+
+    def raw_callback():
+        for packet in packets:
+            listener.raw_callback((packet, 0.001))
+
+    for name, func in (("input: mido", mido_callback), ("input: raw", raw_callback)):
+        func()
+        report(name, number * len(packets), timeit.timeit(func, number=number))
+
+
+@benchmark
+def bench_midi_out(number=100000):
+    """Compare mido.Message dict API with raw bytes note API"""
+    import mido
+    import midi_ports as mp
+
+    class SinkPort(mido.ports.BaseOutput):
+        def _send(self, msg):
+            pass
+
+    port = SinkPort()
+
+    def mido_dict():
+        port.send(mido.Message(type="note_on", channel=1, note=36, velocity=100))
+
+    mp._write_data = len  # raw writer stand-in
+
+    def shim():
+        mp.send_midi(dict(type="note_on", channel=1, note=36, velocity=100))
+
+    def raw():
+        mp.note_on(1, 36, 100)
+
+    for name, func in (
+        ("midi out: mido.Message", mido_dict),
+        ("midi out: send_midi dict", shim),
+        ("midi out: note_on", raw),
+    ):
+        report(name, number, timeit.timeit(func, number=number))
+
+
+def _stacked_press_light(func):
+    """`press_light` as stacked decorator, sending its light on its own"""
+    import midi_ports as mp
+    from functools import wraps
+
+    @wraps(func)
+    def wrapped(*args, **kwargs):
+        sysEx = args[1] if len(args) > 1 else args[0]
+        if sysEx.state in (pk.NOTE_ON, 1):
+            mp.light_on(sysEx.control)
+        else:
+            mp.light_off(sysEx.control)
+        return func(*args, **kwargs)
+
+    return wrapped
+
+
+@benchmark
+def bench_light_policy(number=50000):
+    """Compare stacked light decorator with compiled light policy
+    on `FreeState.play_note` (pad press and release)"""
+    import time
+    import midi_ports as mp
+    from midi_event import EventType, SysexEvent
+    from recorder import SinkPort
+    from States.free import FreeState
+
+    out, data = SinkPort("padKontrol"), SinkPort("data")
+    mp.install_ports(out, data, threaded=False)
+    state = FreeState()
+    state.load_state()
+    press = SysexEvent(EventType.PAD, 3, pk.NOTE_ON, 100)
+    release = SysexEvent(EventType.PAD, 3, pk.NOTE_OFF, 0)
+
+    stacked = _stacked_press_light(FreeState.play_note._light_handler)
+    compiled = FreeState.play_note
+
+    def run(handler):
+        def hit():
+            handler(state, press)
+            handler(state, release)
+
+        return hit
+
+    for name, handler in (("stacked", stacked), ("compiled", compiled)):
+        report(
+            f"light policy: {name} (direct)",
+            number,
+            timeit.timeit(run(handler), number=number),
+        )
+
+    # pad hits 1 ms apart through output thread, writer idle between events,
+    # latency from handler call to the last written note / light message
+    written = []
+
+    def stamp(message):
+        written.append(time.perf_counter_ns())
+
+    out.send_bytes = data.send_bytes = stamp
+    mp.install_ports(out, data)
+    writer = mp._writer
+    events = (press, release) * 200
+    for name, handler in (("stacked", stacked), ("compiled", compiled)):
+        wakes = writer.wakes
+        latency = []
+        for event in events:
+            del written[:]
+            start = time.perf_counter_ns()
+            handler(state, event)
+            time.sleep(0.001)
+            latency.append(written[-1] - start)
+        latency.sort()
+        print(
+            f"light policy: {name} (writer) output "
+            f"p50 {latency[len(latency) // 2] / 1000:.1f} us "
+            f"p99 {latency[len(latency) * 99 // 100] / 1000:.1f} us, "
+            f"{(writer.wakes - wakes) / len(events):.2f} wakes/event"
+        )
+    mp.stop_writer()
+
+
+@benchmark
+def bench_pattern(steps=256, rounds=20):
+    """Per-step cost of Drumpattern playback for growing number of tracks"""
+    import random
+    import midi_ports as mp
+    from States.drumpattern import Drumpattern
+
+    mp._write_out = mp._write_data = len  # raw writers stand-in
+    rng = random.Random(1)
+    for tracks in (4, 16, 64):
+        pattern = Drumpattern(tracks=tracks, steps=steps)
+        for track in range(tracks):
+            instrument = pattern.add_instrument(note=track % 128)
+            for step in range(steps):
+                if rng.random() < 1 / 16:  # sparse, ~4 hits per step for 64 tracks
+                    instrument.strokes[step] = rng.randrange(1, 128)
+        pattern.load_current_instrument()
+        hits = sum(bin(mask).count("1") for mask in pattern.grid.masks)
+
+        def play():
+            for _ in range(steps):
+                pattern.playstep(120)
+
+        seconds = timeit.timeit(play, number=rounds)
+        report(f"pattern: {tracks} tracks", rounds * steps, seconds)
+        print(f"{'':<40} {hits / steps:>14.2f} hits/step")
+
+
+@benchmark
+def bench_strum(strums=40, bpm=200):
+    """Timer lateness of Strummer strums repeated at 16th notes"""
+    import time
+    import midi_ports as mp
+    from midi_event import EventType, SysexEvent
+    from recorder import SinkPort
+    from States.strummer import Strummer
+
+    mp.install_ports(SinkPort("padKontrol"), SinkPort("data"))
+    state = Strummer()
+    state.load_state()
+    timer = state.engine._timer
+    timer.lateness.reset()
+    period = 60 / bpm / 4
+    sweeps = [range(0, 128, 8), range(127, -1, -8)]  # down and up strums
+
+    started = time.perf_counter()
+    for strum in range(strums):
+        for x in sweeps[strum % 2]:
+            state.handle_xy_pad(SysexEvent(EventType.XY_PAD, 0, 1, (x, 100)))
+        time.sleep(max(0, started + (strum + 1) * period - time.perf_counter()))
+    backlog = sum(
+        1 for event in timer.scheduler._queue if event.tick <= time.perf_counter_ns()
+    )
+    print(f"strum: {strums} strums at {bpm} bpm, due backlog {backlog}")
+    print(timer.lateness.summary())
+    mp.stop_writer()
+
+
+@benchmark
+def bench_clock(bpm=120, seconds=2.0):
+    """Jitter of MIDI clock output and note to clock offset of ReDrum
+    on loopback data port, tempo changes in the middle of run"""
+    import time
+    import midi_ports as mp
+    from midi_clock import CLOCK
+    from midi_event import EventType, SysexEvent
+    from scheduler import LatenessStats
+    from States.redrum import ReDrumState
+
+    mp.connect(backend="loopback_backend")
+    state = ReDrumState()
+    state.set_tempo(bpm)
+    state.send_clock()
+    state.pattern.initialize()
+    for step in range(0, 16, 4):
+        state.pattern.instruments[0].strokes[step] = 100
+    state.pattern.load_current_instrument()
+    state.start()
+    time.sleep(0.4)  # instrument warm-up of sequencer thread
+    log = mp.get_midi_out_data().log
+    log.clear()
+    state.resume_seq(SysexEvent(EventType.BUTTON, pk.BUTTON_VELOCITY, 1, None))
+    time.sleep(seconds / 2)
+    changed = time.perf_counter_ns()
+    state.set_tempo(bpm * 3 // 2)
+    time.sleep(seconds / 2)
+    print("clock: tick lateness", state.timing_stats())
+    state.pause()
+    time.sleep(0.1)
+
+    records = list(log)
+    ticks = [stamp for stamp, message in records if message[0] == CLOCK]
+    settled = changed + 2 * 60e9 / (bpm * 24)  # new tempo from the next tick
+    for name, tempo, segment in (
+        (f"{bpm} bpm", bpm, [t for t in ticks if t < changed]),
+        (f"{bpm * 3 // 2} bpm", bpm * 3 // 2, [t for t in ticks if t > settled]),
+    ):
+        period = 60e9 / (tempo * 24)
+        stats = LatenessStats()
+        for previous, stamp in zip(segment[1:], segment[2:]):
+            stats.add(int(stamp - previous - period))
+        print(f"clock: {name}, {len(segment)} ticks, interval error", stats.summary())
+
+    offsets = LatenessStats()
+    last_tick = None
+    for stamp, message in records:
+        if message[0] == CLOCK:
+            last_tick = stamp
+        elif message[0] & 0xF0 == 0x90 and last_tick:
+            offsets.add(stamp - last_tick)
+    print("clock: note after clock tick", offsets.summary())
+    print(mp.stop_writer())
+    mp.close_native()
+
+
+@benchmark
+def bench_transport(pauses=50, bpm=120):
+    """Pause to silence latency of ReDrum thread and engine process,
+    pauses at random time within step interval"""
+    import random
+    import time
+    import midi_ports as mp
+    from recorder import SinkPort
+    from States.redrum import ReDrumState
+
+    mp.install_ports(SinkPort("padKontrol"), SinkPort("data"))
+    for mode in ("thread", "process"):
+        state = ReDrumState()
+        state.set_tempo(bpm)
+        if mode == "process":
+            state.run_in_process(backend="loopback_backend")
+        state.load_state()
+        for instrument in state.pattern.instruments:
+            instrument.strokes[0] = 100
+        if state.engine:
+            state.engine.publish()
+        time.sleep(0.4)  # instrument warm-up of sequencer thread
+        rng = random.Random(1)
+        for _ in range(pauses):
+            state.play()
+            time.sleep(state.interval * rng.uniform(1, 2))
+            state.pause()
+            time.sleep(0.01)
+        print(f"transport: {mode}, {pauses} pauses at {bpm} bpm", state.silence_stats())
+        state.shutdown()
+    mp.close_native()
+
+
+@benchmark
+def bench_realtime(seconds=2.0, bpm=240):
+    """Step lateness and gc pauses of ReDrum thread next to allocating
+    thread with default gc and in realtime mode, with output thread
+    counters and wake-up lateness of (not promoted) input thread"""
+    import threading
+    import time
+    import midi_ports as mp
+    import realtime
+    from recorder import SinkPort
+    from scheduler import LatenessStats
+    from States.redrum import ReDrumState
+
+    heap = [[index] for index in range(300000)]  # traversed by full collections
+    running = True
+    packets = _xy_sweep()
+    listener = PadKontrolPrint()
+    listener.register(_NullListener())
+    input_lateness = LatenessStats()
+
+    def garbage():
+        while running:
+            for _ in range(1000):
+                cycle = []
+                cycle.append(cycle)
+            time.sleep(0.0005)
+
+    def controller(period_ns=1_000_000):
+        """Input callback thread polled every millisecond"""
+        deadline = time.perf_counter_ns()
+        index = 0
+        while running:
+            deadline += period_ns
+            time.sleep(max(0, deadline - time.perf_counter_ns()) / 1e9)
+            now = time.perf_counter_ns()
+            input_lateness.add(now - deadline)
+            deadline = max(deadline, now)
+            listener.process_bytes(packets[index % len(packets)])
+            index += 1
+
+    mp.install_ports(SinkPort("padKontrol"), SinkPort("data"), threaded=False)
+    realtime.track_gc()
+    threading.Thread(target=garbage, daemon=True).start()
+    threading.Thread(target=controller, daemon=True).start()
+    for mode in ("default gc", "realtime"):
+        if mode == "realtime":
+            realtime.enable()
+            realtime.freeze()
+        mp.start_writer()  # promoted in realtime mode
+        state = ReDrumState()
+        state.set_tempo(bpm)
+        state.load_state()
+        for instrument in state.pattern.instruments:
+            for step in range(0, 16, 2):
+                instrument.strokes[step] = 100
+        time.sleep(0.4)  # instrument warm-up of sequencer thread
+        realtime.reset()
+        input_lateness.reset()
+        state.play()
+        time.sleep(seconds)
+        stats = state.timing_stats()
+        state.shutdown()
+        print(f"realtime: {mode}, {len(heap)} live objects", stats)
+        print("realtime: input lateness", input_lateness.summary())
+        print("realtime: output", mp.stop_writer())
+        realtime.dump()
+    running = False
+    realtime.disable()
+    realtime.track_gc(False)
+    mp.close_native()
+
+
+@benchmark
+def bench_engine(seconds=2.0, bpm=240):
+    """Step lateness of ReDrum thread and engine process during x/y pad
+    flood on loopback backend"""
+    import time
+    import loopback_backend
+    import midi_ports as mp
+    from main import Context
+    from midi_event import EventType, SysexEvent
+    from States.redrum import ReDrumState
+
+    mp.connect(backend="loopback_backend")
+    listener = PadKontrolPrint()
+    context = Context()
+    listener.register(context)
+    mp.start_native(listener.raw_callback, raw=True)
+    press = SysexEvent(EventType.BUTTON, pk.BUTTON_VELOCITY, 1, None)
+
+    for mode in ("thread", "process"):
+        state = ReDrumState()
+        state.set_tempo(bpm)
+        if mode == "process":
+            state.run_in_process(backend="loopback_backend")
+        context._states.clear()
+        context.add_state(state)
+        context.load_state()
+        for instrument in state.pattern.instruments:
+            for step in range(0, 16, 2):
+                instrument.strokes[step] = 100
+        time.sleep(0.5)  # sequencer warm-up
+        state.resume_seq(press)
+        floods = 0
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            for x in range(128):
+                loopback_backend.device.xy(x, 127 - x)
+            floods += 128
+        stats = state.timing_stats()
+        state.pause()
+        print(f"engine: {mode}, {floods / seconds:,.0f} x/y events/s", stats)
+        state.shutdown()
+
+    mp.close_native()
+
+
+@benchmark
+def bench_pipeline(number=20000):
+    """Events/s of full Context pipeline on loopback backend (FreeState)"""
+    import random
+    import loopback_backend
+    import midi_ports as mp
+    from main import Context
+    from States.free import FreeState
+
+    mp.connect(backend="loopback_backend")
+    listener = PadKontrolPrint()
+    context = Context()
+    context._states.clear()  # states are class attribute, shared by contexts
+    context.add_state(FreeState())
+    listener.register(context)
+    mp.start_native(listener.raw_callback, raw=True)
+    context.load_state()
+
+    rng = random.Random(1)
+
+    def events():
+        for _ in range(number):
+            loopback_backend.device.random_event(rng)
+
+    report("pipeline: loopback", number, timeit.timeit(events, number=1))
+    print(mp.stop_writer())
+    mp.close_native()
+
+
+# module state of midi_ports replaced by benchmarks
+_PORT_STATE = (
+    "_midi_in",
+    "_midi_out",
+    "_midi_out_data",
+    "_write_out",
+    "_write_data",
+    "_writer",
+)
+
+
+def isolated(func):
+    """Run benchmark, stop threads it left running and restore ports and
+    writers of `midi_ports` it replaced, so benchmarks do not leak into
+    each other"""
+    import midi_ports as mp
+
+    saved = {name: getattr(mp, name) for name in _PORT_STATE}
+    try:
+        func()
+    finally:
+        while mp._close_hooks:
+            mp._close_hooks.pop()()  # threads left running by benchmark
+        mp.stop_writer()
+        for name, value in saved.items():
+            setattr(mp, name, value)
+
+
+def main(names):
+    for name in names or BENCHMARKS:
+        isolated(BENCHMARKS[name])
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
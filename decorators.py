@@ -1,68 +1,157 @@
-from functools import wraps
+from collections import namedtuple
+from functools import partial, update_wrapper
 from midi_ports import (
+    begin_batch,
     led,
-    led_blink,
+    led_reset,
     light_blink,
     light_flash,
-    light_off,
-    light_on,
-    translate_to_led,
+    surface,
 )
 import padKontrol as pk
 
+_PRESSED = (pk.NOTE_ON, 1)
 
-def press_light(func):
-    """sysEx light decorator:
-    Turn on light on button press and turn off on release
+
+class LightPolicy(
+    namedtuple("LightPolicy", ["press", "release", "flash", "press_only", "reset_led"])
+):
+    """Light feedback and event filter of sysEx handler.
+
+    Arguments:
+        press {string} -- light action on press: "on", "off", "blink", "flash"
+        release {string} -- light action on release: "off"
+        flash {float} -- oneshot light duration of "flash" action
+        press_only {bool} -- call handler only on press event
+        reset_led {string/bool} -- on release display handler object attribute
+            of this name (or the string itself), True clears led display
     """
 
-    @wraps(func)
-    def wrapped(*args, **kwargs):
-        sysEx = args[1] if len(args) > 1 else args[0]
-        if sysEx.state in (pk.NOTE_ON, 1):
-            light_on(sysEx.control)
-        else:
-            light_off(sysEx.control)
-        return func(*args, **kwargs)
+    __slots__ = ()
+
+
+LightPolicy.__new__.__defaults__ = (None, None, 0.3, False, None)
+
+
+def _light_action(action, duration):
+    if action == "on":
+        return surface.set
+    if action == "off":
+        return partial(surface.set, on=False)
+    if action == "blink":
+        return light_blink
+    if action == "flash":
+        return partial(light_flash, duration=duration)
+    return None
+
+
+def compile_policy(func, policy):
+    """Compile light policy of sysEx handler to single wrapper.
+
+    Light changes are applied to retained lights model (`midi_ports.surface`)
+    and rendered once after handler returns, together with lights changed
+    by handler itself. Output of handler and its lights is queued to
+    output thread in one batch (see `midi_ports.begin_batch`).
+
+    Arguments:
+        func {callable} -- sysEx handler method
+        policy {LightPolicy} -- handler light feedback
+
+    Returns:
+        callable -- wrapped handler
+    """
+    press = _light_action(policy.press, policy.flash)
+    release = _light_action(policy.release, policy.flash)
+    press_only = policy.press_only
+    reset_led = policy.reset_led
+    render = surface.render
+
+    follow_state = (policy.press, policy.release) == ("on", "off")
+    if follow_state and not press_only and reset_led is None:
+        # light follows controller state (`press_light`)
+        set_light = surface.set
+
+        def follow(self, sysEx, *args, **kwargs):
+            writer = begin_batch()
+            set_light(sysEx.control, sysEx.state in _PRESSED)
+            try:
+                return func(self, sysEx, *args, **kwargs)
+            finally:
+                render()
+                if writer is not None:
+                    writer.end_batch()
+
+        return follow
+
+    def wrapped(self, sysEx, *args, **kwargs):
+        writer = begin_batch()
+        try:
+            if sysEx.state in _PRESSED:
+                if press:
+                    press(sysEx.control)
+                return func(self, sysEx, *args, **kwargs)
+            if release:
+                release(sysEx.control)
+            if reset_led is True:
+                led_reset()
+            elif reset_led:
+                message = getattr(self, reset_led, reset_led)
+                if message is None:
+                    led_reset()
+                else:
+                    led(message)
+            elif not press_only:
+                return func(self, sysEx, *args, **kwargs)
+        finally:
+            render()
+            if writer is not None:
+                writer.end_batch()
 
     return wrapped
 
 
-def flash_light(duration=0.3):
-    """sysEx light decorator:
-    Oneshot light on button press
+def light_policy(**changes):
+    """sysEx handler decorator:
+    Update light policy of handler (see `LightPolicy`).
 
-    Keyword Arguments:
-        duration {float} -- range 0.0-1.0 (9ms - 279ms) (default: {0.3})
+    Stacked policy decorators are merged, outer decorator overrides
+    actions set by inner one, handler is wrapped only once.
     """
 
     def wrapper(func):
-        @wraps(func)
-        def wrapped(*args, **kwargs):
-            sysEx = args[1] if len(args) > 1 else args[0]
-            if sysEx.state in (pk.NOTE_ON, 1):
-                light_flash(sysEx.control, duration)
-            return func(*args, **kwargs)
-
+        handler = getattr(func, "_light_handler", func)
+        policy = getattr(func, "_light_policy", LightPolicy())._replace(**changes)
+        wrapped = update_wrapper(compile_policy(handler, policy), func)
+        wrapped._light_handler = handler
+        wrapped._light_policy = policy
         return wrapped
 
     return wrapper
 
 
-def blink_light(func):
+def press_light(func):
     """sysEx light decorator:
-    Blink light on button press
+    Turn on light on button press and turn off on release
+    """
+    return light_policy(press="on", release="off")(func)
 
+
+def flash_light(duration=0.3):
+    """sysEx light decorator:
+    Oneshot light on button press
+
+    Keyword Arguments:
+        duration {float} -- range 0.0-1.0 (9ms - 279ms) (default: {0.3})
     """
+    return light_policy(press="flash", flash=duration)
 
-    @wraps(func)
-    def wrapped(*args, **kwargs):
-        sysEx = args[1] if len(args) > 1 else args[0]
-        if sysEx.state in (pk.NOTE_ON, 1):
-            light_blink(sysEx.control)
-        return func(*args, **kwargs)
 
-    return wrapped
+def blink_light(func):
+    """sysEx light decorator:
+    Blink light on button press
+
+    """
+    return light_policy(press="blink")(func)
 
 
 def hold_light(func):
@@ -70,15 +159,7 @@ def hold_light(func):
     Turn on light on button press and hold on release
 
     """
-
-    @wraps(func)
-    def wrapped(*args, **kwargs):
-        sysEx = args[1] if len(args) > 1 else args[0]
-        if sysEx.state in (pk.NOTE_ON, 1):
-            light_on(sysEx.control)
-        return func(*args, **kwargs)
-
-    return wrapped
+    return light_policy(press="on")(func)
 
 
 def release_light(func):
@@ -86,15 +167,7 @@ def release_light(func):
     Turn off constant light on button press
 
     """
-
-    @wraps(func)
-    def wrapped(*args, **kwargs):
-        sysEx = args[1] if len(args) > 1 else args[0]
-        if sysEx.state in (pk.NOTE_ON, 1):
-            light_off(sysEx.control)
-        return func(*args, **kwargs)
-
-    return wrapped
+    return light_policy(press="off")(func)
 
 
 # ------- decorator functions to handle common events sysex messages ------
@@ -107,26 +180,12 @@ def action_on_press(reset_led=False, led_msg=None):
 
     Keyword Arguments:
         reset_led {bool} -- reset message on button release (default: {False})
-        led_msg {string} -- displayed message (default: {None})
+        led_msg {string} -- displayed message or name of attribute
+            with message, None clears display (default: {None})
 
     """
-
-    def wrapper(func):
-        @wraps(func)
-        def wrapped(*args, **kwargs):
-            sysEx = args[1] if len(args) > 1 else args[0]
-            if sysEx.state in (pk.NOTE_ON, 1):
-                return func(*args, **kwargs)
-            else:
-                if reset_led:
-                    m = led_msg
-                    try:
-                        m = getattr(args[0], led_msg)
-                    except:
-                        pass
-                    msg = translate_to_led(m)
-                    led(msg)
-
-        return wrapped
-
-    return wrapper
+    if reset_led:
+        reset_led = led_msg if led_msg is not None else True
+    else:
+        reset_led = None
+    return light_policy(press_only=True, reset_led=reset_led)
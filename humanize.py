@@ -0,0 +1,138 @@
+"""Pre-generated humanization jitter.
+
+Random velocity and timing deviations are generated ahead of time into
+ring buffers, playback only reads the next value. Every buffer is split
+in two halves: when playback leaves a half, the half is refilled by
+background thread while the other one is consumed.
+
+Buffers have independent generators seeded from `Humanizer` seed, so the
+same seed always produces the same sequence of deviations.
+"""
+
+import random
+import threading
+from array import array
+from collections import deque
+
+_refill = deque()  # (buffer, half) pending refill
+_refill_wake = threading.Event()
+_refiller = None
+
+
+def _refill_loop():
+    while True:
+        _refill_wake.wait()
+        _refill_wake.clear()
+        while _refill:
+            buffer, half = _refill.popleft()
+            buffer.fill(half)
+
+
+def _request_refill(buffer, half):
+    global _refiller
+    if _refiller is None:
+        _refiller = threading.Thread(
+            target=_refill_loop, name="HumanizeRefill", daemon=True
+        )
+        _refiller.start()
+    _refill.append((buffer, half))
+    _refill_wake.set()
+
+
+class JitterBuffer:
+    """Ring buffer of pre-generated integer samples
+
+    Arguments:
+        sample {callable} -- generator of single sample
+
+    Keyword Arguments:
+        size {int} -- number of samples, even (default: {1024})
+    """
+
+    def __init__(self, sample, size=1024):
+        self._sample = sample
+        self.values = array("l", [0]) * size
+        self._half = size // 2
+        self._ready = [False, False]  # half refilled since consumed
+        self._cursor = 0
+        self.overruns = 0  # halves reused before refill
+        self.fill(0)
+        self.fill(1)
+
+    def fill(self, half):
+        """Generate samples of buffer half"""
+        values = self.values
+        sample = self._sample
+        start = half * self._half
+        for index in range(start, start + self._half):
+            values[index] = sample()
+        self._ready[half] = True
+
+    def take(self):
+        """Get next sample"""
+        cursor = self._cursor
+        value = self.values[cursor]
+        cursor += 1
+        if cursor == len(self.values):
+            cursor = 0
+        if cursor % self._half == 0:
+            # half consumed, switch to the other one
+            current = cursor // self._half
+            consumed = 1 - current
+            self._ready[consumed] = False
+            _request_refill(self, consumed)
+            if not self._ready[current]:
+                self.overruns += 1
+        self._cursor = cursor
+        return value
+
+
+class Humanizer:
+    """Velocity and timing deviations of sequencer hits
+
+    Keyword Arguments:
+        velocity {float} -- standard deviation of velocity, ratio of
+            hit velocity (default: {0.0})
+        timing_ns {int} -- standard deviation of step time (default: {0})
+        seed {int} -- random seed, None for random sequence (default: {None})
+        size {int} -- samples per buffer (default: {1024})
+    """
+
+    def __init__(self, velocity=0.0, timing_ns=0, seed=None, size=1024):
+        self.velocity = velocity
+        self.timing_ns = timing_ns
+        self.seed = seed
+        velocity_rng = self._random("velocity")
+        timing_rng = self._random("timing")
+        sigma = velocity * 100
+
+        def velocity_sample():
+            return max(-100, min(100, round(velocity_rng.gauss(0, sigma))))
+
+        limit = 3 * timing_ns
+
+        def timing_sample():
+            return max(-limit, min(limit, round(timing_rng.gauss(0, timing_ns))))
+
+        # velocity deviation in percents of hit velocity
+        self.velocities = JitterBuffer(velocity_sample, size)
+        # step time deviation in nanoseconds
+        self.timings = JitterBuffer(timing_sample, size)
+
+    def _random(self, name):
+        if self.seed is None:
+            return random.Random()
+        return random.Random(f"{self.seed}/{name}")
+
+    def humanize_velocity(self, velocity):
+        """Deviate velocity by next sample, result is in range 1-127"""
+        velocity += velocity * self.velocities.take() // 100
+        if velocity < 1:
+            return 1
+        if velocity > 127:
+            return 127
+        return velocity
+
+    @property
+    def overruns(self):
+        return self.velocities.overruns + self.timings.overruns
@@ -1,60 +1,168 @@
 import padKontrol as pk
-from midi_event import SysexEvent
+import latency
+from midi_event import EventType, SysexEvent
 
+# native mode packet: F0 42 40 6E 08 <command> <control> <value> F7
+_PACKET_LENGTH = 9
 
-class PadKontrolPrint(pk.PadKontrolInput):
-    def __init__(self,):
-        super().__init__()
-        self._listener = None
 
-    def on_pad_down(self, pad, velocity):
-        # print("pad #%d down, velocity %d/127" % (pad, velocity))
-        self.send_msg(SysexEvent("pad", pad, pk.NOTE_ON, velocity))
+def _pad_event(control, value):
+    if control >= 64:
+        return SysexEvent(EventType.PAD, control - 64, pk.NOTE_ON, value)
+    return SysexEvent(EventType.PAD, control, pk.NOTE_OFF, 0)
+
+
+def _button_event(control, value):
+    return SysexEvent(EventType.BUTTON, control + 16, 1 if value == 127 else 0)
+
+
+def _knob_event(control, value):
+    return SysexEvent(EventType.KNOB, control, 1, value)
+
+
+def _rotary_event(control, value):
+    # val: left = 127, right = 1
+    return SysexEvent(EventType.ROTARY, pk.ROTARY_KNOB, 1, value)
+
+
+def _xy_event(control, value):
+    return SysexEvent(EventType.XY_PAD, pk.BUTTON_PAD, 1, (control, value))
+
 
-    def on_pad_up(self, pad):
-        # print("pad #%d up" % pad)
-        self.send_msg(SysexEvent("pad", pad, pk.NOTE_OFF, 0))
+class SysexDecoder:
+    """Table driven decoder of padKontrol native mode packets.
 
-    def on_button_down(self, button):
-        #  print("button #%d down" % button)
-        self.send_msg(SysexEvent("button", button, 1))
+    Command byte selects interned events table, which is indexed by
+    packet control and value bytes. Events are immutable, so every packet
+    with the same content returns the same SysexEvent object. Missing events
+    are created on first use, pads, buttons, knobs and rotary encoder
+    events are created in advance.
+    """
 
-    def on_button_up(self, button):
-        #print("button #%d up" % button)
-        self.send_msg(SysexEvent("button", button, 0))
+    _FACTORIES = {
+        0x45: _pad_event,
+        0x48: _button_event,
+        0x49: _knob_event,
+        0x43: _rotary_event,
+        0x4B: _xy_event,
+    }
 
-    def on_knob(self, knob, value):
-        # print("knob #%d value = %d" % (knob, value))
-        self.send_msg(SysexEvent("knob", knob, 1, value))
+    def __init__(self):
+        self._factories = [None] * 256
+        self._events = [None] * 256
+        for command, factory in self._FACTORIES.items():
+            self._factories[command] = factory
+            self._events[command] = [None] * (128 * 128)
+        self.prefill(0x45, range(64, 64 + len(pk.ALL_PADS)), range(128))
+        self.prefill(0x45, pk.ALL_PADS, [0])
+        self.prefill(0x48, range(len(pk.ALL_BUTTONS)), [0, 127])
+        self.prefill(0x49, [pk.KNOB_1, pk.KNOB_2], range(128))
+        self.prefill(0x43, [0], [pk.ROTARY_KNOB_RIGHT, pk.ROTARY_KNOB_LEFT])
 
-    # def on_rotary_left(self):
-    #     print("rotary turned left")
-    #     self.send_msg(SysexEvent("rotary", pk.ROTARY_KNOB, 0))
+    def prefill(self, command, controls, values):
+        """Create events in advance
 
-    # def on_rotary_right(self):
-    #     print("rotary turned right")
-    #     self.send_msg(SysexEvent("rotary", pk.ROTARY_KNOB, 1))
+        Arguments:
+            command {int} -- packet command byte
+            controls {iterable} -- packet control bytes
+            values {iterable} -- packet value bytes
+        """
+        for control in controls:
+            for value in values:
+                self.decode(command, control, value)
 
-    def on_rotary(self, val):
-        # print("ON ROTARY", val)
-        # val: left = 127, right = 1
-        self.send_msg(SysexEvent("rotary", pk.ROTARY_KNOB, 1, val))
+    def decode(self, command, control, value):
+        """Get event of native mode packet
 
-    def on_x_y(self, x, y):
-        # print("x/y pad (x = %d, y = %d)" % (x, y))
-        self.send_msg(SysexEvent("xy_pad", pk.BUTTON_PAD, 1, (x, y)))  # todo
+        Arguments:
+            command {int} -- packet command byte
+            control {int} -- packet control byte
+            value {int} -- packet value byte
+
+        Returns:
+            SysexEvent -- interned event or None for unknown command
+        """
+        events = self._events[command]
+        if events is None:
+            return None
+        key = control << 7 | value
+        event = events[key]
+        if event is None:
+            event = events[key] = self._factories[command](control, value)
+        return event
+
+
+class PadKontrolPrint(pk.PadKontrolInput):
+    def __init__(self,):
+        super().__init__()
+        self._listener = None
+        self._decoder = SysexDecoder()
+        self.delta = 0.0  # rtmidi delta time of last message
+        self.recorder = None  # raw input log, see `recorder.Recorder`
+        self.clock = 0.0  # sum of rtmidi delta times since first message
 
     def register(self, listener):
         self._listener = listener
 
-    def send_msg(self, msg):
-        self._listener.notify(msg)
-
     def callback(self, message):
         # logging.info(message)
-        sysex_buffer = []
-        for byte in message.bytes():
-            sysex_buffer.append(byte)
+        data = message.bytes()
+        if self.recorder:
+            self.recorder.record(data)
+        self.process_bytes(data)
+
+    def raw_callback(self, event, data=None):
+        """rtmidi input callback, see `midi_ports.set_callback`
+
+        Arguments:
+            event {tuple} -- message bytes and delta time from previous message
+        """
+        message, self.delta = event
+        self.clock += self.delta
+        if self.recorder:
+            self.recorder.record(message)
+        self.process_bytes(message)
+
+    def process_bytes(self, data):
+        """Decode SysEx bytes and notify listener
+
+        Arguments:
+            data {list/bytes} -- one or more complete SysEx messages
+        """
+        if len(data) == _PACKET_LENGTH:
+            # single native mode packet, read in place
+            if latency.enabled:
+                latency.begin()
+            event = self._decoder.decode(data[5], data[6], data[7])
+            if event is None:
+                self.on_invalid_sysex(data)
+            elif latency.enabled:
+                latency.mark(latency.DECODE)
+                self._listener.notify(event)
+                latency.mark(latency.DISPATCH)
+                latency.end()
+            else:
+                self._listener.notify(event)
+            return
+
+        # coalesced packets arrived together, later packets wait for
+        # earlier ones and their latency includes it
+        timed = latency.enabled
+        if timed:
+            latency.begin()
+        start = 0
+        for end, byte in enumerate(data):
             if byte == 0xF7:
-                self.process_sysex(sysex_buffer)
-                del sysex_buffer[:]  # empty list
+                packet = data[start : end + 1]
+                event = self._decoder.decode(packet[5], packet[6], packet[7])
+                if event is None:
+                    self.on_invalid_sysex(packet)
+                elif timed:
+                    latency.mark(latency.DECODE)
+                    self._listener.notify(event)
+                    latency.mark(latency.DISPATCH)
+                else:
+                    self._listener.notify(event)
+                start = end + 1
+        if timed:
+            latency.end()
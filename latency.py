@@ -0,0 +1,132 @@
+"""Optional end-to-end latency instrumentation.
+
+Controller event is timestamped on input callback entry, every next stage
+records time elapsed from that moment:
+    decode -- SysEx decoded to event,
+    dispatch -- event handled by active state (`Context.notify`),
+    write -- midi message written to data port by `MidiWriter`.
+
+Instrumentation is disabled by default, call sites check `latency.enabled`
+before calling any function of this module.
+"""
+
+import threading
+import time
+from array import array
+
+enabled = False
+
+DECODE = 0
+DISPATCH = 1
+WRITE = 2
+STAGES = ("decode", "dispatch", "write")
+
+_local = threading.local()
+
+
+class Histogram:
+    """HDR-style histogram of nanosecond values in fixed size array.
+
+    Values are counted in log-linear buckets: `2 ** SUB_BITS` linear
+    buckets per power of two, i.e. ~6% precision for 4 bits.
+    """
+
+    SUB_BITS = 4
+    SUB_COUNT = 1 << SUB_BITS
+    MAX_BITS = 40  # ~18 minutes
+
+    def __init__(self):
+        size = (self.MAX_BITS - self.SUB_BITS + 2) * self.SUB_COUNT
+        self.counts = array("Q", bytes(8 * size))
+        self.count = 0
+        self.max = 0
+
+    def reset(self):
+        for index in range(len(self.counts)):
+            self.counts[index] = 0
+        self.count = 0
+        self.max = 0
+
+    def record(self, value):
+        """Count value in nanoseconds"""
+        if value < 2 * self.SUB_COUNT:
+            index = max(0, value)
+        else:
+            shift = min(value.bit_length(), self.MAX_BITS) - self.SUB_BITS - 1
+            index = (shift + 1) * self.SUB_COUNT + (value >> shift) - self.SUB_COUNT
+            index = min(index, len(self.counts) - 1)
+        self.counts[index] += 1
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def bucket_value(self, index):
+        """Lower bound of bucket values"""
+        if index < 2 * self.SUB_COUNT:
+            return index
+        shift = index // self.SUB_COUNT - 1
+        return (index % self.SUB_COUNT + self.SUB_COUNT) << shift
+
+    def percentile(self, percent):
+        """Get value (lower bound of bucket) below which `percent` values are"""
+        if not self.count:
+            return 0
+        threshold = self.count * percent / 100
+        total = 0
+        for index, count in enumerate(self.counts):
+            total += count
+            if count and total >= threshold:
+                return self.bucket_value(index)
+        return self.max
+
+
+histograms = [Histogram() for _ in STAGES]
+
+
+def enable(flag=True):
+    global enabled
+    enabled = flag
+
+
+def begin():
+    """Timestamp controller event on input callback entry"""
+    _local.origin = time.perf_counter_ns()
+
+
+def mark(stage):
+    """Record time elapsed from event input in stage histogram"""
+    origin = getattr(_local, "origin", 0)
+    if origin:
+        histograms[stage].record(time.perf_counter_ns() - origin)
+
+
+def end():
+    """Mark end of controller event handling in current thread"""
+    _local.origin = 0
+
+
+def origin():
+    """Get input timestamp of event handled in current thread (or 0)"""
+    return getattr(_local, "origin", 0)
+
+
+def reset():
+    for histogram in histograms:
+        histogram.reset()
+
+
+def dump(file=None):
+    """Print stages percentiles in microseconds"""
+    print(
+        f"{'stage':<10}{'count':>10}{'p50':>10}{'p90':>10}"
+        f"{'p99':>10}{'p99.9':>10}{'max':>10}",
+        file=file,
+    )
+    for name, histogram in zip(STAGES, histograms):
+        values = [histogram.percentile(p) for p in (50, 90, 99, 99.9)]
+        values.append(histogram.max)
+        print(
+            f"{name:<10}{histogram.count:>10}"
+            + "".join(f"{value / 1000:>10.1f}" for value in values),
+            file=file,
+        )
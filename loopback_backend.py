@@ -0,0 +1,206 @@
+"""In-process loopback mido backend emulating padKONTROL in native mode.
+
+Select backend with environment variable:
+    PYKONTROL_BACKEND=loopback_backend
+(see `midi_ports.connect`). Output ports other than padKONTROL control
+port are data sinks with optional write latency:
+    PYKONTROL_LOOPBACK_LATENCY_US=<microseconds>
+
+Emulated device answers native mode handshake, keeps light/led state and
+generates pad, button, knob, rotary and x/y pad traffic on its input port:
+
+    import loopback_backend
+    loopback_backend.device.pad(3, 100)
+"""
+
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import mido
+from mido.ports import BaseInput, BaseOutput
+
+import padKontrol as pk
+import midi_ports as mp
+
+_COMMON = pk._SYSEX_COMMON
+_NATIVE_MODE_ACK = _COMMON + [0x40, 0x00, 0x01, 0xF7]
+_OUTPUT_ACK = _COMMON + [0x5F, 0x4F, 0x00, 0xF7]
+
+
+def _write_latency():
+    return int(os.environ.get("PYKONTROL_LOOPBACK_LATENCY_US", 0)) * 1000
+
+
+class PadKontrolEmulator:
+    """Emulated padKONTROL device shared by all loopback ports"""
+
+    def __init__(self):
+        self.native = False
+        self.inputs = []
+        self.lights = {}  # control: light state
+        self.led = None
+        self.sysex_received = 0
+        self._traffic = None
+
+    # ------------------------ host -> device --------------------------
+
+    def receive(self, data):
+        """Handle SysEx frame sent to padKONTROL control port"""
+        self.sysex_received += 1
+        command = data[5]
+        if data == pk.SYSEX_NATIVE_MODE_ON:
+            self.native = True
+            self._emit(_NATIVE_MODE_ACK, force=True)
+        elif data == pk.SYSEX_NATIVE_MODE_OFF:
+            self.native = False
+            self.stop_traffic()
+        elif command == 0x01:
+            self.lights[data[6]] = data[7]
+        elif command == 0x22:
+            self.led = bytes(data[8:11])
+        elif command == 0x3F and data[6] == 0x2A:
+            self._emit(_OUTPUT_ACK, force=True)
+        elif command == 0x3F:
+            for light in range(pk.LIGHT_GROUP_SIZE):
+                on = data[8 + light // 7] >> (light % 7) & 1
+                self.lights[light] = pk.LIGHT_STATE_ON if on else pk.LIGHT_STATE_OFF
+
+    # ------------------------ device -> host --------------------------
+
+    def _emit(self, data, force=False):
+        if self.native or force:
+            for port in self.inputs:
+                port.deliver(data)
+
+    def pad(self, pad, velocity=100):
+        self._emit(_COMMON + [0x45, 64 + pad, velocity, 0xF7])
+
+    def pad_up(self, pad):
+        self._emit(_COMMON + [0x45, pad, 0, 0xF7])
+
+    def button(self, button, down=True):
+        self._emit(_COMMON + [0x48, button - 16, 127 if down else 0, 0xF7])
+
+    def knob(self, knob, value):
+        self._emit(_COMMON + [0x49, knob, value, 0xF7])
+
+    def rotary(self, right=True):
+        value = pk.ROTARY_KNOB_RIGHT if right else pk.ROTARY_KNOB_LEFT
+        self._emit(_COMMON + [0x43, 0x00, value, 0xF7])
+
+    def xy(self, x, y):
+        self._emit(_COMMON + [0x4B, x, y, 0xF7])
+
+    def random_event(self, rng=random):
+        """Generate random pad hit, knob turn or x/y pad move"""
+        kind = rng.random()
+        if kind < 0.4:
+            pad = rng.randrange(16)
+            self.pad(pad, rng.randrange(1, 128))
+            self.pad_up(pad)
+        elif kind < 0.5:
+            self.knob(rng.randrange(2), rng.randrange(128))
+        else:
+            self.xy(rng.randrange(128), rng.randrange(128))
+
+    def start_traffic(self, rate=1000, seed=None):
+        """Generate random events in background thread
+
+        Keyword Arguments:
+            rate {int} -- events per second (default: {1000})
+            seed {int} -- random generator seed (default: {None})
+        """
+        self.stop_traffic()
+        stop = threading.Event()
+        rng = random.Random(seed)
+
+        def run():
+            interval = 1 / rate
+            while not stop.wait(interval):
+                self.random_event(rng)
+
+        self._traffic = stop
+        threading.Thread(target=run, name="LoopbackTraffic", daemon=True).start()
+
+    def stop_traffic(self):
+        if self._traffic:
+            self._traffic.set()
+            self._traffic = None
+
+
+device = PadKontrolEmulator()
+
+
+def get_devices(**kwargs):
+    return [
+        dict(name=mp.PADKONTROL_INPUT_PORT, is_input=True, is_output=False),
+        dict(name=mp.PADKONTROL_OUTPUT_PORT, is_input=False, is_output=True),
+        dict(name=mp.DATA_MIDI_PORT, is_input=False, is_output=True),
+    ]
+
+
+class Input(BaseInput):
+    """padKONTROL input port.
+
+    Like rtmidi port ignores SysEx until `ignore_sysex` is cleared.
+    `raw_callback` receives `(message bytes, delta time)` tuples,
+    see `midi_ports.set_callback`.
+    """
+
+    def _open(self, callback=None, **kwargs):
+        self.callback = callback
+        self.raw_callback = None
+        self.ignore_sysex = True
+        self._last = time.perf_counter()
+        device.inputs.append(self)
+
+    def _close(self):
+        # also called from __del__, possibly after device is gone
+        inputs = getattr(device, "inputs", ())
+        if self in inputs:
+            inputs.remove(self)
+
+    def deliver(self, data):
+        if self.ignore_sysex and data[0] == 0xF0:
+            return
+        now = time.perf_counter()
+        delta, self._last = now - self._last, now
+        if self.raw_callback:
+            self.raw_callback((data, delta))
+            return
+        message = mido.Message.from_bytes(data)
+        if self.callback:
+            self.callback(message)
+        else:
+            self._messages.append(message)
+
+
+class Output(BaseOutput):
+    """padKONTROL control port or data sink.
+
+    Data sink counts messages and keeps the latest `(perf_counter_ns, bytes)`
+    records in `log`, writes take `write_latency_ns`.
+    """
+
+    def _open(self, **kwargs):
+        self.is_device = self.name == mp.PADKONTROL_OUTPUT_PORT
+        self.write_latency_ns = _write_latency()
+        self.messages = 0
+        self.log = deque(maxlen=100000)
+
+    def send_bytes(self, data):
+        if self.write_latency_ns:
+            deadline = time.perf_counter_ns() + self.write_latency_ns
+            while time.perf_counter_ns() < deadline:
+                pass
+        self.messages += 1
+        if self.is_device:
+            device.receive(list(data))
+        else:
+            self.log.append((time.perf_counter_ns(), bytes(data)))
+
+    def _send(self, message):
+        self.send_bytes(message.bytes())
@@ -1,6 +1,10 @@
 #!/usr/bin/env python
 
+import os
+import signal
 import padKontrol as pk
+import latency
+import realtime
 import rtmidi
 from rtmidi.midiutil import open_midioutput, open_midiinput
 import time
@@ -13,6 +17,7 @@ import midi_ports as mp
 from States.free import FreeState
 from States.redrum import ReDrumState
 from States.strummer import Strummer
+from recorder import Recorder
 
 # log = logging.getLogger(__name__)
 # logging.basicConfig(
@@ -53,7 +58,23 @@ class Context:
 
 # ------------------------------------------
 def main():
+    if os.environ.get("PYKONTROL_LATENCY"):
+        latency.enable()
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, lambda signum, frame: latency.dump())
+
+    # realtime mode: PYKONTROL_REALTIME=fifo|rr, PYKONTROL_RT_CPUS=2,3
+    realtime_mode = os.environ.get("PYKONTROL_REALTIME")
+    if realtime_mode:
+        cpus = os.environ.get("PYKONTROL_RT_CPUS")
+        realtime.enable(
+            policy=realtime_mode,
+            cpus={int(cpu) for cpu in cpus.split(",")} if cpus else None,
+        )
+
     pk_print = PadKontrolPrint()
+    if os.environ.get("PYKONTROL_RECORD"):
+        pk_print.recorder = Recorder(os.environ["PYKONTROL_RECORD"])
 
     # initialize Context object and add states objects
     c = Context()
@@ -62,18 +83,34 @@ def main():
     state1 = FreeState()
     state2 = ReDrumState()
     state3 = Strummer()
+    if mp.CLOCK_MIDI_PORT:
+        state2.follow_clock(mp.CLOCK_MIDI_PORT)
+    if mp.CLOCK_OUTPUT_PORTS:
+        state2.send_clock(mp.CLOCK_OUTPUT_PORTS)
+    if os.environ.get("PYKONTROL_SEQ_PROCESS"):
+        state2.run_in_process()
 
     c.add_state(state1, state2, state3)
 
     # register Context as main listener
     pk_print.register(c)
 
+    if realtime_mode:
+        if not state2.engine:
+            state2.start()  # sequencer thread runs gc safe points from startup
+        realtime.freeze(disable=not state2.engine)
+
     input("Press enter to initialize connection")
-    mp.start_native(pk_print.callback)
+    mp.start_native(pk_print.raw_callback, raw=True)
     c.load_state()
     input("Press enter to exit")
 
     mp.close_native()
+    if pk_print.recorder:
+        pk_print.recorder.close()
+    if realtime_mode:
+        realtime.dump()
 
 
-main()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""MIDI clock synchronisation.
+
+`ClockMaster` sends clock and transport messages of ReDrum timebase.
+
+`ClockFollower` locks to incoming 24 ppqn MIDI clock. Raw tick times are
+jittery (USB polling, driver buffering), so tick grid is tracked by
+alpha-beta filter (first order PLL): every tick corrects phase by `alpha`
+and period by `beta` part of prediction error. Sequencer schedules steps
+on extrapolated grid (`tick_time`) instead of raw ticks.
+"""
+
+import time
+
+PPQN = 24
+
+CLOCK = 0xF8
+START = 0xFA
+CONTINUE = 0xFB
+STOP = 0xFC
+SONG_POSITION = 0xF2
+
+_TICKS_PER_SIXTEENTH = PPQN // 4
+
+# precompiled single byte realtime messages
+CLOCK_MESSAGE = bytes((CLOCK,))
+START_MESSAGE = bytes((START,))
+CONTINUE_MESSAGE = bytes((CONTINUE,))
+STOP_MESSAGE = bytes((STOP,))
+
+
+def bpm_to_period(bpm):
+    """Tick period in nanoseconds"""
+    return 60e9 / (bpm * PPQN)
+
+
+def song_position_message(tick):
+    """Song position pointer message of tick (rounded down to 16th note)"""
+    sixteenths = tick // _TICKS_PER_SIXTEENTH
+    return bytes((SONG_POSITION, sixteenths & 0x7F, sixteenths >> 7 & 0x7F))
+
+
+class ClockMaster:
+    """Send 24 ppqn MIDI clock and transport messages to outputs
+
+    Clock ticks are scheduled by sequencer on its own timebase (see
+    `ReDrumState._plan_steps`), `tick` only writes precompiled byte.
+
+    Arguments:
+        writers {list} -- raw writers of clock outputs
+            (see `midi_ports.clock_writers`)
+    """
+
+    def __init__(self, writers):
+        self.writers = tuple(writers)
+        self.ticks = 0  # sent clock ticks
+        if len(self.writers) == 1:
+            write = self.writers[0]
+
+            def tick():
+                write(CLOCK_MESSAGE)
+                self.ticks += 1
+
+        else:
+
+            def tick():
+                for write in self.writers:
+                    write(CLOCK_MESSAGE)
+                self.ticks += 1
+
+        self.tick = tick
+
+    def _send(self, message):
+        for write in self.writers:
+            write(message)
+
+    def start(self):
+        self._send(START_MESSAGE)
+
+    def stop(self):
+        self._send(STOP_MESSAGE)
+
+    def resume(self, tick):
+        """Continue from song position
+
+        Arguments:
+            tick {int} -- song position of the next clock tick
+        """
+        if not tick:
+            self.start()
+            return
+        self._send(song_position_message(tick))
+        self._send(CONTINUE_MESSAGE)
+
+
+class ClockFollower:
+    """Follow MIDI clock, start, stop, continue and song position messages
+
+    Keyword Arguments:
+        bpm {float} -- initial tempo estimate (default: {120})
+        alpha {float} -- phase correction gain (default: {0.1})
+        beta {float} -- period correction gain (default: {0.005})
+        on_start {callable} -- called on start message (default: {None})
+        on_stop {callable} -- called on stop message (default: {None})
+        on_continue {callable} -- called on continue message (default: {None})
+    """
+
+    min_bpm = 20
+    max_bpm = 400
+
+    def __init__(
+        self,
+        bpm=120,
+        alpha=0.1,
+        beta=0.005,
+        on_start=None,
+        on_stop=None,
+        on_continue=None,
+    ):
+        self.alpha = alpha
+        self.beta = beta
+        self.on_start = on_start
+        self.on_stop = on_stop
+        self.on_continue = on_continue
+        self.running = False
+        self.ticks = 0  # received ticks
+        # (song position, filtered time, period) of last tick, replaced
+        # at once, so sequencer thread never reads half updated grid
+        self._grid = (-1, 0.0, bpm_to_period(bpm))
+        self._raw = 0  # receive time of last tick
+        self._synced = 0  # ticks since start / continue, up to 2
+        self._resynced = False  # last tick did not match grid
+        self._min_period = bpm_to_period(self.max_bpm)
+        self._max_period = bpm_to_period(self.min_bpm)
+
+    @property
+    def period(self):
+        """Filtered tick period in nanoseconds"""
+        return self._grid[2]
+
+    @property
+    def bpm(self):
+        return 60e9 / (self.period * PPQN)
+
+    @property
+    def next_tick(self):
+        """Song position (in ticks) of the next tick"""
+        return self._grid[0] + 1
+
+    def tick_time(self, tick):
+        """Extrapolated `time.perf_counter_ns()` time of song position tick
+
+        Arguments:
+            tick {int/float} -- song position, fractional between ticks
+        """
+        last, time_, period = self._grid
+        return int(time_ + (tick - last) * period)
+
+    def raw_callback(self, event, data=None):
+        """rtmidi input callback, see `midi_ports.open_clock_input`"""
+        self.receive(event[0])
+
+    def receive(self, message, now=None):
+        """Handle realtime or song position message
+
+        Arguments:
+            message {list/bytes} -- raw midi message
+
+        Keyword Arguments:
+            now {int} -- `time.perf_counter_ns()` receive time (default: {None})
+        """
+        status = message[0]
+        if now is None:
+            now = time.perf_counter_ns()
+        if status == CLOCK:
+            self._on_tick(now)
+        elif status == START:
+            self._expect(-1, now)
+            self.running = True
+            if self.on_start:
+                self.on_start()
+        elif status == CONTINUE:
+            self._expect(self._grid[0], now)
+            self.running = True
+            if self.on_continue:
+                self.on_continue()
+        elif status == STOP:
+            self.running = False
+            if self.on_stop:
+                self.on_stop()
+        elif status == SONG_POSITION:
+            sixteenths = message[1] | message[2] << 7
+            _, time_, period = self._grid
+            self._grid = (sixteenths * _TICKS_PER_SIXTEENTH - 1, time_, period)
+
+    def _expect(self, tick, now):
+        """Predict first tick one period after transport message"""
+        self._grid = (tick, now, self._grid[2])
+        self._synced = 0
+        self._resynced = False
+
+    def _on_tick(self, now):
+        self.ticks += 1
+        tick, time_, period = self._grid
+        tick += 1
+        raw, self._raw = self._raw, now
+        if self._synced < 2:
+            # first tick after start / continue sets phase, second period
+            if self._synced:
+                period = self._clamp(now - raw)
+            self._synced += 1
+            self._grid = (tick, now, period)
+            return
+        predicted = time_ + period
+        error = now - predicted
+        if abs(error) > period / 2:
+            # tick closer to other grid tick, lost ticks or tempo jump:
+            # resync to measured tick, interval spanning several periods
+            # counts lost ticks, unless it repeats (tempo slowed down)
+            interval = now - raw
+            missed = 1 if self._resynced else max(1, round(interval / period))
+            self._resynced = True
+            self._grid = (tick + missed - 1, now, self._clamp(interval / missed))
+            return
+        self._resynced = False
+        self._grid = (
+            tick,
+            predicted + self.alpha * error,
+            self._clamp(period + self.beta * error),
+        )
+
+    def _clamp(self, period):
+        if period < self._min_period:
+            return self._min_period
+        if period > self._max_period:
+            return self._max_period
+        return period
@@ -1,4 +1,5 @@
 from collections import namedtuple
+from enum import IntEnum
 
 
 class MidiEvent(object):
@@ -35,11 +36,23 @@ class MidiEvent(object):
         return self.tick >= other.tick
 
 
+class EventType(IntEnum):
+    """Group of controller sending sysEx message,
+    lowercase name is a suffix of `State` handler method (e.g. `handle_xy_pad`)
+    """
+
+    PAD = 0
+    BUTTON = 1
+    KNOB = 2
+    ROTARY = 3
+    XY_PAD = 4
+
+
 class SysexEvent(namedtuple("Sysex", ["type", "control", "state", "data"])):
     """Container for precessed sysEx messages from PK device.
 
     Arguments:
-        type {string} -- group representation of controller (button / knob / pad),
+        type {EventType} -- group representation of controller (button / knob / pad),
         control {int} -- parameter description,
         state {int/string} -- event type (for buttons/pads: pressed or released) (default: {1}),
         data {int/tuple} (optional) -- transmitted value/s (default: {None}).
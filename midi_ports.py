@@ -1,6 +1,10 @@
 import mido
+import os
 import time
+from functools import lru_cache
 import padKontrol as pk
+from surface import Surface
+from midi_writer import MidiWriter
 
 # should be named 'padKONTROL 1 CTRL' or similar.
 PADKONTROL_OUTPUT_PORT = "padKONTROL 1 CTRL 2"
@@ -10,10 +14,32 @@ PADKONTROL_INPUT_PORT = "padKONTROL 1 PORT A 1"
 # external midi port to send midi messages
 DATA_MIDI_PORT = "KorgLoopMidi 4"
 
+# mido backend module, e.g. 'loopback_backend' for hardware-free runs
+BACKEND = os.environ.get("PYKONTROL_BACKEND")
+
+# input port of external MIDI clock followed by ReDrum, None disables
+CLOCK_MIDI_PORT = os.environ.get("PYKONTROL_CLOCK_PORT")
+# comma separated output ports of ReDrum MIDI clock, "data" is data port
+CLOCK_OUTPUT_PORTS = [
+    name for name in os.environ.get("PYKONTROL_CLOCK_OUT", "").split(",") if name
+]
+
 
 _midi_in = None
+_midi_clock_in = None
+_midi_clock_out = []  # opened clock output ports
 _midi_out = None
 _midi_out_data = None
+_write_out = None  # raw frame writer of padKontrol output port
+_write_data = None  # raw message writer of data output port
+_writer = None  # output thread, owns output ports when started
+_close_hooks = []  # called by `close_native` before output is stopped
+
+# channel voice message status bytes
+_NOTE_OFF = 0x80
+_NOTE_ON = 0x90
+_CONTROL_CHANGE = 0xB0
+_PITCHWHEEL = 0xE0
 
 
 def get_padkontrol_input(PADKONTROL_INPUT_PORT=PADKONTROL_INPUT_PORT):
@@ -24,16 +50,18 @@ def get_padkontrol_input(PADKONTROL_INPUT_PORT=PADKONTROL_INPUT_PORT):
 
 
 def get_padkontrol_output(PADKONTROL_OUTPUT_PORT=PADKONTROL_OUTPUT_PORT):
-    global _midi_out
+    global _midi_out, _write_out
     if not _midi_out:
         _midi_out = mido.open_output(PADKONTROL_OUTPUT_PORT)
+        _write_out = raw_writer(_midi_out)
     return _midi_out
 
 
 def get_midi_out_data(DATA_MIDI_PORT=DATA_MIDI_PORT):
-    global _midi_out_data
+    global _midi_out_data, _write_data
     if not _midi_out_data:
         _midi_out_data = mido.open_output(DATA_MIDI_PORT, autoreset=True)
+        _write_data = raw_writer(_midi_out_data)
     return _midi_out_data
 
 
@@ -48,14 +76,98 @@ def connect(
     midi_in=PADKONTROL_INPUT_PORT,
     midi_out=PADKONTROL_OUTPUT_PORT,
     midi_data=DATA_MIDI_PORT,
+    threaded=True,
+    backend=BACKEND,
 ):
+    if backend:
+        mido.set_backend(backend)
     _midi_in = get_padkontrol_input(midi_in)
     _midi_out = get_padkontrol_output(midi_out)
     _midi_out_data = get_midi_out_data(midi_data)
-    _midi_in._rt.ignore_types(True, True, True)
+    _ignore_sysex(_midi_in, True)
+    if threaded:
+        start_writer()
+
+
+def install_ports(midi_out, midi_data, midi_in=None, threaded=True):
+    """Use already opened ports (e.g. stand-in ports for tests and replay)
+
+    Arguments:
+        midi_out {port} -- padKontrol output port
+        midi_data {port} -- data output port
+
+    Keyword Arguments:
+        midi_in {port} -- padKontrol input port (default: {None})
+        threaded {bool} -- start output thread (default: {True})
+    """
+    global _midi_in, _midi_out, _midi_out_data, _write_out, _write_data
+    stop_writer()
+    _midi_in = midi_in
+    _midi_out = midi_out
+    _midi_out_data = midi_data
+    _write_out = raw_writer(midi_out)
+    _write_data = raw_writer(midi_data)
+    if threaded:
+        start_writer()
+
+
+def start_writer(feedback_size=64):
+    """Pass all output through `MidiWriter` thread
+
+    Keyword Arguments:
+        feedback_size {int} -- max pending light/led frames (default: {64})
+    """
+    global _writer, _write_out, _write_data
+    if _writer:
+        return
+    _writer = MidiWriter(
+        write_data=raw_writer(_midi_out_data),
+        write_out=raw_writer(_midi_out),
+        feedback_size=feedback_size,
+        on_drop=surface.frame_dropped,
+    )
+    _write_out = _writer.send_feedback
+    _write_data = _writer.send_data
+    _writer.start()
+
+
+def stop_writer():
+    """Write pending messages, stop `MidiWriter` and write to ports directly
+
+    Returns:
+        dict -- final output thread counters, see `MidiWriter.stats`
+    """
+    global _writer, _write_out, _write_data
+    if not _writer:
+        return {}
+    _writer.stop()
+    stats = _writer.stats()
+    _writer = None
+    _write_out = raw_writer(_midi_out)
+    _write_data = raw_writer(_midi_out_data)
+    return stats
+
+
+def writer_stats():
+    """Get output thread counters, see `MidiWriter.stats`"""
+    return _writer.stats() if _writer else {}
+
 
+def begin_batch():
+    """Collect output of calling thread until `MidiWriter.end_batch`,
+    then it is queued at once (see `MidiWriter.begin_batch`)
 
-def start_native(callback):
+    Returns:
+        MidiWriter -- batching writer, None if output is written directly
+            or batch is already open
+    """
+    writer = _writer
+    if writer is not None and writer.begin_batch():
+        return writer
+    return None
+
+
+def start_native(callback, raw=False):
     send_sysex(pk.SYSEX_NATIVE_MODE_OFF)
     send_sysex(pk.SYSEX_NATIVE_MODE_ON)
     send_sysex(pk.SYSEX_NATIVE_MODE_ENABLE_OUTPUT)
@@ -64,39 +176,308 @@ def start_native(callback):
     # these sysex messages are device specyfic and input port must ignore them.
     # wait some time to avoid conflicts between I/O midi ports
     time.sleep(0.5)
-    set_callback(callback)
+    surface.reset()  # native mode init turns off all lights
+    set_callback(callback, raw)
+
+
+def on_close(callback):
+    """Call callback from `close_native` while output ports are open,
+    e.g. to stop and join threads writing to them (in reverse order)"""
+    _close_hooks.append(callback)
 
 
 def close_native():
+    while _close_hooks:
+        _close_hooks.pop()()
     send_sysex(pk.SYSEX_NATIVE_MODE_OFF)
+    stop_writer()
     disconnect()
 
 
 def disconnect():
-    global _midi_in, _midi_out, _midi_out_data
-    _midi_in.close()
-    _midi_out.close()
-    _midi_out_data.close()
+    """Close ports, the next `connect` opens new ones"""
+    global _midi_in, _midi_out, _midi_out_data, _write_out, _write_data
+    for port in (_midi_in, _midi_out, _midi_out_data):
+        if port:
+            port.close()
+    _midi_in = _midi_out = _midi_out_data = None
+    _write_out = _write_data = None
+    close_clock_input()
+    close_clock_outputs()
+
+
+def open_clock_input(callback, name=CLOCK_MIDI_PORT):
+    """Open input port of external MIDI clock
+
+    Clock port is separate from padKontrol input, so clock ticks do not
+    queue behind controller messages.
+
+    Arguments:
+        callback {callable} -- raw messages handler, receives
+            `(message bytes, delta time)` tuple (see `set_callback`)
+
+    Keyword Arguments:
+        name {string} -- input port name (default: {CLOCK_MIDI_PORT})
+
+    Returns:
+        mido.ports.BaseInput -- opened port
+    """
+    global _midi_clock_in
+    close_clock_input()
+    _midi_clock_in = mido.open_input(name)
+    _set_raw_callback(_midi_clock_in, callback)
+    rt = getattr(_midi_clock_in, "_rt", None)
+    if rt is not None:
+        # receive clock and transport, drop sysex and active sensing
+        rt.ignore_types(sysex=True, timing=False, active_sense=True)
+    return _midi_clock_in
+
+
+def close_clock_input():
+    global _midi_clock_in
+    if _midi_clock_in:
+        _midi_clock_in.close()
+        _midi_clock_in = None
 
 
-def set_callback(callback):
+def clock_writers(names):
+    """Get raw writers of MIDI clock outputs
+
+    "data" (or None) writes to data port directly from sequencer thread
+    (see `send_realtime`), clock ticks do not wait for output thread wake
+    up. Other ports are opened and written directly from sequencer thread.
+
+    Arguments:
+        names {list} -- output port names
+
+    Returns:
+        list -- raw writers
+    """
+    writers = []
+    for name in names:
+        if name in (None, "data", DATA_MIDI_PORT):
+            writers.append(send_realtime)
+        else:
+            port = mido.open_output(name)
+            _midi_clock_out.append(port)
+            writers.append(raw_writer(port))
+    return writers
+
+
+def close_clock_outputs():
+    while _midi_clock_out:
+        _midi_clock_out.pop().close()
+
+
+def set_callback(callback, raw=False):
+    """Set padKontrol input port callback
+
+    Arguments:
+        callback {callable} -- input messages handler
+
+    Keyword Arguments:
+        raw {bool} -- register callback directly on rtmidi input, callback
+            receives `(message bytes, delta time)` tuple instead of
+            mido.Message. Ports of other backends pass message bytes with
+            delta time measured on arrival (default: {False})
+    """
     global _midi_in
     if _midi_in:
-        _midi_in.callback = callback
-        _midi_in._rt.ignore_types(False, False, False)
+        if raw:
+            _set_raw_callback(_midi_in, callback)
+        else:
+            _midi_in.callback = callback
+        _ignore_sysex(_midi_in, False)
+
+
+def _set_raw_callback(port, callback):
+    if getattr(port, "_rt", None) is not None:
+        port._rt.set_callback(callback)  # replace mido callback wrapper
+    elif hasattr(port, "raw_callback"):
+        port.raw_callback = callback  # loopback backend
+    else:
+        port.callback = _raw_callback_adapter(callback)
+
+
+def _ignore_sysex(port, ignore):
+    """Ignore SysEx (with timing and active sense) messages on input port"""
+    rt = getattr(port, "_rt", None)
+    if rt is not None:
+        rt.ignore_types(ignore, ignore, ignore)
+    else:
+        port.ignore_sysex = ignore
+
+
+def _raw_callback_adapter(callback):
+    last = time.perf_counter()
+
+    def adapter(message):
+        nonlocal last
+        now = time.perf_counter()
+        callback((message.bytes(), now - last))
+        last = now
+
+    return adapter
+
+
+def raw_writer(port):
+    """Get raw bytes writer for mido output port.
+
+    rtmidi ports are written directly, skipping mido message parsing,
+    ports with `send_bytes` method receive raw bytes, other backends
+    receive parsed mido message.
+
+    Arguments:
+        port {mido.ports.BaseOutput} -- opened output port
+
+    Returns:
+        callable -- function sending list/bytes of single midi message
+    """
+    rt = getattr(port, "_rt", None)
+    if rt is not None:
+        return rt.send_message
+    send_bytes = getattr(port, "send_bytes", None)
+    if send_bytes is not None:
+        return send_bytes
+    return lambda frame: port.send(mido.Message.from_bytes(frame))
 
 
 def send_sysex(sysex):
     global _midi_out
+    if _writer:
+        _writer.send_control(sysex)
+        return
     sysex = mido.parse(sysex)
     _midi_out.send(sysex)
 
 
+def send_frame(frame):
+    """Send precompiled SysEx frame to padKontrol output port
+
+    Arguments:
+        frame {bytes} -- complete SysEx message (see `pk.LIGHT_FRAMES`)
+    """
+    _write_out(frame)
+
+
+# retained model of padKontrol lights
+surface = Surface(send_frame)
+
+
 def send_midi(data):
-    global _midi_out_data
-    if not isinstance(data, mido.Message):
-        data = mido.Message(**data)
-    _midi_out_data.send(data)
+    """Send midi message to data port.
+
+    Compatibility API, note, control change and pitchwheel dicts are
+    sent with `note_on`, `note_off`, `cc` and `pitchwheel` functions.
+
+    Arguments:
+        data {dict/mido.Message} -- mido.Message or its keyword arguments
+    """
+    if isinstance(data, mido.Message):
+        _write_data(data.bytes())
+        return
+    kind = data["type"]
+    channel = data.get("channel", 0)
+    if kind == "note_on":
+        note_on(channel, data["note"], data.get("velocity", 64))
+    elif kind == "note_off":
+        note_off(channel, data["note"], data.get("velocity", 64))
+    elif kind == "control_change":
+        cc(channel, data.get("control", 0), data.get("value", 0))
+    elif kind == "pitchwheel":
+        pitchwheel(channel, data.get("pitch", 0))
+    else:
+        _write_data(mido.Message(**data).bytes())
+
+
+def note_on(channel, note, velocity):
+    """Send note on message to data port
+
+    Arguments:
+        channel {int} -- midi channel 0-15
+        note {int} -- note pitch 0-127
+        velocity {int} -- note velocity 0-127
+    """
+    _write_data([_NOTE_ON | channel, note, velocity])
+
+
+def note_bytes(channel, note, velocity):
+    """Compile note on message for `send_bundle`
+
+    Returns:
+        bytes -- raw midi message
+    """
+    return bytes((_NOTE_ON | channel, note, velocity))
+
+
+def send_data(message):
+    """Send raw midi message to data port
+
+    Arguments:
+        message {list/bytes} -- single midi message
+    """
+    _write_data(message)
+
+
+def send_realtime(message):
+    """Write realtime message (clock, start, stop) to data port from
+    calling thread, skipping output thread queue
+
+    Arguments:
+        message {bytes} -- single midi message
+    """
+    if _writer:
+        _writer.write_now(message)
+        return
+    _write_data(message)
+
+
+def send_bundle(bundle):
+    """Send precompiled messages to data port in one write
+
+    Arguments:
+        bundle {tuple} -- raw midi messages (see `note_bytes`)
+    """
+    if _writer:
+        _writer.send_data(bundle)
+        return
+    for message in bundle:
+        _write_data(message)
+
+
+def note_off(channel, note, velocity=0):
+    """Send note off message to data port
+
+    Arguments:
+        channel {int} -- midi channel 0-15
+        note {int} -- note pitch 0-127
+
+    Keyword Arguments:
+        velocity {int} -- release velocity 0-127 (default: {0})
+    """
+    _write_data([_NOTE_OFF | channel, note, velocity])
+
+
+def cc(channel, control, value):
+    """Send control change message to data port
+
+    Arguments:
+        channel {int} -- midi channel 0-15
+        control {int} -- controller number 0-127
+        value {int} -- controller value 0-127
+    """
+    _write_data([_CONTROL_CHANGE | channel, control, value])
+
+
+def pitchwheel(channel, pitch):
+    """Send pitchwheel message to data port
+
+    Arguments:
+        channel {int} -- midi channel 0-15
+        pitch {int} -- pitch bend -8192-8191 (as mido)
+    """
+    pitch += 8192
+    _write_data([_PITCHWHEEL | channel, pitch & 0x7F, pitch >> 7])
 
 
 def ascii_to_led(char, pos=0):
@@ -136,14 +517,18 @@ def translate_to_led(msg):
     return s, custom
 
 
-def led(msg, led_state=pk.LED_STATE_ON):
-    """Set led message
+@lru_cache(maxsize=512)
+def led_frames(msg, led_state=pk.LED_STATE_ON):
+    """Compile led message to SysEx frames
 
     Arguments:
         msg {string} -- message to display (or first 3 characters of string)
+
+    Returns:
+        tuple -- SysEx frames of led text and custom characters segments
     """
     msg, custom = translate_to_led(msg)
-    send_sysex(pk.led(msg, led_state))  # send valid characters as string
+    frames = [bytes(pk.led(msg, led_state))]  # valid characters as string
     if custom:
         # unsupported characters must be created segment by segment
         light_state = pk.LIGHT_STATE_ON
@@ -151,13 +536,27 @@ def led(msg, led_state=pk.LED_STATE_ON):
             light_state = pk.LIGHT_STATE_BLINK
         for char in custom:
             for c in char:
-                send_sysex(pk.light(c, light_state))
+                frames.append(pk.light_frame(c, light_state))
+    return tuple(frames)
+
+
+def led(msg, led_state=pk.LED_STATE_ON):
+    """Set led message
+
+    Arguments:
+        msg {string} -- message to display (or first 3 characters of string)
+    """
+    for frame in led_frames(str(msg), led_state):
+        _write_out(frame)
+
+
+_LED_RESET = bytes(pk.led([0x29, 0x29, 0x29]))
 
 
 def led_reset():
     """Clear led display
     """
-    send_sysex(pk.led([0x29, 0x29, 0x29]))
+    _write_out(_LED_RESET)
 
 
 def led_blink(msg):
@@ -165,26 +564,37 @@ def led_blink(msg):
 
 
 def light_on(control):
-    send_sysex(pk.light(control, pk.LIGHT_STATE_ON))
+    surface.set(control, True)
+    surface.render()
 
 
 def light_off(control):
-    send_sysex(pk.light(control, pk.LIGHT_STATE_OFF))
+    surface.set(control, False)
+    surface.render()
 
 
 def light_blink(control):
-    send_sysex(pk.light(control, pk.LIGHT_STATE_BLINK))
+    surface.blink(control)
 
 
 def light_flash(control, duration=0.5):
-    send_sysex(pk.light_flash(control, duration))
+    surface.flash(control, duration)
 
 
 def group_light_on(buttons_or_pads: list) -> None:
-    for btn_or_pad in buttons_or_pads:
-        light_on(btn_or_pad)
+    surface.set_many(buttons_or_pads, True)
+    surface.render()
 
 
 def group_light_off(buttons_or_pads: list) -> None:
-    for btn_or_pad in buttons_or_pads:
-        light_off(btn_or_pad)
+    surface.set_many(buttons_or_pads, False)
+    surface.render()
+
+
+def group_light_set(buttons_or_pads: list, active: list) -> None:
+    """Turn on `active` lights and turn off the rest of `buttons_or_pads`
+    in one update
+    """
+    surface.set_many(buttons_or_pads, False)
+    surface.set_many(active, True)
+    surface.render()
@@ -0,0 +1,312 @@
+import threading
+import time
+from collections import deque
+
+import latency
+import realtime
+
+LIGHT_GROUP_KEY = 0x100 | 0x3F  # feedback key of `light_group` frames
+
+
+def feedback_key(frame):
+    """Coalescing key of padKontrol SysEx frame
+
+    Frames with the same key overwrite each other on device, only the
+    latest one has to be sent: `light` frames are keyed by control,
+    other frames (led, light_group) by command byte.
+    """
+    command = frame[5]
+    if command == 0x01:
+        return frame[6]
+    return 0x100 | command
+
+
+class MidiWriter(threading.Thread):
+    """Output actor, the only thread writing to midi output ports.
+
+    Messages are passed through three lanes:
+        data -- time critical messages for data port, never dropped
+            and written before feedback, at most `data_batch` messages
+            between two feedback frames, so busy data port cannot
+            starve feedback;
+        control -- padKontrol SysEx frames which must not be lost
+            (e.g. native mode handshake), never dropped nor coalesced
+            and written before feedback;
+        feedback -- best-effort padKontrol light/led SysEx frames,
+            stale frames are coalesced and the oldest frames are dropped
+            when lane is full.
+
+    Lanes are plain deques, append/popleft are atomic, so producers
+    (input callback, sequencer and main threads) never wait for each other.
+
+    Output of one handler (e.g. note and its pad light) may be collected
+    in batch (`begin_batch`, `end_batch`) and queued at once, so writer
+    is woken once and takes the whole batch in one pass.
+
+    Time critical single messages (MIDI clock) may skip the data lane
+    and be written from the calling thread with `write_now`, data port
+    writes are serialized by port lock.
+
+    Arguments:
+        write_data {callable} -- raw writer of data port
+        write_out {callable} -- raw writer of padKontrol port
+
+    Keyword Arguments:
+        feedback_size {int} -- max pending feedback frames (default: {64})
+        data_batch {int} -- max data messages written between two
+            feedback frames (default: {16})
+        on_drop {callable} -- called with `feedback_key` of dropped
+            feedback frame (default: {None})
+    """
+
+    def __init__(
+        self, write_data, write_out, feedback_size=64, data_batch=16, on_drop=None
+    ):
+        super().__init__(name="MidiWriter", daemon=True)
+        self._write_data = write_data
+        self._write_out = write_out
+        self._data = deque()
+        self._control = deque()
+        self._feedback = deque()
+        self._feedback_size = feedback_size
+        self._data_batch = data_batch
+        self._on_drop = on_drop
+        self._wake = threading.Event()
+        self._running = True
+        # data port is written by writer thread and `write_now` callers
+        self._data_lock = threading.Lock()
+        # batch of one producer thread at a time
+        self._batch_lock = threading.Lock()
+        self._batch_owner = None  # thread ident
+        self._batch_data = []
+        self._batch_frames = []
+        # counters
+        self.data_written = 0
+        self.feedback_written = 0
+        self.drops = 0
+        self.coalesced = 0
+        self.wakes = 0  # writer thread wake ups
+        self.latency_total_ns = 0  # data lane enqueue to written
+        self.latency_max_ns = 0
+
+    # ------------------------ producer API --------------------------
+
+    def send_data(self, message):
+        """Queue message for data port
+
+        Arguments:
+            message {list/bytes/tuple} -- single midi message or bundle
+                (tuple) of messages written in one go
+        """
+        origin = latency.origin() if latency.enabled else 0
+        entry = (message, time.perf_counter_ns(), origin)
+        owner = self._batch_owner
+        if owner is not None and owner == threading.get_ident():
+            self._batch_data.append(entry)
+            return
+        self._data.append(entry)
+        if not self._wake.is_set():
+            self._wake.set()
+
+    def write_now(self, message):
+        """Write message to data port from calling thread, skipping data
+        lane and writer wake up. Message may overtake queued data messages,
+        use for realtime messages only (e.g. MIDI clock).
+
+        Arguments:
+            message {bytes} -- single midi message
+        """
+        with self._data_lock:
+            self._write_data(message)
+
+    def send_feedback(self, frame):
+        """Queue light/led frame for padKontrol port, see `feedback_key`
+
+        Arguments:
+            frame {bytes} -- complete SysEx message
+        """
+        owner = self._batch_owner
+        if owner is not None and owner == threading.get_ident():
+            self._batch_frames.append(frame)
+            return
+        dropped = self._queue_feedback(frame)
+        if not self._wake.is_set():
+            self._wake.set()
+        if dropped is not None:
+            self._dropped(dropped)
+
+    def _queue_feedback(self, frame):
+        """Append frame to feedback lane, returns key of dropped frame"""
+        feedback = self._feedback
+        dropped = None
+        if len(feedback) >= self._feedback_size:
+            try:
+                dropped, _ = feedback.popleft()
+            except IndexError:
+                pass  # writer emptied the lane meanwhile
+        feedback.append((feedback_key(frame), frame))
+        return dropped
+
+    def _dropped(self, key):
+        self.drops += 1
+        if self._on_drop:
+            self._on_drop(key)
+
+    def send_control(self, frame):
+        """Queue SysEx frame which is never dropped nor coalesced with
+        other frames (e.g. native mode handshake)
+        """
+        self._control.append(frame)
+        if not self._wake.is_set():
+            self._wake.set()
+
+    def begin_batch(self):
+        """Hold data messages and feedback frames of calling thread until
+        `end_batch`. Only one thread batches at a time, nested and
+        concurrent calls do not start batch (output of nested call is
+        part of the outer batch).
+
+        Returns:
+            bool -- batch started, must be ended by `end_batch`
+        """
+        if not self._batch_lock.acquire(False):
+            return False
+        self._batch_owner = threading.get_ident()
+        return True
+
+    def end_batch(self):
+        """Queue held feedback frames and data messages, wake writer once"""
+        frames = self._batch_frames
+        data = self._batch_data
+        queued = bool(frames or data)
+        dropped = None
+        if frames:
+            for frame in frames:
+                key = self._queue_feedback(frame)
+                if key is not None:
+                    dropped = (dropped or []) + [key]
+            frames.clear()
+        if data:
+            # after frames, writer takes data and feedback in the same pass
+            self._data.extend(data)
+            data.clear()
+        self._batch_owner = None
+        self._batch_lock.release()
+        if queued and not self._wake.is_set():
+            self._wake.set()
+        if dropped:
+            for key in dropped:
+                self._dropped(key)
+
+    # ------------------------ counters --------------------------
+
+    @property
+    def data_depth(self):
+        return len(self._data)
+
+    @property
+    def feedback_depth(self):
+        return len(self._feedback)
+
+    def stats(self):
+        """Get writer counters
+
+        Returns:
+            dict -- queue depths, written, dropped and coalesced frames,
+                writer wake ups, data write latency in microseconds
+        """
+        written = self.data_written or 1
+        return dict(
+            data_depth=self.data_depth,
+            feedback_depth=self.feedback_depth,
+            data_written=self.data_written,
+            feedback_written=self.feedback_written,
+            drops=self.drops,
+            coalesced=self.coalesced,
+            wakes=self.wakes,
+            latency_avg_us=self.latency_total_ns / written / 1000,
+            latency_max_us=self.latency_max_ns / 1000,
+        )
+
+    # ------------------------ writer thread --------------------------
+
+    def stop(self, timeout=None):
+        """Write all pending messages and stop thread"""
+        self._running = False
+        self._wake.set()
+        if self.is_alive():
+            self.join(timeout)
+
+    def run(self):
+        if realtime.enabled:
+            realtime.promote("MidiWriter")
+        data = self._data
+        control = self._control
+        feedback = self._feedback
+        while self._running or data or control or feedback:
+            if data:
+                self._flush_data()
+            if control:
+                self._flush_control()
+            if feedback:
+                self._flush_feedback()
+            if self._running and not (data or control or feedback):
+                self._wake.wait()
+                self._wake.clear()
+                self.wakes += 1
+
+    def _flush_data(self):
+        """Write up to `data_batch` data messages"""
+        data = self._data
+        write = self._write_data
+        lock = self._data_lock
+        for _ in range(self._data_batch):
+            if not data:
+                break
+            message, stamp, origin = data.popleft()
+            with lock:
+                if type(message) is tuple:
+                    # bundle, ports accept single midi message per write
+                    for part in message:
+                        write(part)
+                else:
+                    write(message)
+            now = time.perf_counter_ns()
+            delay = now - stamp
+            self.latency_total_ns += delay
+            if delay > self.latency_max_ns:
+                self.latency_max_ns = delay
+            if origin:
+                latency.histograms[latency.WRITE].record(now - origin)
+            self.data_written += 1
+
+    def _flush_control(self):
+        control = self._control
+        write = self._write_out
+        while control:
+            write(control.popleft())
+            self.feedback_written += 1
+
+    def _flush_feedback(self):
+        feedback = self._feedback
+        batch = []
+        while feedback:
+            batch.append(feedback.popleft())
+
+        # keep only the latest frame of each key, in original order
+        seen = set()
+        frames = []
+        for key, frame in reversed(batch):
+            if key in seen:
+                self.coalesced += 1
+                continue
+            seen.add(key)
+            frames.append(frame)
+
+        write = self._write_out
+        data = self._data
+        for frame in reversed(frames):
+            if data:
+                self._flush_data()  # notes wait for at most one light frame
+            write(frame)
+            self.feedback_written += 1
@@ -213,6 +213,23 @@ def light_group(led, lights):
     return _SYSEX_COMMON + [0x3F, 0x0A, 0x01] + group + [0x00] + led + [0xF7]
 
 
+# lights addressable by light_group message (pads and buttons 0-34)
+LIGHT_GROUP_SIZE = 35
+LIGHT_GROUP_MASK = (1 << LIGHT_GROUP_SIZE) - 1
+_LIGHT_GROUP_HEAD = bytes(_SYSEX_COMMON + [0x3F, 0x0A, 0x01])
+_LIGHT_GROUP_TAIL = bytes([0x00, 0x00, 0x00, 0x00, 0xF7])  # keep LCD text
+
+
+def light_group_frame(mask):
+    """Build `light_group` SysEx frame from lights bitmask.
+
+    mask -- integer with bit n set for every light n (0 to 34) turned on,
+            all other lights will be turned off. LED readout is unchanged.
+    """
+    group = bytes((mask >> shift) & 0x7F for shift in range(0, 35, 7))
+    return _LIGHT_GROUP_HEAD + group + _LIGHT_GROUP_TAIL
+
+
 def light(button_or_pad, light_state):
     """Set the state of the specified button or pad's light.
 
@@ -240,6 +257,53 @@ def light_flash(button_or_pad, duration):
     return light(button_or_pad, speed)
 
 
+# precompiled SysEx frames for every (control, light state) pair,
+# flash durations are light states in 0x40-0x5E range
+_LIGHT_CONTROLS = range(0x40)  # pads, buttons and led segments
+_LIGHT_STATES = [LIGHT_STATE_OFF, LIGHT_STATE_ON, LIGHT_STATE_BLINK] + [
+    LIGHT_STATE_ONESHOT + n for n in range(31)
+]
+LIGHT_FRAMES = {
+    (control, state): bytes(_SYSEX_COMMON + [0x01, control, state, 0xF7])
+    for control in _LIGHT_CONTROLS
+    for state in _LIGHT_STATES
+}
+
+
+def light_frame(button_or_pad, light_state):
+    """Get precompiled SysEx frame of `light` message.
+
+    button_or_pad -- a button value constant or pad number (0 to 15).
+
+    light_state -- a light state constant or True (on) or False (off).
+    """
+    if light_state is True:
+        light_state = LIGHT_STATE_ON
+    elif light_state is False:
+        light_state = LIGHT_STATE_OFF
+
+    return _light_frame(button_or_pad, light_state)
+
+
+def light_flash_frame(button_or_pad, duration):
+    """Get precompiled SysEx frame of `light_flash` message.
+
+    button_or_pad -- a button value constant or pad number (0 to 15).
+
+    duration -- a number between 0 (9ms) and 1.0 (279ms).
+    """
+    return _light_frame(button_or_pad, LIGHT_STATE_ONESHOT + int(30 * duration))
+
+
+def _light_frame(button_or_pad, light_state):
+    frame = LIGHT_FRAMES.get((button_or_pad, light_state))
+    if frame is None:
+        # outside of precompiled range (e.g. flash longer than 1.0),
+        # build it like `light` does
+        frame = bytes(light(button_or_pad, light_state))
+    return frame
+
+
 def led(led, led_state=LED_STATE_ON):
     """Set the LED display.
 
@@ -0,0 +1,196 @@
+"""Optional realtime mode of sequencer.
+
+Garbage collector pauses and normal thread scheduling are the largest
+outliers of step timing. Realtime mode:
+    freezes startup heap (`gc.freeze`), so collections do not traverse it,
+    keeps automatic collections of youngest generation only (short,
+        bounded by allocations since the last one), collections of older
+        generations run at safe points of sequencer thread (`safe_point`)
+        when next step is far enough, or when sequencer is paused,
+    raises scheduling policy of time critical threads to SCHED_FIFO /
+        SCHED_RR with optional CPU affinity (`promote`), where permitted.
+
+GC pauses are recorded in histograms by generation whenever `track_gc`
+is on, in realtime mode or not, so both modes can be compared.
+
+Mode is disabled by default, call sites check `realtime.enabled` before
+calling `promote` or `safe_point`.
+"""
+
+import gc
+import os
+import time
+
+from latency import Histogram
+
+enabled = False
+
+# gc pause durations by generation
+pauses = [Histogram() for _ in range(3)]
+totals = [0, 0, 0]  # total gc pause by generation
+# thread name: reason why scheduling was not changed
+failures = {}
+
+_policy = "fifo"
+_priority = 10
+_cpus = None
+_budget_ns = 2_000_000  # min time to next step for safe point collection
+_gc_start = 0
+_last = [0, 0, 0]  # last gc pause by generation
+_thresholds = None  # automatic thresholds deferred to safe points
+_DEFERRED = 1 << 30  # threshold never reached by automatic collection
+
+
+def _on_gc(phase, info):
+    global _gc_start
+    if phase == "start":
+        _gc_start = time.perf_counter_ns()
+    else:
+        pause = time.perf_counter_ns() - _gc_start
+        pauses[info["generation"]].record(pause)
+        totals[info["generation"]] += pause
+        _last[info["generation"]] = pause
+
+
+def track_gc(flag=True):
+    """Record gc pauses (see `pauses`)"""
+    if _on_gc in gc.callbacks:
+        gc.callbacks.remove(_on_gc)
+    if flag:
+        gc.callbacks.append(_on_gc)
+
+
+def enable(policy="fifo", priority=10, cpus=None, budget_ns=2_000_000):
+    """Enable realtime mode, call before time critical threads are started
+
+    Keyword Arguments:
+        policy {string} -- "fifo" or "rr" scheduling policy (default: {"fifo"})
+        priority {int} -- static priority 1-99 (default: {10})
+        cpus {set} -- CPU affinity of promoted threads, None keeps
+            current affinity (default: {None})
+        budget_ns {int} -- min time to the next step for collection
+            at safe point (default: {2ms})
+    """
+    global enabled, _policy, _priority, _cpus, _budget_ns
+    _policy = policy
+    _priority = priority
+    _cpus = cpus
+    _budget_ns = budget_ns
+    enabled = True
+    track_gc()
+
+
+def settings():
+    """Get `enable` arguments of current realtime mode (e.g. for engine
+    process), None if mode is disabled"""
+    if not enabled:
+        return None
+    return dict(policy=_policy, priority=_priority, cpus=_cpus, budget_ns=_budget_ns)
+
+
+def freeze(disable=True):
+    """Move all current objects to permanent generation, call after
+    startup allocations
+
+    Keyword Arguments:
+        disable {bool} -- disable automatic collections of older
+            generations in realtime mode, process must run `safe_point`
+            regularly (default: {True})
+    """
+    global _thresholds
+    gc.collect()
+    gc.freeze()
+    if enabled and disable and _thresholds is None:
+        _thresholds = gc.get_threshold()
+        gc.set_threshold(_thresholds[0], _DEFERRED, _DEFERRED)
+
+
+def disable():
+    global enabled, _thresholds
+    enabled = False
+    gc.unfreeze()
+    if _thresholds is not None:
+        gc.set_threshold(*_thresholds)
+        _thresholds = None
+
+
+def promote(name):
+    """Raise scheduling policy and set CPU affinity of calling thread
+
+    Arguments:
+        name {string} -- thread name reported in `failures`
+
+    Returns:
+        bool -- scheduling changed
+    """
+    try:
+        policy = os.SCHED_RR if _policy == "rr" else os.SCHED_FIFO
+        # pid 0 is the calling thread on Linux
+        os.sched_setscheduler(0, policy, os.sched_param(_priority))
+        if _cpus:
+            os.sched_setaffinity(0, _cpus)
+    except (AttributeError, OSError) as error:
+        # not Linux or missing CAP_SYS_NICE, keep normal scheduling
+        failures[name] = str(error) or type(error).__name__
+        return False
+    failures.pop(name, None)
+    return True
+
+
+def safe_point(slack_ns=None, full=False):
+    """Run collection of older generation deferred by `freeze` where
+    sequencer would wait anyway.
+
+    Middle generation is collected when its count reaches threshold,
+    oldest generation when its count does too, like automatic collection
+    would. Oldest generation waits for slack of its own last pause,
+    middle generation is collected meanwhile.
+
+    Keyword Arguments:
+        slack_ns {int} -- time to the next step, no collection below
+            budget or twice the last pause of collected generation
+            (default: {None})
+        full {bool} -- collect all generations (default: {False})
+
+    Returns:
+        bool -- collection was run
+    """
+    if full:
+        gc.collect()
+        return True
+    if _thresholds is None:
+        return False  # automatic collections
+    _, count1, count2 = gc.get_count()
+    _, threshold1, threshold2 = _thresholds
+    if count1 < threshold1:
+        return False
+    for generation in (2, 1) if count2 >= threshold2 else (1,):
+        if slack_ns is None or slack_ns >= max(_budget_ns, 2 * _last[generation]):
+            gc.collect(generation)
+            return True
+    return False
+
+
+def reset():
+    for generation, histogram in enumerate(pauses):
+        histogram.reset()
+        totals[generation] = 0
+
+
+def dump(file=None):
+    """Print gc pauses percentiles in microseconds and scheduling failures"""
+    print(
+        f"{'gc gen':<10}{'count':>10}{'p50':>10}{'p99':>10}{'max':>10}{'total':>12}",
+        file=file,
+    )
+    for generation, histogram in enumerate(pauses):
+        values = [histogram.percentile(p) for p in (50, 99)]
+        values.append(histogram.max)
+        print(
+            f"{generation:<10}{histogram.count:>10}"
+            + "".join(f"{value / 1000:>10.1f}" for value in values)
+            + f"{totals[generation] / 1000:>12.1f}",
+            file=file,
+        )
+    for name, reason in failures.items():
+        print(f"{name}: normal scheduling ({reason})", file=file)
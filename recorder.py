@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+"""Record and replay raw controller input streams.
+
+Log is append-only sequence of binary records (little endian):
+    uint64 -- nanoseconds from recording session start,
+    uint16 -- message length,
+    bytes -- raw SysEx message as received by input callback.
+File starts with `MAGIC` header. Sessions may be appended to existing log,
+timestamps restart from zero with every session.
+
+Usage:
+    python recorder.py LOG [--fast] [--state free|redrum|strummer]
+"""
+
+import argparse
+import struct
+import time
+
+MAGIC = b"PKLOG\x01"
+_RECORD = struct.Struct("<QH")
+
+
+class Recorder:
+    """Append raw input messages to log file
+
+    Arguments:
+        path {string} -- log file path
+    """
+
+    def __init__(self, path):
+        self._file = open(path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+        self._start = time.perf_counter_ns()
+
+    def record(self, data):
+        """Append message
+
+        Arguments:
+            data {list/bytes} -- raw SysEx message
+        """
+        self._file.write(_RECORD.pack(time.perf_counter_ns() - self._start, len(data)))
+        self._file.write(bytes(data))
+
+    def close(self):
+        self._file.close()
+
+
+def read_log(path):
+    """Stream records of log file
+
+    Arguments:
+        path {string} -- log file path
+
+    Yields:
+        tuple -- session timestamp in nanoseconds and message bytes
+    """
+    with open(path, "rb") as log:
+        if log.read(len(MAGIC)) != MAGIC:
+            raise ValueError("'%s' is not padKontrol input log" % path)
+        while True:
+            header = log.read(_RECORD.size)
+            if len(header) < _RECORD.size:
+                return
+            timestamp, length = _RECORD.unpack(header)
+            data = log.read(length)
+            if len(data) < length:
+                return  # truncated by interrupted recording
+            yield timestamp, data
+
+
+def replay(path, listener, realtime=True):
+    """Feed recorded messages to input listener
+
+    Arguments:
+        path {string} -- log file path
+        listener {PadKontrolPrint} -- registered input listener
+
+    Keyword Arguments:
+        realtime {bool} -- keep original timing, otherwise replay as fast
+            as possible (default: {True})
+
+    Returns:
+        int -- replayed messages
+    """
+    from scheduler import Scheduler
+
+    wait_until = Scheduler().wait_until
+    start = time.perf_counter_ns()
+    previous = 0
+    count = 0
+    for timestamp, data in read_log(path):
+        if timestamp < previous:
+            # next appended session
+            start += previous - timestamp
+        previous = timestamp
+        if realtime:
+            wait_until(start + timestamp)
+        listener.process_bytes(data)
+        count += 1
+    return count
+
+
+class SinkPort:
+    """Stand-in output port, counts written messages"""
+
+    def __init__(self, name="sink"):
+        self.name = name
+        self.messages = 0
+        self.bytes = 0
+
+    def send_bytes(self, data):
+        self.messages += 1
+        self.bytes += len(data)
+
+    def send(self, message):
+        self.send_bytes(message.bytes())
+
+    def close(self):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay padKontrol input log")
+    parser.add_argument("log")
+    parser.add_argument(
+        "--fast", action="store_true", help="replay as fast as possible"
+    )
+    parser.add_argument(
+        "--state", choices=["free", "redrum", "strummer"], default="free"
+    )
+    args = parser.parse_args()
+
+    import midi_ports as mp
+    from kontrol_listener import PadKontrolPrint
+    from main import Context
+
+    if args.state == "free":
+        from States.free import FreeState as state_class
+    elif args.state == "redrum":
+        from States.redrum import ReDrumState as state_class
+    else:
+        from States.strummer import Strummer as state_class
+
+    out, data = SinkPort("padKontrol"), SinkPort("data")
+    mp.install_ports(out, data)
+
+    context = Context()
+    context.add_state(state_class())
+    listener = PadKontrolPrint()
+    listener.register(context)
+    context.load_state()
+
+    started = time.perf_counter()
+    count = replay(args.log, listener, realtime=not args.fast)
+    stats = mp.stop_writer()
+    elapsed = time.perf_counter() - started
+
+    print(f"{count} events in {elapsed:.3f}s ({count / elapsed:,.0f} events/s)")
+    print(f"padKontrol frames: {out.messages}, data messages: {data.messages}")
+    print(stats)
+
+
+if __name__ == "__main__":
+    main()
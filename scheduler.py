@@ -0,0 +1,221 @@
+import heapq
+import threading
+import time
+from math import sqrt
+
+import realtime
+from midi_event import MidiEvent
+
+
+class LatenessStats:
+    """Running statistics of event lateness (fire time - deadline)"""
+
+    __slots__ = ("count", "total", "squares", "min", "max")
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total = 0
+        self.squares = 0
+        self.min = 0
+        self.max = 0
+
+    def add(self, lateness):
+        """Record lateness in nanoseconds"""
+        if not self.count or lateness < self.min:
+            self.min = lateness
+        if lateness > self.max:
+            self.max = lateness
+        self.count += 1
+        self.total += lateness
+        self.squares += lateness * lateness
+
+    def summary(self):
+        """Get statistics in microseconds
+
+        Returns:
+            dict -- count, mean, standard deviation (jitter), min and max
+        """
+        count = self.count or 1
+        mean = self.total / count
+        variance = max(0, self.squares / count - mean * mean)
+        return dict(
+            count=self.count,
+            mean_us=mean / 1000,
+            jitter_us=sqrt(variance) / 1000,
+            min_us=self.min / 1000,
+            max_us=self.max / 1000,
+        )
+
+
+class Scheduler:
+    """Deadline ordered queue of callbacks.
+
+    Events are `MidiEvent` objects in a heap, tick is deadline from
+    `time.perf_counter_ns()` and message is `(callback, argument)` tuple.
+    Waiting for deadline sleeps until `spin_ns` before deadline and spins
+    the rest, so events fire with sub-millisecond precision regardless of
+    OS sleep granularity.
+
+    Keyword Arguments:
+        spin_ns {int} -- busy wait time before deadline (default: {1ms})
+    """
+
+    def __init__(self, spin_ns=1_000_000):
+        self.spin_ns = spin_ns
+        self.lateness = LatenessStats()
+        self._queue = []
+
+    def __len__(self):
+        return len(self._queue)
+
+    def schedule(self, deadline, callback, argument=None):
+        """Add event
+
+        Arguments:
+            deadline {int} -- `time.perf_counter_ns()` time of event
+            callback {callable} -- called with `argument`, if given
+        """
+        heapq.heappush(self._queue, MidiEvent(deadline, (callback, argument)))
+
+    def clear(self):
+        del self._queue[:]
+
+    def next_deadline(self):
+        return self._queue[0].tick if self._queue else None
+
+    def wait_until(self, deadline):
+        """Sleep and spin until deadline
+
+        Returns:
+            int -- current `time.perf_counter_ns()` time
+        """
+        remaining = deadline - time.perf_counter_ns() - self.spin_ns
+        if remaining > 0:
+            time.sleep(remaining / 1e9)
+        now = time.perf_counter_ns()
+        while now < deadline:
+            now = time.perf_counter_ns()
+        return now
+
+    def run_due(self, now=None):
+        """Fire all events with deadline before `now`
+
+        Returns:
+            int -- number of fired events
+        """
+        if now is None:
+            now = time.perf_counter_ns()
+        return self.fire(self.pop_due(now))
+
+    def pop_due(self, now):
+        """Remove events with deadline before `now`
+
+        Returns:
+            list -- due events in deadline order
+        """
+        queue = self._queue
+        due = []
+        while queue and queue[0].tick <= now:
+            due.append(heapq.heappop(queue))
+        return due
+
+    def fire(self, events):
+        """Call callbacks of events and record lateness
+
+        Returns:
+            int -- number of fired events
+        """
+        lateness = self.lateness
+        for event in events:
+            lateness.add(time.perf_counter_ns() - event.tick)
+            callback, argument = event.message
+            if argument is None:
+                callback()
+            else:
+                callback(argument)
+        return len(events)
+
+    def run_next(self):
+        """Wait for the earliest event and fire all due events
+
+        Returns:
+            int -- number of fired events
+        """
+        if not self._queue:
+            return 0
+        return self.run_due(self.wait_until(self._queue[0].tick))
+
+
+class Timer(threading.Thread):
+    """Timer thread firing scheduled callbacks of many producers.
+
+    Thread safe front of `Scheduler`: events may be scheduled from any
+    thread, timer thread sleeps until the earliest deadline (or new earlier
+    event) and spins the last `spin_ns`.
+
+    Keyword Arguments:
+        spin_ns {int} -- busy wait time before deadline (default: {1ms})
+    """
+
+    def __init__(self, spin_ns=1_000_000):
+        super().__init__(name="Timer", daemon=True)
+        self.scheduler = Scheduler(spin_ns)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._running = True
+
+    @property
+    def lateness(self):
+        return self.scheduler.lateness
+
+    def schedule(self, deadline, callback, argument=None):
+        """Add event, see `Scheduler.schedule`"""
+        scheduler = self.scheduler
+        with self._lock:
+            earliest = scheduler.next_deadline()
+            scheduler.schedule(deadline, callback, argument)
+        if earliest is None or deadline < earliest:
+            self._wake.set()
+
+    def stop(self, timeout=None):
+        self._running = False
+        self._wake.set()
+        if self.is_alive():
+            self.join(timeout)
+
+    def run(self):
+        if realtime.enabled:
+            realtime.promote("Timer")
+        scheduler = self.scheduler
+        lock = self._lock
+        wake = self._wake
+        spin_ns = scheduler.spin_ns
+        while self._running:
+            deadline = scheduler.next_deadline()
+            if deadline is None:
+                wake.wait()
+                wake.clear()
+                continue
+            remaining = deadline - time.perf_counter_ns() - spin_ns
+            if remaining > 0 and wake.wait(remaining / 1e9):
+                wake.clear()  # earlier event scheduled
+                continue
+            now = scheduler.wait_until(deadline)
+            with lock:
+                due = scheduler.pop_due(now)
+            scheduler.fire(due)
+
+
+_timer = None
+
+
+def shared_timer():
+    """Get started timer thread shared by all states"""
+    global _timer
+    if _timer is None:
+        _timer = Timer()
+        _timer.start()
+    return _timer
@@ -0,0 +1,488 @@
+"""ReDrum playback engine in separate process.
+
+Engine process has its own interpreter, so GIL contention in controller
+process (x/y pad floods, input decoding, light feedback) does not delay
+steps. Processes share one `multiprocessing.shared_memory` block:
+
+    header -- tempo, resolution, channel, pattern size, play flag, stats
+        of step lateness and of pause to silence latency
+    ring   -- edit commands of controller process (`EditRing`)
+    grid   -- `PatternGrid` notes, track lengths and cells
+
+Controller process is the only writer of the grid. Changed steps (grid
+dirty bitmap) are published on the ring, engine recomputes their bitmaps
+and recompiles bundles before the next step. Played steps are reported
+back through pipe, so controller process flashes pads of current
+instrument.
+"""
+
+import multiprocessing
+import threading
+import time
+from multiprocessing import shared_memory
+
+import mido
+
+import midi_ports as mp
+import realtime
+from scheduler import LatenessStats
+from States.drumpattern import Drumpattern, PatternGrid
+from States.redrum import ReDrumState
+
+# header slots (int64)
+RUNNING = 0
+PLAYING = 1
+BPM = 2
+RESOLUTION = 3
+CHANNEL = 4
+USED = 5
+LENGTH = 6
+STATS_VERSION = 7  # incremented by engine before and after stats update
+STATS_COUNT = 8
+STATS_TOTAL = 9
+STATS_SQUARES = 10
+STATS_MIN = 11
+STATS_MAX = 12
+STATS_SKIPPED = 13
+SILENCE_REQUESTED = 14  # perf_counter_ns time of controller pause
+SILENCE_COUNT = 15  # pause to silence latency, like STATS_COUNT ... STATS_MAX
+SILENCE_TOTAL = 16
+SILENCE_SQUARES = 17
+SILENCE_MIN = 18
+SILENCE_MAX = 19
+_HEADER_SLOTS = 24
+
+# edit commands
+EDIT_STEP = 0  # argument: changed step
+EDIT_SIZE = 1  # argument: used tracks << 16 | pattern length
+EDIT_CURSOR = 2  # argument: next played step
+
+
+class EditRing:
+    """Lock-free single producer single consumer ring of `(command, argument)`
+    pairs in shared buffer.
+
+    Producer writes entry before publishing it by moving head, consumer
+    reads entries before releasing them by moving tail, head and tail
+    have a single writer each.
+
+    Arguments:
+        buffer {buffer} -- shared buffer of `nbytes(size)` size
+        size {int} -- number of entries, power of 2
+    """
+
+    def __init__(self, buffer, size):
+        self.size = size
+        self._mask = size - 1
+        slots = memoryview(buffer).cast("q")
+        self._index = slots[:2]  # head, tail
+        self._entries = slots[2:]
+
+    @staticmethod
+    def nbytes(size):
+        return 8 * (2 + 2 * size)
+
+    def __len__(self):
+        return self._index[0] - self._index[1]
+
+    def push(self, command, argument):
+        """Add entry, returns False if ring is full"""
+        head = self._index[0]
+        if head - self._index[1] >= self.size:
+            return False
+        slot = (head & self._mask) << 1
+        self._entries[slot] = command
+        self._entries[slot + 1] = argument
+        self._index[0] = head + 1
+        return True
+
+    def pop_all(self):
+        """Remove all published entries
+
+        Returns:
+            list -- `(command, argument)` pairs
+        """
+        head = self._index[0]
+        tail = self._index[1]
+        entries = self._entries
+        mask = self._mask
+        edits = []
+        while tail < head:
+            slot = (tail & mask) << 1
+            edits.append((entries[slot], entries[slot + 1]))
+            tail += 1
+        self._index[1] = tail
+        return edits
+
+    def release(self):
+        self._index.release()
+        self._entries.release()
+
+
+class SharedSequencer:
+    """Layout of shared memory block
+
+    Arguments:
+        memory {SharedMemory} -- shared block of `nbytes` size
+        tracks {int} -- max number of tracks
+        steps {int} -- max pattern length
+
+    Keyword Arguments:
+        ring_size {int} -- edit ring entries (default: {4096})
+    """
+
+    def __init__(self, memory, tracks, steps, ring_size=4096):
+        self.memory = memory
+        buffer = memory.buf
+        ring_end = 8 * _HEADER_SLOTS + EditRing.nbytes(ring_size)
+        self.header = buffer[: 8 * _HEADER_SLOTS].cast("q")
+        self.ring = EditRing(buffer[8 * _HEADER_SLOTS : ring_end], ring_size)
+        self.grid = buffer[ring_end : ring_end + PatternGrid.nbytes(tracks, steps)]
+
+    @staticmethod
+    def nbytes(tracks, steps, ring_size=4096):
+        return (
+            8 * _HEADER_SLOTS
+            + EditRing.nbytes(ring_size)
+            + PatternGrid.nbytes(tracks, steps)
+        )
+
+    def put_stats(self, lateness, skipped=0):
+        """Publish `LatenessStats` of engine scheduler and number of
+        skipped steps"""
+        header = self.header
+        header[STATS_VERSION] += 1  # odd while stats are written
+        self._put_lateness(STATS_COUNT, lateness)
+        header[STATS_SKIPPED] = skipped
+        header[STATS_VERSION] += 1
+
+    def put_silence(self, latency):
+        """Publish pause to silence `LatenessStats` of engine"""
+        header = self.header
+        header[STATS_VERSION] += 1
+        self._put_lateness(SILENCE_COUNT, latency)
+        header[STATS_VERSION] += 1
+
+    def get_stats(self, slot):
+        """Read `LatenessStats` published at slot (STATS_COUNT or SILENCE_COUNT),
+        read again if engine updated stats meanwhile
+
+        Returns:
+            tuple -- `LatenessStats` and number of skipped steps
+        """
+        header = self.header
+        while True:
+            version = header[STATS_VERSION]
+            if not version & 1:
+                stats = LatenessStats()
+                stats.count = header[slot]
+                stats.total = header[slot + 1]
+                stats.squares = header[slot + 2]
+                stats.min = header[slot + 3]
+                stats.max = header[slot + 4]
+                skipped = header[STATS_SKIPPED]
+                if header[STATS_VERSION] == version:
+                    return stats, skipped
+            time.sleep(0)
+
+    def _put_lateness(self, slot, lateness):
+        header = self.header
+        header[slot] = lateness.count
+        header[slot + 1] = lateness.total
+        header[slot + 2] = min(lateness.squares, 2**63 - 1)
+        header[slot + 3] = lateness.min
+        header[slot + 4] = lateness.max
+
+    def release(self):
+        """Release views of shared block, so it can be closed"""
+        self.header.release()
+        self.ring.release()
+        self.grid.release()
+
+
+class EnginePattern(Drumpattern):
+    """Pattern of engine process attached to shared grid, played steps are
+    reported to controller process instead of flashing pads
+
+    Arguments:
+        shared {SharedSequencer} -- shared block
+        steps_out {Connection} -- pipe end of played steps
+        tracks {int} -- max number of tracks
+        steps {int} -- max pattern length
+    """
+
+    def __init__(self, shared, steps_out, tracks, steps):
+        super().__init__(tracks=tracks)
+        header = shared.header
+        self.grid = PatternGrid(tracks, steps, header[LENGTH], buffer=shared.grid)
+        self.grid.sync(header[USED], header[LENGTH])
+        for step in range(header[LENGTH]):
+            self.grid.refresh(step)
+        self._allocate(steps)
+        self._steps_out = steps_out
+
+    def apply_edits(self, edits):
+        grid = self.grid
+        for command, argument in edits:
+            if command == EDIT_STEP:
+                grid.refresh(argument)
+            elif command == EDIT_SIZE:
+                grid.sync(argument >> 16, argument & 0xFFFF)
+                self.step %= grid.length
+            elif command == EDIT_CURSOR:
+                self.step = argument % grid.length
+
+    def current_instrument_seq(self, bpm, step):
+        self._steps_out.send_bytes(step.to_bytes(2, "little"))
+
+
+class EngineState(ReDrumState):
+    """ReDrum sequencer thread of engine process, follows transport and
+    tempo of controller process"""
+
+    stats_interval = 16  # played steps between stats updates
+
+    def __init__(self, shared, steps_out, transport, tracks, steps):
+        super().__init__()
+        self.shared = shared
+        self._unpublished = 0  # steps played since stats update
+        self.transport_changed = transport
+        header = shared.header
+        self.channel = header[CHANNEL]
+        self.set_tempo(header[BPM], header[RESOLUTION])
+        self.pattern = EnginePattern(shared, steps_out, tracks, steps)
+
+    def _apply_edits(self):
+        edits = self.shared.ring.pop_all()
+        if edits:
+            self.pattern.apply_edits(edits)
+
+    def _restart_clock(self):
+        self._apply_edits()  # cursor moved while paused
+        super()._restart_clock()
+
+    def main_loop(self):
+        self._apply_edits()
+        super().main_loop()
+
+    def worker(self):
+        super().worker()
+        self._unpublished += 1
+        if self._unpublished >= self.stats_interval:
+            self._put_stats()
+
+    def _put_stats(self):
+        self._unpublished = 0
+        self.shared.put_stats(self.scheduler.lateness, self.skipped_steps)
+
+    def _silence(self):
+        super()._silence()
+        self.shared.put_silence(self.silence_latency)
+        self._put_stats()
+
+    def follow_transport(self):
+        """Apply play flag and tempo on transport change (control thread)"""
+        header = self.shared.header
+        while header[RUNNING]:
+            self.transport_changed.wait()
+            self.transport_changed.clear()
+            if header[BPM] != self.bpm or header[RESOLUTION] != self.resolution:
+                self.set_tempo(header[BPM], header[RESOLUTION])
+            if header[PLAYING] and self.paused:
+                self.play()
+            elif not header[PLAYING] and not self.paused:
+                self.pause(header[SILENCE_REQUESTED])
+        self.shutdown()
+
+
+def _engine_main(
+    name, tracks, steps, transport, steps_out, data_port, backend, realtime_settings
+):
+    if backend:
+        mido.set_backend(backend)
+    if realtime_settings:
+        realtime.enable(**realtime_settings)
+    mp.get_midi_out_data(data_port)  # written directly, no output thread
+    memory = shared_memory.SharedMemory(name)
+    shared = SharedSequencer(memory, tracks, steps)
+    state = EngineState(shared, steps_out, transport, tracks, steps)
+    threading.Thread(
+        target=state.follow_transport, name="EngineTransport", daemon=True
+    ).start()
+    if realtime.enabled:
+        realtime.freeze()  # sequencer thread runs safe points
+    try:
+        state.run()
+    finally:
+        state.pattern.grid.share(bytearray(len(shared.grid)))
+        shared.release()
+        memory.close()
+        mp.get_midi_out_data().close()
+
+
+class SequencerProcess:
+    """Controller side of engine process playing pattern
+
+    Pattern grid is moved to shared memory, edits of pattern are sent to
+    engine by `publish`.
+
+    Arguments:
+        pattern {Drumpattern} -- played pattern
+
+    Keyword Arguments:
+        bpm {int} -- tempo (default: {120})
+        resolution {int} -- steps per beat (default: {4})
+        channel {int} -- midi channel (default: {1})
+        data_port {string} -- output port opened by engine (default: {DATA_MIDI_PORT})
+        backend {string} -- mido backend of engine (default: {BACKEND})
+        realtime_settings {dict} -- realtime mode of engine, see
+            `realtime.enable` (default: {controller realtime mode})
+    """
+
+    def __init__(
+        self,
+        pattern,
+        bpm=120,
+        resolution=4,
+        channel=1,
+        data_port=mp.DATA_MIDI_PORT,
+        backend=mp.BACKEND,
+        realtime_settings=None,
+    ):
+        self.pattern = pattern
+        grid = pattern.grid
+        context = multiprocessing.get_context("spawn")
+        self._memory = shared_memory.SharedMemory(
+            create=True, size=SharedSequencer.nbytes(grid.tracks, grid.steps)
+        )
+        self.shared = SharedSequencer(self._memory, grid.tracks, grid.steps)
+        grid.share(self.shared.grid)
+        grid.take_dirty()  # engine reads whole grid on start
+        header = self.shared.header
+        header[RUNNING] = 1
+        header[BPM] = bpm
+        header[RESOLUTION] = resolution
+        header[CHANNEL] = channel
+        header[USED] = grid.used
+        header[LENGTH] = grid.length
+        self._size = (grid.used, grid.length)
+        self._cursor = None  # step cursor not sent yet
+        self._transport = context.Event()
+        steps_in, steps_out = context.Pipe(duplex=False)
+        self._steps_in = steps_in
+        self.process = context.Process(
+            target=_engine_main,
+            args=(
+                self._memory.name,
+                grid.tracks,
+                grid.steps,
+                self._transport,
+                steps_out,
+                data_port,
+                backend,
+                realtime_settings or realtime.settings(),
+            ),
+            name="ReDrumEngine",
+            daemon=True,
+        )
+        self.process.start()
+        steps_out.close()
+        self._feedback = threading.Thread(
+            target=self._follow_steps, name="EngineSteps", daemon=True
+        )
+        self._feedback.start()
+
+    @property
+    def playing(self):
+        return bool(self.shared.header[PLAYING])
+
+    def _signal(self, slot, value):
+        self.shared.header[slot] = value
+        self._transport.set()
+
+    def play(self):
+        self.publish()
+        self._signal(PLAYING, 1)
+
+    def pause(self):
+        # perf_counter is system-wide monotonic clock, engine measures
+        # silence latency from controller request
+        self.shared.header[SILENCE_REQUESTED] = time.perf_counter_ns()
+        self._signal(PLAYING, 0)
+
+    def set_tempo(self, bpm, resolution):
+        self.shared.header[RESOLUTION] = resolution
+        self._signal(BPM, bpm)
+
+    def set_step(self, step):
+        """Move engine step cursor, sent after pattern changes by `publish`"""
+        self._cursor = step
+        self.publish()
+
+    def publish(self):
+        """Send pattern changes and step cursor set since last publish to engine
+
+        Returns:
+            bool -- all changes sent, False if ring is full (rest is sent
+                by the next publish)
+        """
+        grid = self.pattern.grid
+        ring = self.shared.ring
+        size = (grid.used, grid.length)
+        if size != self._size:
+            if not ring.push(EDIT_SIZE, size[0] << 16 | size[1]):
+                return False
+            self._size = size
+        dirty = grid.take_dirty()
+        while dirty:
+            bit = dirty & -dirty
+            if not ring.push(EDIT_STEP, bit.bit_length() - 1):
+                grid.mark_dirty(dirty)
+                return False
+            dirty ^= bit
+        if self._cursor is not None:
+            if not ring.push(EDIT_CURSOR, self._cursor):
+                return False
+            self._cursor = None
+        return True
+
+    def timing_stats(self):
+        """Get lateness statistics of engine steps (see `LatenessStats.summary`),
+        published by engine every `EngineState.stats_interval` played steps
+        and on pause"""
+        stats, skipped = self.shared.get_stats(STATS_COUNT)
+        return dict(stats.summary(), skipped=skipped)
+
+    def silence_stats(self):
+        """Get pause to silence latency of engine (see `LatenessStats.summary`),
+        published by engine after note offs of each pause"""
+        stats, _ = self.shared.get_stats(SILENCE_COUNT)
+        return stats.summary()
+
+    def _follow_steps(self):
+        pattern = self.pattern
+        header = self.shared.header
+        try:
+            while True:
+                step = int.from_bytes(self._steps_in.recv_bytes(), "little")
+                if pattern.curent_instrument:
+                    pattern.current_instrument_seq(header[BPM], step)
+        except (EOFError, OSError):
+            pass  # engine stopped
+
+    def close(self, timeout=2.0):
+        """Stop engine process and move pattern grid back to private memory"""
+        if self.shared is None:
+            return  # already closed
+        self._signal(RUNNING, 0)
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+        self._feedback.join(timeout)  # ends with engine end of steps pipe
+        self._steps_in.close()
+        grid = self.pattern.grid
+        grid.share(bytearray(len(self.shared.grid)))
+        self.shared.release()
+        self.shared = None
+        self._memory.close()
+        self._memory.unlink()
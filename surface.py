@@ -0,0 +1,147 @@
+import threading
+
+import padKontrol as pk
+from midi_writer import LIGHT_GROUP_KEY
+
+
+class Surface:
+    """Retained model of padKontrol pad and button lights.
+
+    States mutate desired lights and `render` sends only the difference
+    from lights last sent to the device: single change as one `light`
+    message, bulk changes as one `light_group` message.
+
+    Lights out of `light_group` range (x/y pad button, led segments)
+    are sent immediately.
+
+    Methods are thread safe, states and sequencer threads update lights
+    concurrently.
+
+    Arguments:
+        write {callable} -- function sending SysEx frame to padKontrol
+    """
+
+    def __init__(self, write):
+        self._write = write
+        self._desired = 0
+        self._sent = None  # unknown device state, first render sends all lights
+        self._blink = 0  # lights in blink state set by single light message
+        self._stale = 0  # lights with state different from sent bitmap
+        # reentrant, output may report dropped frame while frame is written
+        self._lock = threading.RLock()
+
+    def reset(self):
+        """Mark all lights as turned off on device (e.g. after native mode init)"""
+        with self._lock:
+            self._desired = self._sent = self._blink = self._stale = 0
+
+    def invalidate(self):
+        """Forget device state, next render will refresh all lights"""
+        with self._lock:
+            self._sent = None
+
+    def frame_dropped(self, key):
+        """Output dropped frame, resend what it changed on next render
+
+        Arguments:
+            key {int} -- `midi_writer.feedback_key` of dropped frame
+        """
+        with self._lock:
+            if key < pk.LIGHT_GROUP_SIZE:
+                self._stale |= 1 << key
+            elif key == LIGHT_GROUP_KEY:
+                self._sent = None
+
+    def is_on(self, control):
+        return bool(self._desired >> control & 1)
+
+    def set(self, control, on=True):
+        """Set desired state of single light
+
+        Arguments:
+            control {int} -- button constant or pad number
+
+        Keyword Arguments:
+            on {bool} -- light state (default: {True})
+        """
+        with self._lock:
+            self._set(control, on)
+
+    def set_many(self, controls, on=True):
+        with self._lock:
+            for control in controls:
+                self._set(control, on)
+
+    def _set(self, control, on):
+        if control >= pk.LIGHT_GROUP_SIZE:
+            state = pk.LIGHT_STATE_ON if on else pk.LIGHT_STATE_OFF
+            self._write(pk.LIGHT_FRAMES[control, state])
+            return
+        bit = 1 << control
+        if self._blink & bit:
+            # blinking light has to be overwritten even if bitmap is unchanged
+            self._blink &= ~bit
+            self._stale |= bit
+        if on:
+            self._desired |= bit
+        else:
+            self._desired &= ~bit
+
+    def blink(self, control):
+        """Blink light immediately, blinking light is treated as turned on"""
+        with self._lock:
+            self._write(pk.LIGHT_FRAMES[control, pk.LIGHT_STATE_BLINK])
+            if control >= pk.LIGHT_GROUP_SIZE:
+                return
+            bit = 1 << control
+            self._desired |= bit
+            self._blink |= bit
+            self._stale &= ~bit
+            if self._sent is not None:
+                self._sent |= bit
+
+    def flash(self, control, duration=0.5):
+        """Flash light immediately, desired state is unchanged.
+
+        Flashed light is turned off on device, next render turns it back
+        on if it is desired on.
+        """
+        with self._lock:
+            self._write(pk.light_flash_frame(control, duration))
+            if control >= pk.LIGHT_GROUP_SIZE:
+                return
+            bit = 1 << control
+            self._blink &= ~bit
+            self._stale &= ~bit
+            if self._sent is not None:
+                self._sent &= ~bit
+
+    def render(self):
+        """Send minimum number of frames to match desired lights state"""
+        with self._lock:
+            self._render()
+
+    def _render(self):
+        desired = self._desired
+        if self._sent is None:
+            diff = pk.LIGHT_GROUP_MASK
+        else:
+            diff = (desired ^ self._sent) | self._stale
+        if not diff:
+            return
+        # update before sending, output may mark state stale on dropped frame
+        self._sent = desired
+        self._stale = 0
+        if diff & (diff - 1) == 0:
+            # single light change
+            control = diff.bit_length() - 1
+            state = pk.LIGHT_STATE_ON if desired & diff else pk.LIGHT_STATE_OFF
+            self._write(pk.LIGHT_FRAMES[control, state])
+        else:
+            self._write(pk.light_group_frame(desired))
+            # light_group overwrites blinking lights with constant light
+            blink = self._blink & desired
+            while blink:
+                bit = blink & -blink
+                self._write(pk.LIGHT_FRAMES[bit.bit_length() - 1, pk.LIGHT_STATE_BLINK])
+                blink ^= bit
@@ -0,0 +1,68 @@
+import pytest
+
+import midi_ports as mp
+import padKontrol as pk
+from decorators import action_on_press, press_light
+from midi_event import EventType, SysexEvent
+from midi_writer import MidiWriter
+
+
+class Pads:
+    def __init__(self, writer):
+        self.writer = writer
+        self.held = []
+
+    @press_light
+    def play(self, sysEx):
+        mp.note_on(0, 36, sysEx.data)
+        # output of handler is held until it returns
+        self.held.append(len(self.writer._data) + len(self.writer._feedback))
+
+    @press_light
+    @action_on_press(False)
+    def nested(self, sysEx):
+        self.play(sysEx)
+
+
+@pytest.fixture
+def writer(monkeypatch):
+    writer = MidiWriter(list.append, list.append)
+    monkeypatch.setattr(mp, "_writer", writer)
+    monkeypatch.setattr(mp, "_write_data", writer.send_data)
+    monkeypatch.setattr(mp, "_write_out", writer.send_feedback)
+    mp.surface.reset()
+    yield writer
+    mp.surface.reset()
+
+
+def event(control, pressed, velocity=100):
+    state = pk.NOTE_ON if pressed else pk.NOTE_OFF
+    return SysexEvent(EventType.PAD, control, state, velocity)
+
+
+def test_note_and_light_queued_in_one_batch(writer):
+    pads = Pads(writer)
+    pads.play(event(3, True))
+    assert pads.held == [0]
+    assert [message for message, _, _ in writer._data] == [[0x90, 36, 100]]
+    assert [frame for _, frame in writer._feedback] == [
+        pk.LIGHT_FRAMES[3, pk.LIGHT_STATE_ON]
+    ]
+    assert mp.surface.is_on(3)
+
+    pads.play(event(3, False, 0))
+    assert not mp.surface.is_on(3)
+    assert writer._feedback[-1][1] == pk.LIGHT_FRAMES[3, pk.LIGHT_STATE_OFF]
+
+
+def test_nested_handlers_share_batch(writer):
+    pads = Pads(writer)
+    pads.nested(event(pk.BUTTON_HOLD, True))
+    assert pads.held == [0]
+    assert len(writer._data) == 1
+    # release is filtered by action_on_press, light follows button
+    pads.nested(event(pk.BUTTON_HOLD, False, 0))
+    assert pads.held == [0]
+    assert not mp.surface.is_on(pk.BUTTON_HOLD)
+    assert writer.begin_batch()
+    writer.end_batch()
@@ -0,0 +1,181 @@
+import threading
+
+import pytest
+
+import midi_ports as mp
+from States.drumpattern import Drumpattern, PatternGrid
+
+
+@pytest.fixture
+def written(monkeypatch):
+    """Messages written to data port"""
+    messages = []
+    monkeypatch.setattr(mp, "_writer", None)
+    monkeypatch.setattr(mp, "_write_data", messages.append)
+    return messages
+
+
+def test_set_updates_cell_mask_and_dirty():
+    grid = PatternGrid(tracks=4, steps=16)
+    track = grid.add_track(36)
+    grid.set(track, 3, 100)
+    assert grid.get(track, 3) == 100
+    assert grid.masks[3] == 1 << track
+    assert grid.take_dirty() == 1 << 3
+    assert grid.take_dirty() == 0
+    grid.set(track, 3, 0)
+    assert grid.masks[3] == 0
+    assert grid.take_dirty() == 1 << 3
+
+
+def test_short_track_is_tiled():
+    grid = PatternGrid(tracks=4, steps=16)
+    track = grid.add_track(36, length=4)
+    grid.set(track, 1, 90)
+    assert [step for step in range(16) if grid.get(track, step)] == [1, 5, 9, 13]
+    assert [step for step in range(16) if grid.masks[step]] == [1, 5, 9, 13]
+
+
+def test_track_length_change_tiles_new_length():
+    grid = PatternGrid(tracks=4, steps=16)
+    track = grid.add_track(36, length=4)
+    grid.set(track, 0, 80)
+    grid.set_track_length(track, 8)
+    # steps 4-7 are new empty steps, tiled over steps 8-15
+    assert [step for step in range(16) if grid.get(track, step)] == [0, 8]
+
+
+def test_shrinking_pattern_clears_steps():
+    grid = PatternGrid(tracks=4, steps=32)
+    track = grid.add_track(36)
+    grid.set(track, 12, 70)
+    grid.length = 8
+    assert grid.length == 8
+    assert grid.masks[12] == 0
+    assert not any(grid.column(12))
+
+
+def test_set_note_marks_steps_with_hits():
+    grid = PatternGrid(tracks=4, steps=16)
+    kick = grid.add_track(36)
+    snare = grid.add_track(38)
+    grid.set(kick, 0, 100)
+    grid.set(snare, 4, 100)
+    grid.take_dirty()
+    grid.set_note(snare, 40)
+    assert grid.notes[snare] == 40
+    assert grid.take_dirty() == 1 << 4
+
+
+def test_shared_grid_reads_same_cells():
+    grid = PatternGrid(tracks=4, steps=16)
+    track = grid.add_track(36)
+    buffer = bytearray(PatternGrid.nbytes(4, 16))
+    grid.share(buffer)
+    attached = PatternGrid(tracks=4, steps=16, buffer=buffer)
+    attached.sync(grid.used, grid.length)
+    grid.set(track, 2, 64)
+    attached.refresh(2)
+    assert attached.get(track, 2) == 64
+    assert attached.masks[2] == 1 << track
+    assert attached.notes[track] == 36
+    assert attached.take_dirty() == 1 << 2
+
+
+def test_edits_during_compile_are_not_lost(written):
+    pattern = Drumpattern(tracks=8, steps=16)
+    for note in range(36, 44):
+        pattern.add_instrument(note=note)
+    grid = pattern.grid
+
+    def edit():
+        for index in range(20000):
+            grid.set(index % 8, index * 7 % 16, index % 128)
+
+    editor = threading.Thread(target=edit)
+    editor.start()
+    while editor.is_alive():
+        pattern._compile_dirty(1)
+    pattern._compile_dirty(1)
+    for step in range(16):
+        assert pattern._bundles[step] == pattern.compile_step(step, 1)
+
+
+def test_step_bundle_stops_previous_step(written):
+    pattern = Drumpattern(tracks=4, steps=16)
+    kick = pattern.add_instrument(note=36)
+    snare = pattern.add_instrument(note=38)
+    kick.strokes[0] = 100
+    snare.strokes[0] = 90
+    kick.strokes[1] = 80
+    assert pattern.compile_step(0, 9) == (
+        mp.note_bytes(9, 36, 100),
+        mp.note_bytes(9, 38, 90),
+    )
+    assert pattern.compile_step(1, 9) == (
+        mp.note_bytes(9, 36, 0),
+        mp.note_bytes(9, 38, 0),
+        mp.note_bytes(9, 36, 80),
+    )
+    assert pattern.compile_step(2, 9) == (mp.note_bytes(9, 36, 0),)
+
+
+def test_edit_recompiles_offs_of_next_step(written):
+    pattern = Drumpattern(tracks=4, steps=16)
+    pattern.current_instrument_seq = lambda bpm, step: None
+    kick = pattern.add_instrument(note=36)
+    kick.strokes[0] = 100
+    pattern._compile_dirty(9)
+    kick.strokes[15] = 70
+    pattern.steps = 8  # offs of step 0 from step 7
+    pattern._compile_dirty(9)
+    for step in range(8):
+        assert pattern._bundles[step] == pattern.compile_step(step, 9)
+
+
+def play(pattern, steps):
+    for _ in range(steps):
+        pattern.playstep(120, channel=9)
+
+
+def test_ringing_notes_stopped_once(written):
+    pattern = Drumpattern(tracks=4, steps=4)
+    pattern.current_instrument_seq = lambda bpm, step: None
+    kick = pattern.add_instrument(note=36)
+    hat = pattern.add_instrument(note=42)
+    kick.strokes[0] = 100
+    hat.strokes[1] = 60
+    play(pattern, 2)
+    assert written == [
+        mp.note_bytes(9, 36, 100),
+        mp.note_bytes(9, 36, 0),
+        mp.note_bytes(9, 42, 60),
+    ]
+    del written[:]
+    # cursor moved, last played notes are stopped by the next step
+    pattern.skip(1)
+    play(pattern, 1)
+    assert written == [mp.note_bytes(9, 42, 0)]
+    assert pattern.silence(9) == 0
+    # nothing rings after silence
+    del written[:]
+    pattern.step = 1
+    play(pattern, 1)
+    assert written == [mp.note_bytes(9, 42, 60)]
+    del written[:]
+    assert pattern.silence(9) == 1
+    assert written == [mp.note_bytes(9, 42, 0)]
+
+
+def test_humanized_step_stops_previous_step(written):
+    pattern = Drumpattern(tracks=4, steps=4, humanize=0.1, seed=1)
+    pattern.current_instrument_seq = lambda bpm, step: None
+    kick = pattern.add_instrument(note=36)
+    kick.strokes[0] = 100
+    kick.strokes[1] = 100
+    play(pattern, 3)
+    assert [message[1:] for message in written][1::2] == [
+        bytes((36, 0)),
+        bytes((36, 0)),
+    ]
+    assert pattern.silence(9) == 0
@@ -0,0 +1,84 @@
+import random
+
+import pytest
+
+from latency import Histogram
+
+
+def bucket_bounds(histogram, value):
+    """Lower bounds of bucket counting value and of the next bucket"""
+    histogram.reset()
+    histogram.record(value)
+    index = next(i for i, count in enumerate(histogram.counts) if count)
+    return histogram.bucket_value(index), histogram.bucket_value(index + 1)
+
+
+def test_small_values_are_exact():
+    histogram = Histogram()
+    for value in range(2 * Histogram.SUB_COUNT):
+        histogram.record(value)
+    assert histogram.count == 2 * Histogram.SUB_COUNT
+    assert histogram.percentile(50) == Histogram.SUB_COUNT - 1
+    assert histogram.percentile(100) == 2 * Histogram.SUB_COUNT - 1
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_bucket_contains_value(seed):
+    histogram = Histogram()
+    rng = random.Random(seed)
+    for _ in range(1000):
+        value = rng.randrange(1, 1 << 36)
+        low, high = bucket_bounds(histogram, value)
+        assert low <= value < high
+        # log-linear buckets, 2 ** SUB_BITS per power of two
+        assert high - low <= max(1, low >> Histogram.SUB_BITS)
+
+
+def test_percentiles_of_uniform_values():
+    histogram = Histogram()
+    for value in range(1, 100001):
+        histogram.record(value * 1000)
+    for percent in (50, 90, 99):
+        expected = percent * 1000 * 1000
+        assert histogram.percentile(percent) == pytest.approx(expected, rel=0.07)
+    assert histogram.max == 100000 * 1000
+
+
+def test_negative_and_huge_values_are_clamped():
+    histogram = Histogram()
+    histogram.record(-5)
+    histogram.record(1 << 50)
+    assert histogram.counts[0] == 1
+    assert histogram.counts[len(histogram.counts) - 1] == 1
+    assert histogram.count == 2
+
+
+def test_reset():
+    histogram = Histogram()
+    histogram.record(12345)
+    histogram.reset()
+    assert histogram.count == 0
+    assert histogram.max == 0
+    assert histogram.percentile(99) == 0
+    assert not any(histogram.counts)
+
+
+def test_coalesced_packets_are_timed():
+    import latency
+    from kontrol_listener import PadKontrolPrint
+
+    class Listener:
+        def notify(self, event):
+            pass
+
+    pad_hit = bytes([0xF0, 0x42, 0x40, 0x6E, 0x08, 0x45, 0x43, 0x64, 0xF7])
+    listener = PadKontrolPrint()
+    listener.register(Listener())
+    latency.reset()
+    latency.enable()
+    try:
+        listener.process_bytes(pad_hit * 3)
+    finally:
+        latency.enable(False)
+    assert latency.histograms[latency.DECODE].count == 3
+    assert latency.histograms[latency.DISPATCH].count == 3
@@ -0,0 +1,108 @@
+import random
+
+import pytest
+
+from midi_clock import (
+    CLOCK,
+    CONTINUE,
+    PPQN,
+    SONG_POSITION,
+    START,
+    STOP,
+    ClockFollower,
+    ClockMaster,
+    bpm_to_period,
+    song_position_message,
+)
+
+
+def feed(follower, times):
+    for now in times:
+        follower.receive([CLOCK], now=int(now))
+
+
+def started(bpm=120):
+    follower = ClockFollower(bpm=bpm)
+    follower.receive([START], now=0)
+    return follower
+
+
+def test_locks_to_jittered_clock():
+    period = bpm_to_period(100)
+    follower = started()
+    rng = random.Random(1)
+    feed(follower, (period * (i + 1) + rng.uniform(-1e6, 1e6) for i in range(400)))
+    assert follower.bpm == pytest.approx(100, rel=0.01)
+    assert follower.next_tick == 400
+    # grid is filtered, not the last jittered tick
+    assert follower.tick_time(400) == pytest.approx(period * 401, abs=0.5e6)
+
+
+def test_lost_ticks_advance_position():
+    period = bpm_to_period(120)
+    follower = started()
+    times = [period * (i + 1) for i in range(202)]
+    del times[100:103]  # 3 ticks lost by driver
+    feed(follower, times)
+    assert follower.next_tick == 202
+    assert follower.bpm == pytest.approx(120, rel=0.001)
+
+
+def test_tempo_halved_relocks():
+    fast = bpm_to_period(120)
+    slow = bpm_to_period(60)
+    follower = started()
+    times = [fast * (i + 1) for i in range(100)]
+    times += [times[-1] + slow * (i + 1) for i in range(50)]
+    feed(follower, times)
+    assert follower.bpm == pytest.approx(60, rel=0.001)
+    # first slow tick is taken for a lost tick, but not the following ones
+    assert follower.next_tick == 151
+
+
+def test_fractional_tick_time():
+    period = bpm_to_period(120)
+    follower = started()
+    feed(follower, (period * (i + 1) for i in range(10)))
+    assert follower.tick_time(9.5) == pytest.approx(period * 10.5, abs=10)
+    assert follower.tick_time(12) == pytest.approx(period * 13, abs=10)
+
+
+def test_song_position_and_transport():
+    events = []
+    follower = ClockFollower(
+        on_start=lambda: events.append("start"),
+        on_stop=lambda: events.append("stop"),
+        on_continue=lambda: events.append("continue"),
+    )
+    follower.receive([START], now=0)
+    assert follower.running and follower.next_tick == 0
+    follower.receive([STOP], now=0)
+    assert not follower.running
+    follower.receive(song_position_message(PPQN * 4), now=0)
+    assert follower.next_tick == PPQN * 4
+    follower.receive([CONTINUE], now=0)
+    assert follower.running and follower.next_tick == PPQN * 4
+    assert events == ["start", "stop", "continue"]
+
+
+def test_song_position_message():
+    assert song_position_message(0) == bytes((SONG_POSITION, 0, 0))
+    # 16th notes, rounded down
+    assert song_position_message(PPQN + 5) == bytes((SONG_POSITION, 4, 0))
+    assert song_position_message(6 * 200) == bytes((SONG_POSITION, 200 & 0x7F, 1))
+
+
+def test_master_resume():
+    written = []
+    master = ClockMaster([written.append])
+    master.resume(0)
+    master.resume(PPQN)
+    master.tick()
+    assert written == [
+        bytes((START,)),
+        song_position_message(PPQN),
+        bytes((CONTINUE,)),
+        bytes((CLOCK,)),
+    ]
+    assert master.ticks == 1
@@ -0,0 +1,77 @@
+import threading
+
+import padKontrol as pk
+from midi_writer import LIGHT_GROUP_KEY, MidiWriter, feedback_key
+
+
+def light(control, state=pk.LIGHT_STATE_ON):
+    return pk.LIGHT_FRAMES[control, state]
+
+
+def test_feedback_key():
+    assert feedback_key(light(3)) == 3
+    assert feedback_key(light(3, pk.LIGHT_STATE_OFF)) == 3
+    assert feedback_key(pk.light_group_frame(0)) == LIGHT_GROUP_KEY
+
+
+def test_feedback_drops_oldest_frame():
+    dropped = []
+    writer = MidiWriter(
+        list.append, list.append, feedback_size=2, on_drop=dropped.append
+    )
+    for control in range(3):
+        writer.send_feedback(light(control))
+    assert [key for key, _ in writer._feedback] == [1, 2]
+    assert dropped == [0]
+    assert writer.drops == 1
+
+
+def test_batch_queued_at_end():
+    writer = MidiWriter(list.append, list.append)
+    assert writer.begin_batch()
+    assert not writer.begin_batch()  # nested call joins the open batch
+    writer.send_data(b"\x90\x24\x64")
+    writer.send_feedback(light(3))
+    assert not writer._data and not writer._feedback
+    assert not writer._wake.is_set()
+    writer.end_batch()
+    assert [message for message, _, _ in writer._data] == [b"\x90\x24\x64"]
+    assert [frame for _, frame in writer._feedback] == [light(3)]
+    assert writer._wake.is_set()
+    assert writer.begin_batch()  # batch can be opened again
+    writer.end_batch()
+
+
+def test_batch_does_not_hold_other_threads():
+    writer = MidiWriter(list.append, list.append)
+    writer.begin_batch()
+    other = threading.Thread(target=writer.send_data, args=(b"\x90\x26\x64",))
+    other.start()
+    other.join()
+    assert not writer.begin_batch()  # held by main thread
+    assert [message for message, _, _ in writer._data] == [b"\x90\x26\x64"]
+    writer.end_batch()
+
+
+def test_writer_flushes_batch_in_one_pass():
+    data, out = [], []
+    writer = MidiWriter(data.append, out.append)
+    writer.start()
+    writer.begin_batch()
+    writer.send_data(b"\x90\x24\x64")
+    writer.send_feedback(light(3))
+    writer.end_batch()
+    writer.stop(1)
+    assert data == [b"\x90\x24\x64"]
+    assert out == [light(3)]
+    assert writer.wakes <= 1
+
+
+def test_write_now_skips_data_lane():
+    data = []
+    writer = MidiWriter(data.append, list.append)
+    writer.send_data(b"\x90\x24\x64")
+    writer.write_now(b"\xf8")  # writer thread is not running
+    assert data == [b"\xf8"]
+    assert len(writer._data) == 1
+    assert not writer._data_lock.locked()
@@ -0,0 +1,118 @@
+import time
+
+import pytest
+
+pytest.importorskip("rtmidi", exc_type=ImportError)
+
+import midi_ports as mp
+from midi_clock import PPQN
+from recorder import SinkPort
+from States.redrum import ReDrumState, Transport
+
+
+@pytest.fixture
+def ports(monkeypatch):
+    """Stand-in ports written directly, restored after test"""
+    for name in ("_midi_in", "_midi_out", "_midi_out_data", "_writer"):
+        monkeypatch.setattr(mp, name, None)
+    monkeypatch.setattr(mp, "_write_out", None)
+    monkeypatch.setattr(mp, "_write_data", None)
+    monkeypatch.setattr(mp, "_close_hooks", [])
+    data = SinkPort("data")
+    mp.install_ports(SinkPort("padKontrol"), data, threaded=False)
+    yield data
+    while mp._close_hooks:
+        mp._close_hooks.pop()()
+
+
+def planned_steps(state, horizon_ns):
+    state.lookahead_ns = horizon_ns  # plan from anchor up to horizon
+    state._restart_clock()
+    state._plan_steps(state._anchor + horizon_ns)
+    return sorted(
+        event.tick
+        for event in state.scheduler._queue
+        if event.message[0] == state.worker
+    )
+
+
+@pytest.mark.parametrize("resolution", [3, 4, 5, 16])
+def test_step_interval(resolution):
+    state = ReDrumState()
+    state.set_tempo(120, resolution)
+    steps = planned_steps(state, 1_000_000_000)
+    step_ns = 60e9 / (120 * resolution)
+    assert len(steps) == pytest.approx(1e9 / step_ns, abs=1)
+    for index, deadline in enumerate(steps):
+        # no rounding of step length to whole ticks, no drift
+        assert deadline - steps[0] == pytest.approx(index * step_ns, abs=1)
+
+
+def test_restart_at_step_cursor():
+    state = ReDrumState()
+    state.set_tempo(120, 5)
+    state.pattern.step = 3
+    state._restart_clock()
+    assert state._step_tick == 3 * PPQN / 5
+    assert state._tick == 15  # first tick at or after step
+
+
+def test_transport(ports):
+    state = ReDrumState()
+    state.load_state()  # starts sequencer thread
+    state.play()
+    time.sleep(0.5)
+    assert ports.messages
+    assert state.timing_stats()["count"] > 0
+
+    state.pause()
+    time.sleep(0.05)
+    assert state.transport == Transport.PAUSED
+    assert state.silence_stats()["count"] == 1
+
+    state.stop()
+    time.sleep(0.05)
+    assert state.pattern.step == 0
+    assert state.silence_stats()["count"] == 1  # already silent
+
+    state.play()
+    time.sleep(0.05)
+    state.shutdown()
+    assert not state.is_alive()
+    assert state.transport == Transport.SHUTDOWN
+    assert state.silence_stats()["count"] == 2
+    state.play()  # no restart after shutdown
+    assert state.transport == Transport.SHUTDOWN
+
+
+def test_engine_process_transport(ports):
+    from sequencer_process import EDIT_CURSOR, EDIT_STEP
+
+    state = ReDrumState()
+    engine = state.run_in_process(backend="loopback_backend")
+    state.load_state()
+    for instrument in state.pattern.instruments:
+        instrument.strokes[0] = 100
+    state.set_tempo(400)
+    state.play()
+    # stats are published while playing, reading them does not pause
+    deadline = time.monotonic() + 5
+    while not state.timing_stats()["count"]:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert engine.playing and not state.paused
+
+    state.pause()
+    time.sleep(0.1)
+    # rewind is kept while edit ring is full and sent with the next publish
+    ring = engine.shared.ring
+    while ring.push(EDIT_STEP, 0):
+        pass
+    state.stop()
+    assert engine._cursor == 0
+    ring.pop_all()  # engine does not read ring while stopped
+    assert engine.publish()
+    assert engine._cursor is None
+    assert ring.pop_all()[-1] == (EDIT_CURSOR, 0)
+    state.shutdown()
+    assert not engine.process.is_alive()
@@ -0,0 +1,109 @@
+import threading
+from multiprocessing import shared_memory
+
+import pytest
+
+pytest.importorskip("rtmidi", exc_type=ImportError)
+
+from scheduler import LatenessStats
+from sequencer_process import (
+    EDIT_CURSOR,
+    EDIT_STEP,
+    SILENCE_COUNT,
+    STATS_COUNT,
+    STATS_SKIPPED,
+    STATS_VERSION,
+    EditRing,
+    SharedSequencer,
+)
+
+
+@pytest.fixture
+def ring():
+    ring = EditRing(bytearray(EditRing.nbytes(4)), 4)
+    yield ring
+    ring.release()
+
+
+def test_push_pop(ring):
+    assert ring.pop_all() == []
+    assert ring.push(EDIT_STEP, 3)
+    assert ring.push(EDIT_CURSOR, 7)
+    assert len(ring) == 2
+    assert ring.pop_all() == [(EDIT_STEP, 3), (EDIT_CURSOR, 7)]
+    assert len(ring) == 0
+
+
+def test_full_ring(ring):
+    for step in range(4):
+        assert ring.push(EDIT_STEP, step)
+    assert not ring.push(EDIT_STEP, 4)
+    assert ring.pop_all() == [(EDIT_STEP, step) for step in range(4)]
+    assert ring.push(EDIT_STEP, 4)
+
+
+def test_wraparound(ring):
+    popped = []
+    for step in range(11):
+        assert ring.push(EDIT_STEP, step)
+        if step % 3 == 2:
+            popped += ring.pop_all()
+    popped += ring.pop_all()
+    assert popped == [(EDIT_STEP, step) for step in range(11)]
+
+
+def test_ring_shared_between_views():
+    buffer = bytearray(EditRing.nbytes(8))
+    producer = EditRing(buffer, 8)
+    consumer = EditRing(buffer, 8)
+    producer.push(EDIT_STEP, 5)
+    assert consumer.pop_all() == [(EDIT_STEP, 5)]
+    assert len(producer) == 0
+    producer.release()
+    consumer.release()
+
+
+@pytest.fixture
+def shared():
+    memory = shared_memory.SharedMemory(
+        create=True, size=SharedSequencer.nbytes(4, 16, ring_size=16)
+    )
+    shared = SharedSequencer(memory, 4, 16, ring_size=16)
+    yield shared
+    shared.release()
+    memory.close()
+    memory.unlink()
+
+
+def lateness(*values):
+    stats = LatenessStats()
+    for value in values:
+        stats.add(value)
+    return stats
+
+
+def test_stats_round_trip(shared):
+    published = lateness(1000, 3000, 2000)
+    shared.put_stats(published, skipped=2)
+    assert shared.header[STATS_VERSION] == 2
+    stats, skipped = shared.get_stats(STATS_COUNT)
+    assert stats.summary() == published.summary()
+    assert skipped == 2
+    # silence stats use separate slots
+    assert shared.get_stats(SILENCE_COUNT)[0].count == 0
+    shared.put_silence(lateness(500))
+    assert shared.get_stats(SILENCE_COUNT)[0].summary() == lateness(500).summary()
+    assert shared.get_stats(STATS_COUNT)[0].count == 3
+    assert shared.header[STATS_VERSION] == 4
+
+
+def test_stats_not_read_during_update(shared):
+    shared.put_stats(lateness(1000))
+    shared.header[STATS_VERSION] += 1  # engine writing
+    reader = threading.Thread(target=shared.get_stats, args=(STATS_COUNT,))
+    reader.start()
+    reader.join(0.05)
+    assert reader.is_alive()
+    shared.header[STATS_VERSION] += 1
+    reader.join(1)
+    assert not reader.is_alive()
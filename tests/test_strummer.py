@@ -0,0 +1,51 @@
+import time
+
+import pytest
+
+pytest.importorskip("rtmidi", exc_type=ImportError)
+
+import midi_ports as mp
+from States.strummer import StrumEngine
+
+
+@pytest.fixture
+def written(monkeypatch):
+    """Messages written to data port"""
+    messages = []
+    monkeypatch.setattr(mp, "_writer", None)
+    monkeypatch.setattr(mp, "_write_data", messages.append)
+    return messages
+
+
+def wait_for(condition, timeout=1.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def test_strike_and_release_all_strings(written):
+    engine = StrumEngine(0, 16, sustain_ns=10_000_000_000)
+    notes = list(range(40, 56))
+    engine.strike(range(16), notes, 100, 0)
+    wait_for(lambda: len(written) == 16)
+    assert sorted(message[1] for message in written) == notes
+    assert list(engine._sounding) == notes
+
+    del written[:]
+    engine.release_all()
+    assert sorted(message[1] for message in written) == notes
+    assert all(message[0] == 0x80 and message[2] == 0 for message in written)
+    assert list(engine._sounding) == [-1] * 16
+
+    del written[:]
+    engine.release_all()  # nothing sounding
+    assert written == []
+
+
+def test_release_all_cancels_pending_strikes(written):
+    engine = StrumEngine(0, 16, sustain_ns=10_000_000_000)
+    engine.strike(range(8, 16), list(range(40, 56)), 100, 50_000_000)
+    engine.release_all()
+    time.sleep(0.5)
+    assert written == []
@@ -1,4 +1,5 @@
 import asyncio
+from array import array
 from math import ceil
 from itertools import accumulate, cycle, islice
 from collections import deque
@@ -118,6 +119,54 @@ def scale_to_16(scale, mode=0, base=0, length=16):
     return res_acc
 
 
+def pad_note_table(steps, order, bases=164):
+    """Precompute midi notes of pads for every base note
+
+    Arguments:
+        steps {list} -- distance of consecutive scale notes from base note
+            (see `scale_to_16`)
+        order {list} -- scale step of each pad
+
+    Keyword Arguments:
+        bases {int} -- number of base notes, starting from 0 (default: {164})
+
+    Returns:
+        array -- signed bytes, note of pad `p` for base note `b` at index
+            `b * len(order) + p`, -1 for notes out of midi range
+    """
+    table = array("b", [-1]) * (bases * len(order))
+    for base in range(bases):
+        offset = base * len(order)
+        for pad, step in enumerate(order):
+            note = base + steps[step]
+            if 0 <= note <= 127:
+                table[offset + pad] = note
+    return table
+
+
+def zone_table(points, tolerance, size=128):
+    """Precompute index of point within tolerance of every value
+
+    Arguments:
+        points {list} -- zone centers (see `pad_intervals`)
+        tolerance {int} -- max distance from zone center
+
+    Keyword Arguments:
+        size {int} -- number of values, starting from 0 (default: {128})
+
+    Returns:
+        array -- signed bytes, index of first point close to value,
+            -1 for values out of all zones
+    """
+    table = array("b", [-1]) * size
+    for idx in reversed(range(len(points))):
+        low = max(0, points[idx] - tolerance)
+        high = min(size - 1, points[idx] + tolerance)
+        for value in range(low, high + 1):
+            table[value] = idx
+    return table
+
+
 def pad_intervals(parts, duration=128):
     """split midi 0-127 values range in equal parts
 